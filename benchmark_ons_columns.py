@@ -0,0 +1,68 @@
+# Time the column clean-ups in utils/ons_columns.py against the per-row lambdas and list
+# comprehensions they replace, on synthetic columns shaped like the nomis and ONS downloads:
+#   python benchmark_ons_columns.py [--rows 1000000] [--repeat 3]
+# Each pair is also checked to give the same values.
+
+import re
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from utils.ons_columns import split_code_name, extract_year, parse_percentile, replace_markers, snake_case
+
+parser = argparse.ArgumentParser(description='Benchmark per-row lambdas against utils.ons_columns.')
+parser.add_argument('--rows', type=int, default=1000000, help='rows in each column (default: 1000000)')
+parser.add_argument('--repeat', type=int, default=3, help='runs of each method; the best time is shown (default: 3)')
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+codes = ['E{:08d}'.format(x) for x in range(400)]
+geography = pd.Series(['{}: Area {}'.format(codes[x], x) for x in rng.integers(0, 400, args.rows)])
+periods = pd.Series(rng.choice(['Jan 2019-Dec 2019', 'Apr 2020-Mar 2021', '2021-22', '2022'], args.rows))
+percentiles = pd.Series(rng.choice(['10 percentile', '25 percentile', 'Median', '75 percentile', '90 percentile'], args.rows))
+values = pd.Series(np.where(rng.random(args.rows) < 0.1, rng.choice([':', '[x]'], args.rows),
+                            rng.integers(0, 10000, args.rows).astype(str)))
+headers = ['SIC07 industry code', ' ITL3 name ', 'Gross value added'] * 100
+
+
+def markers_lambda(series):
+    return series.apply(lambda x: np.nan if x in [':', '[x]'] else float(x))
+
+
+cases = [
+    ('split_code_name', geography,
+     lambda s: pd.DataFrame({'code': s.apply(lambda x: x.split(':')[0].strip()),
+                             'name': s.apply(lambda x: x.split(':', 1)[1].strip())}),
+     lambda s: split_code_name(s)),
+    ('extract_year', periods, lambda s: s.apply(lambda x: int(re.findall('[0-9]{4}', x)[0])), extract_year),
+    ('parse_percentile', percentiles,
+     lambda s: s.apply(lambda x: re.sub('Median', '50 percentile', x)).apply(lambda x: int(x[:2])), parse_percentile),
+    ('replace_markers', values, markers_lambda, lambda s: replace_markers(s, [':', '[x]'])),
+    ('snake_case', headers, lambda c: [re.sub(' ', '_', x.strip().lower()) for x in c], snake_case),
+]
+
+
+def best_time(method, data):
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        out = method(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+
+def same(a, b):
+    if isinstance(a, pd.DataFrame):
+        return all(same(a[col], b[col]) for col in a.columns)
+    a, b = pd.Series(list(a), dtype=object), pd.Series(list(b), dtype=object)
+    return bool(((a == b) | (a.isna() & b.isna())).all())
+
+
+print('{} rows'.format(args.rows))
+print('{:<18}{:>12}{:>14}{:>10}{:>8}'.format('clean-up', 'lambda (s)', 'toolkit (s)', 'speed-up', 'same'))
+for name, data, before, after in cases:
+    t_before, out_before = best_time(before, data)
+    t_after, out_after = best_time(after, data)
+    print('{:<18}{:>12.3f}{:>14.3f}{:>9.1f}x{:>8}'.format(name, t_before, t_after, t_before / t_after,
+                                                           str(same(out_before, out_after))))
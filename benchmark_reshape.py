@@ -0,0 +1,73 @@
+# Time and peak memory of the wide-to-long reshapes, on a synthetic sheet shaped like the
+# regional GFCF tables (a few id columns and a column per year) or, with --multi, like COR A1
+# (a two-row header of sub-sector and asset):
+#   python benchmark_reshape.py [--rows 4000] [--cols 400] [--multi] [--repeat 3]
+# compares pd.melt, set_index + stack (the ways it was done before) and utils.reshape.wide_to_long.
+
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+from utils.reshape import wide_to_long
+
+parser = argparse.ArgumentParser(description='Benchmark pd.melt and stack against wide_to_long.')
+parser.add_argument('--rows', type=int, default=4000, help='rows in the wide sheet (default: 4000)')
+parser.add_argument('--cols', type=int, default=400, help='value columns in the wide sheet (default: 400)')
+parser.add_argument('--multi', action='store_true', help='use a two-row (sub-sector, asset) header')
+parser.add_argument('--repeat', type=int, default=3, help='runs of each method; the best time is shown (default: 3)')
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+id_vars = ['Asset', 'ITL3 code', 'ITL3 name', 'SIC07 industry code']
+ids = pd.DataFrame({'Asset': rng.choice(['Buildings', 'ICT', 'Machinery', 'Intangibles'], args.rows),
+                    'ITL3 code': ['TL{:04d}'.format(x) for x in rng.integers(0, 180, args.rows)],
+                    'ITL3 name': ['Area {}'.format(x) for x in rng.integers(0, 180, args.rows)],
+                    'SIC07 industry code': rng.choice(list('ABCDEFGHIJKLMNOPQRS'), args.rows)})
+values = pd.DataFrame(rng.random((args.rows, args.cols)))
+values.iloc[rng.random((args.rows, args.cols)) < 0.05] = np.nan
+if args.multi:
+    columns = [('Sector {}'.format(i // 10), 'Asset {}'.format(i % 10)) for i in range(args.cols)]
+    ids.columns = pd.MultiIndex.from_tuples([('', x) for x in id_vars])
+    values.columns = pd.MultiIndex.from_tuples(columns)
+    id_vars = list(ids.columns)
+    var_name = ['Sub-sector', 'Asset']
+else:
+    values.columns = [str(1997 + i) for i in range(args.cols)]
+    var_name = 'Year'
+wide = pd.concat([ids, values], axis=1)
+
+
+def melt(df):
+    return pd.melt(df, id_vars=id_vars, var_name=var_name, value_name='value')
+
+
+def stack(df):
+    levels = list(range(len(var_name))) if args.multi else 0
+    return df.set_index(id_vars).rename_axis(columns=var_name).stack(levels, future_stack=True).rename('value').reset_index()
+
+
+def reshape(df):
+    return wide_to_long(df, id_vars=id_vars, var_name=var_name, value_name='value')
+
+
+def measure(method):
+    # the timings and the memory come from separate runs, as tracemalloc slows down allocation
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        out = method(wide)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    method(wide)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, out.memory_usage(deep=True).sum(), len(out)
+
+print('{} x {} wide sheet ({} header), {:.1f} MB'.format(args.rows, args.cols, 'two-row' if args.multi else 'one-row',
+                                                        wide.memory_usage(deep=True).sum() / 1e6))
+print('{:<14}{:>10}{:>16}{:>14}{:>12}'.format('method', 'time (s)', 'peak mem (MB)', 'result (MB)', 'rows'))
+for name, method in [('pd.melt', melt), ('stack', stack), ('wide_to_long', reshape)]:
+    elapsed, peak, size, rows = measure(method)
+    print('{:<14}{:>10.3f}{:>16.1f}{:>14.1f}{:>12}'.format(name, elapsed, peak / 1e6, size / 1e6, rows))
@@ -5,16 +5,19 @@ import pandas as pd
 import psycopg2
 import psycopg2.extras as extras
 import os
-import datetime
 
 from utils.db_config import config
+from utils.schema import apply_schema
+from utils.load_manifest import BATCH_ID_COLUMN, create_manifest_table, start_batch, finish_batch, migrate_legacy_tables
 
 def execute_values(df, table, con):
     """
-    Using psycopg2.extras.execute_values() to insert the dataframe
+    Using psycopg2.extras.execute_values() to insert the dataframe.
+    On failure the insert is rolled back and the error re-raised, so a failed load stops the
+    run (and a staged refresh is never published) rather than carrying on with a missing table.
     """
     # Create a list of tuples from the dataframe values
-    tuples = [tuple(x) for x in df.to_numpy()]
+    tuples = list(df.itertuples(index=False, name=None))
     # Comma-separated dataframe columns
     cols = ','.join(list(df.columns))
     # SQL quert to execute
@@ -24,10 +27,10 @@ def execute_values(df, table, con):
         extras.execute_values(cur, query, tuples)
         con.commit()
     except (Exception, psycopg2.DatabaseError) as error:
-        print("Error: %s" % error)
+        print("Error loading %s: %s" % (table, error))
         con.rollback()
         cur.close()
-        return 1
+        raise
     print("execute_values() done")
     cur.close()
 
@@ -44,55 +47,45 @@ data_folder = 'data downloads'
 ###############################
 
 lad_mappings = pd.read_csv(os.path.join(data_folder, 'local_authority_boundaries', 'LA_mappings.csv'), index_col=None)
-sql_string = ', '.join([x+' VARCHAR' for x in lad_mappings.columns])
 parent_script = 'database_uploader.py'
 
 # get the connection parameters
 params = config(filename='geoproj_aws_db.ini')
 
-# create a table
+# create a table, with column types inferred from the data
 with psycopg2.connect(**params) as con:
-    cur = con.cursor()
-    # execute a create table query and commit it
-    cur.execute("""CREATE TABLE IF NOT EXISTS lad_mappings (
-                {},
-                created timestamptz,
-                parent_script VARCHAR
-                )""".format(sql_string))
-    cur.close()
-    con.commit()
+    create_manifest_table(con)
+    # move tables loaded before the manifest existed to batch ids
+    migrate_legacy_tables(con)
+    apply_schema(con, lad_mappings, 'lad_mappings', extra_columns=[BATCH_ID_COLUMN])
+    # register the load in the manifest
+    batch_id = start_batch(con, 'lad_mappings', parent_script, source_files=[os.path.join(data_folder, 'local_authority_boundaries', 'LA_mappings.csv')])
 
 # add the metadata
-lad_mappings['created'] = datetime.datetime.now()
-lad_mappings['parent_script'] = parent_script
+lad_mappings['batch_id'] = batch_id
 
 # upload the data
 with psycopg2.connect(**params) as con:
     execute_values(df=lad_mappings, table='lad_mappings', con=con)
+    finish_batch(con, batch_id, row_counts={'lad_mappings': len(lad_mappings)})
 
 ### now do the LAD lookup
 ###############################
 
 lad_multiyear_lookup = pd.read_csv(os.path.join(data_folder, 'local_authority_boundaries', 'lad_multiyear_lookup.csv'), index_col=None)
-sql_string = ', '.join([x+' VARCHAR' for x in lad_multiyear_lookup.columns])
 parent_script = 'database_uploader.py'
 
-# create a table
+# create a table, with column types inferred from the data
 with psycopg2.connect(**params) as con:
-    cur = con.cursor()
-    # execute a create table query and commit it
-    cur.execute("""CREATE TABLE IF NOT EXISTS lad_multiyear_lookup (
-                {},
-                created timestamptz,
-                parent_script VARCHAR
-                )""".format(sql_string))
-    cur.close()
-    con.commit()
+    create_manifest_table(con)
+    apply_schema(con, lad_multiyear_lookup, 'lad_multiyear_lookup', extra_columns=[BATCH_ID_COLUMN])
+    # register the load in the manifest
+    batch_id = start_batch(con, 'lad_multiyear_lookup', parent_script, source_files=[os.path.join(data_folder, 'local_authority_boundaries', 'lad_multiyear_lookup.csv')])
 
 # add the metadata
-lad_multiyear_lookup['created'] = datetime.datetime.now()
-lad_multiyear_lookup['parent_script'] = parent_script
+lad_multiyear_lookup['batch_id'] = batch_id
 
 # upload the data
 with psycopg2.connect(**params) as con:
     execute_values(df=lad_multiyear_lookup, table='lad_multiyear_lookup', con=con)
+    finish_batch(con, batch_id, row_counts={'lad_multiyear_lookup': len(lad_multiyear_lookup)})
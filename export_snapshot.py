@@ -0,0 +1,21 @@
+# Export an offline snapshot of the database (see utils/snapshot.py) for local analysis.
+# Run it again to bring the snapshot up to date: only the partitions that have been reloaded
+# since the last run are rewritten.
+#   python export_snapshot.py [folder] [--duckdb snapshot.duckdb]
+
+import argparse
+import psycopg2
+from utils.db_config import config
+from utils.snapshot import export_snapshot, export_duckdb
+
+parser = argparse.ArgumentParser(description='Export the database to a Hive-partitioned Parquet folder (and optionally a DuckDB file).')
+parser.add_argument('folder', nargs='?', default='snapshot', help='the snapshot folder (default: snapshot)')
+parser.add_argument('--duckdb', help='also copy the snapshot into this DuckDB file')
+parser.add_argument('--tables', nargs='+', help='only these tables (default: every table and _named view)')
+args = parser.parse_args()
+
+params = config(filename='geoproj_aws_db.ini')
+with psycopg2.connect(**params) as con:
+    written = export_snapshot(con, args.folder, tables=args.tables)
+if args.duckdb:
+    export_duckdb(args.folder, args.duckdb, written=written)
@@ -282,24 +282,24 @@ def build_lad_mappers():
     combo = pd.concat([persistent, changes_11_17], axis=0)
     # Next, merge in the changes from 2017 to 2018. This again keeps a full set, but it also leaves a lot of NA, which I now need to right fill.
     combo = combo.merge(changes_17_18, how='left')
-    combo['LAD18CD'] = combo.apply(lambda x: x['LAD18CD'] if pd.notna(x['LAD18CD']) else x['LAD17CD'], axis=1)
-    combo['LAD18NM'] = combo.apply(lambda x: x['LAD18NM'] if pd.notna(x['LAD18NM']) else x['LAD17NM'], axis=1)
+    combo['LAD18CD'] = combo['LAD18CD'].fillna(combo['LAD17CD'])
+    combo['LAD18NM'] = combo['LAD18NM'].fillna(combo['LAD17NM'])
     # Now repeat for the changes from 2018 to 2019
     combo = combo.merge(changes_18_19, how='left')
-    combo['LAD19CD'] = combo.apply(lambda x: x['LAD19CD'] if pd.notna(x['LAD19CD']) else x['LAD18CD'], axis=1)
-    combo['LAD19NM'] = combo.apply(lambda x: x['LAD19NM'] if pd.notna(x['LAD19NM']) else x['LAD18NM'], axis=1)
+    combo['LAD19CD'] = combo['LAD19CD'].fillna(combo['LAD18CD'])
+    combo['LAD19NM'] = combo['LAD19NM'].fillna(combo['LAD18NM'])
     # Now repeat for the changes from 2019 to 2020
     combo = combo.merge(changes_19_20, how='left')
-    combo['LAD20CD'] = combo.apply(lambda x: x['LAD20CD'] if pd.notna(x['LAD20CD']) else x['LAD19CD'], axis=1)
-    combo['LAD20NM'] = combo.apply(lambda x: x['LAD20NM'] if pd.notna(x['LAD20NM']) else x['LAD19NM'], axis=1)
+    combo['LAD20CD'] = combo['LAD20CD'].fillna(combo['LAD19CD'])
+    combo['LAD20NM'] = combo['LAD20NM'].fillna(combo['LAD19NM'])
     # Now repeat for the changes from 2020 to 2021
     combo = combo.merge(changes_20_21, how='left')
-    combo['LAD21CD'] = combo.apply(lambda x: x['LAD21CD'] if pd.notna(x['LAD21CD']) else x['LAD20CD'], axis=1)
-    combo['LAD21NM'] = combo.apply(lambda x: x['LAD21NM'] if pd.notna(x['LAD21NM']) else x['LAD20NM'], axis=1)
+    combo['LAD21CD'] = combo['LAD21CD'].fillna(combo['LAD20CD'])
+    combo['LAD21NM'] = combo['LAD21NM'].fillna(combo['LAD20NM'])
     # Now repeat for the changes from 2021 to 2023
     combo = combo.merge(changes_21_23, how='left')
-    combo['LAD23CD'] = combo.apply(lambda x: x['LAD23CD'] if pd.notna(x['LAD23CD']) else x['LAD21CD'], axis=1)
-    combo['LAD23NM'] = combo.apply(lambda x: x['LAD23NM'] if pd.notna(x['LAD23NM']) else x['LAD21NM'], axis=1)
+    combo['LAD23CD'] = combo['LAD23CD'].fillna(combo['LAD21CD'])
+    combo['LAD23NM'] = combo['LAD23NM'].fillna(combo['LAD21NM'])
 
 
 
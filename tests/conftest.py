@@ -0,0 +1,32 @@
+# Database tests run against a throwaway local Postgres from pgserver (pip install pgserver), and
+# are skipped where it isn't installed. Each test gets a fresh, empty database.
+
+import os
+import sys
+import uuid
+import tempfile
+import pytest
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def pg_server():
+    pgserver = pytest.importorskip('pgserver')
+    server = pgserver.get_server(tempfile.mkdtemp())
+    yield psycopg2.extensions.parse_dsn(server.get_uri())
+    server.cleanup()
+
+
+@pytest.fixture
+def params(pg_server):
+    '''Connection parameters (like utils.db_config.config's) for a new, empty database.'''
+    name = 'test_{}'.format(uuid.uuid4().hex[:12])
+    con = psycopg2.connect(**pg_server)
+    con.autocommit = True
+    con.cursor().execute('CREATE DATABASE {}'.format(name))
+    con.close()
+    out = dict(pg_server)
+    out['dbname'] = name
+    return out
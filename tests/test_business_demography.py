@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+from utils.business_demography import annual_totals, legacy_layouts, OUTPUT_COLUMNS
+
+
+def quarterly_table():
+    rows = []
+    for code, name in [('E06000002', 'Middlesbrough'), ('E06000001', 'Hartlepool')]:
+        for measure in ['births', 'deaths']:
+            for year in [2019, 2020]:
+                for q in range(1, 5):
+                    rows.append([code, name, '{}Q{}'.format(year, q), measure, float(q), 0])
+        for year in [2019, 2020]:
+            rows.append([code, name, str(year), 'stock', 100.0, 0])
+    df = pd.DataFrame(rows, columns=OUTPUT_COLUMNS)
+    # a missing quarter: no 2020 total
+    df.loc[(df['geog_code'] == 'E06000001') & (df['period'] == '2020Q4'), 'value'] = np.nan
+    return pd.concat([df, annual_totals(df[df['measure'] != 'stock'])], ignore_index=True)
+
+
+def test_legacy_layouts():
+    company_births, company_demographics = legacy_layouts(quarterly_table())
+    births = company_demographics['births']
+    assert list(births.columns) == ['Geography', 'geog code', 'geog name'] + \
+        ['Q{} {}'.format(q, y) for y in [2019, 2020] for q in range(1, 5)] + [2019, 2020]
+    # the areas stay in the order they came in
+    assert list(births['Geography']) == ['E06000002: Middlesbrough', 'E06000001: Hartlepool']
+    assert births[2019].tolist() == [10.0, 10.0]
+    assert births[2020].isna().tolist() == [False, True]
+    assert list(company_demographics['stocks'].columns) == ['Geog code', 'Geog name', '2019', '2020']
+    assert set(company_births) == {'Births 2017-2019', 'Births 2020', 'Births 2021', 'Births 2022-2023',
+                                   'Deaths 2017-2019', 'Deaths 2020', 'Deaths 2021', 'Deaths 2022-2023'}
+    assert list(company_births['Deaths 2020'].columns) == ['Geography', 'Q1 2020', 'Q2 2020', 'Q3 2020', 'Q4 2020',
+                                                           'geog code', 'geog name']
+    assert list(company_births['Births 2021'].columns) == ['Geography', 'geog code', 'geog name']
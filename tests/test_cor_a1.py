@@ -0,0 +1,22 @@
+import pandas as pd
+import pytest
+from utils.cor_a1 import grid_to_long
+
+# a 'two-row' sheet: sectors, then sub-sectors, then assets with the id columns
+GRID = [[None, None, 'Education', None, None, None],
+        [None, None, 'Primary', None, 'Secondary', None],
+        ['ONS Code', 'Name', 'Land', 'Buildings', 'Land', 'Buildings'],
+        ['E06000001', 'Hartlepool', '1', ':', '3', '4'],
+        ['Note', None, None, None, None, None]]
+
+
+def test_sectors_from_the_sector_row():
+    df = grid_to_long(pd.DataFrame(GRID, dtype=object), 2019)
+    assert list(df['Sector']) == ['Education'] * 4
+    assert list(df['Sub-sector']) == ['Primary', 'Primary', 'Secondary', 'Secondary']
+    assert df['value'].isna().tolist() == [False, True, False, False]
+
+
+def test_no_sector_row():
+    with pytest.raises(ValueError, match='No broad sector row'):
+        grid_to_long(pd.DataFrame(GRID[1:], dtype=object), 2019)
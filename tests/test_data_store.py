@@ -0,0 +1,34 @@
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+from utils.data_store import DataStore
+
+FRAME = pd.DataFrame({'lad21cd': ['E06000001', 'E06000002'], 'population': [93000, 143000]})
+
+
+def test_reassign_to_the_same_key(tmp_path):
+    store = DataStore(str(tmp_path / 'store'))
+    store['population'] = FRAME
+    store['nested'] = {'totals_by_lad': FRAME, 'notes': ['a', 'b']}
+    store['population'] = store['population']
+    store['nested'] = store['nested']
+    store = DataStore(str(tmp_path / 'store'))
+    pd.testing.assert_frame_equal(store['population'], FRAME)
+    pd.testing.assert_frame_equal(store['nested']['totals_by_lad'], FRAME)
+    assert store['nested']['notes'] == ['a', 'b']
+    # and the old files are gone
+    assert sorted(os.listdir(tmp_path / 'store')) == sorted(['index.json', store._index['population']['file'],
+                                                            store._index['nested']['file']])
+
+
+def test_failed_write_keeps_the_old_value(tmp_path):
+    store = DataStore(str(tmp_path / 'store'))
+    store['population'] = FRAME
+    with pytest.raises(Exception):
+        # a lambda can't be pickled
+        store['population'] = {'totals_by_lad': FRAME, 'bad': lambda x: x}
+    store = DataStore(str(tmp_path / 'store'))
+    pd.testing.assert_frame_equal(store['population'], FRAME)
+    assert sorted(os.listdir(tmp_path / 'store')) == ['index.json', store._index['population']['file']]
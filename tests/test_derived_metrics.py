@@ -0,0 +1,80 @@
+import pytest
+import psycopg2
+from utils.derived_metrics import create_derived_table, refresh_derived_table, refresh_for_table, table_exists
+from utils.geography_dimension import register_geographies
+from utils.schema_swap import start_refresh, staged_params, STAGING_SCHEMA, LIVE_SCHEMA
+
+TABLES = '''
+CREATE TABLE itl3_gfcf_values (itl321_id INTEGER, year INT, asset VARCHAR,
+    sic07_industry_code VARCHAR, sic07_industry_name VARCHAR, value FLOAT,
+    PRIMARY KEY (itl321_id, year, sic07_industry_code, asset));
+CREATE TABLE population_itl3 (itl321_id INTEGER, year INT, population BIGINT, PRIMARY KEY (itl321_id, year));
+CREATE TABLE employment_lfs_itl3 (itl321_id INTEGER, year INT, employment BIGINT, PRIMARY KEY (itl321_id, year));
+INSERT INTO itl3_gfcf_values VALUES (%(a)s, 2020, 'ICT', 'A', 'Farming', 10), (%(a)s, 2021, 'ICT', 'A', 'Farming', 20),
+                                    (%(b)s, 2021, 'ICT', 'A', 'Farming', 30);
+INSERT INTO population_itl3 VALUES (%(a)s, 2020, 100), (%(a)s, 2021, 100), (%(b)s, 2021, 100);
+INSERT INTO employment_lfs_itl3 VALUES (%(a)s, 2020, 50), (%(a)s, 2021, 50), (%(b)s, 2021, 50);
+'''
+
+
+def _load(con):
+    ids = register_geographies(con, ['TLC31', 'TLC32'], names=['Hartlepool', 'Stockton'], entity='itl3', vintage=2021)
+    con.cursor().execute(TABLES, {'a': int(ids['TLC31']), 'b': int(ids['TLC32'])})
+    con.commit()
+
+
+def _per_head(con, table, code='TLC31'):
+    cur = con.cursor()
+    cur.execute('SELECT year, value_per_head FROM {}_named WHERE itl321cd = %s ORDER BY year'.format(table), (code,))
+    return cur.fetchall()
+
+
+def test_named_view_and_refresh_by_code(params):
+    with psycopg2.connect(**params) as con:
+        _load(con)
+        create_derived_table(con, 'itl3_gfcf')
+        refresh_derived_table(con, 'itl3_gfcf')
+        cur = con.cursor()
+        cur.execute("SELECT itl321cd, itl321nm, year, value_per_job FROM itl3_gfcf_named WHERE itl321cd = 'TLC32'")
+        assert cur.fetchall() == [('TLC32', 'Stockton', 2021, 600000.0)]
+        # a revised denominator for one geography, given by its code, only refreshes that geography
+        cur.execute('UPDATE population_itl3 SET population = 200')
+        con.commit()
+        refresh_derived_table(con, 'itl3_gfcf', geos=['TLC32'])
+        assert _per_head(con, 'itl3_gfcf', 'TLC32') == [(2021, 150000.0)]
+        assert _per_head(con, 'itl3_gfcf') == [(2020, 100000.0), (2021, 200000.0)]
+
+
+def test_staged_denominator_refreshes_live_derived_table(params):
+    with psycopg2.connect(**params) as con:
+        _load(con)
+        create_derived_table(con, 'itl3_gfcf')
+        refresh_derived_table(con, 'itl3_gfcf')
+        assert _per_head(con, 'itl3_gfcf') == [(2020, 100000.0), (2021, 200000.0)]
+        start_refresh(con)
+
+    # a staged population run reloads population_itl3 with revised 2021 figures
+    with psycopg2.connect(**staged_params(params)) as con:
+        cur = con.cursor()
+        cur.execute('CREATE TABLE population_itl3 (itl321_id INTEGER, year INT, population BIGINT, PRIMARY KEY (itl321_id, year))')
+        cur.execute("""INSERT INTO population_itl3 SELECT geo_id, year, population
+                       FROM (VALUES (2020, 100), (2021, 200)) v (year, population), public.geographies WHERE code = 'TLC31'""")
+        con.commit()
+        assert not table_exists(con, 'itl3_gfcf')
+        assert table_exists(con, 'itl3_gfcf', search_path=True)
+        refresh_for_table(con, 'population_itl3', years=[2021])
+        # rebuilt in full in staging, with the new denominator; the live table is untouched
+        assert _per_head(con, '{}.itl3_gfcf'.format(STAGING_SCHEMA)) == [(2020, 100000.0), (2021, 100000.0)]
+        assert _per_head(con, '{}.itl3_gfcf'.format(LIVE_SCHEMA)) == [(2020, 100000.0), (2021, 200000.0)]
+
+
+def test_failed_refresh_raises_and_keeps_the_old_rows(params):
+    with psycopg2.connect(**params) as con:
+        _load(con)
+        create_derived_table(con, 'itl3_gfcf')
+        refresh_derived_table(con, 'itl3_gfcf')
+        con.cursor().execute('DROP TABLE employment_lfs_itl3')
+        con.commit()
+        with pytest.raises(psycopg2.DatabaseError):
+            refresh_derived_table(con, 'itl3_gfcf', years=[2021])
+        assert _per_head(con, 'itl3_gfcf') == [(2020, 100000.0), (2021, 200000.0)]
@@ -0,0 +1,52 @@
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip('scipy')
+from utils.geography_rollup import GeographyRollup
+
+# S is split between T2 (which also has C) and T3 (S alone), both in U2; N is in Northern Ireland
+LOOKUP = pd.DataFrame({'LAD21CD': ['A', 'B', 'C', 'S', 'S', 'N'], 'LAU121CD': ['a', 'b', 'c', 's1', 's2', 'n'],
+                       'ITL321CD': ['T1', 'T1', 'T2', 'T2', 'T3', 'T4'], 'ITL321NM': ['t1', 't1', 't2', 't2', 't3', 't4'],
+                       'ITL221CD': ['U1', 'U1', 'U2', 'U2', 'U2', 'U3'], 'ITL221NM': ['u1', 'u1', 'u2', 'u2', 'u2', 'u3'],
+                       'ITL121CD': ['V1', 'V1', 'V1', 'V1', 'V1', 'V2'], 'ITL121NM': ['v1', 'v1', 'v1', 'v1', 'v1', 'v2']})
+GB = pd.DataFrame({'lad21cd': ['A', 'B', 'C', 'S', 'A'], 'year': [2020, 2020, 2020, 2020, 2021],
+                   'population': [1.0, 2.0, 4.0, 10.0, 5.0]})
+# the lookup the lookups block reads, if it's been downloaded
+LOOKUP_FILEPATH = os.path.join('data downloads', 'local_authority_boundaries', 'LAD21_LAU121_ITL321_ITL221_ITL121_UK_LU.xlsx')
+
+
+def _values(out, cd):
+    return {(x[cd], x['year']): x['population'] for x in out.to_dict('records')}
+
+
+def test_split_lads_without_weights():
+    values = _values(GeographyRollup(LOOKUP).rollup(GB, 'population', 'itl3'), 'itl321cd')
+    # T2 is rolled up from C alone, and T3 (only part of S) can't be, but neither is lost
+    assert values[('T1', 2020)] == 3.0 and values[('T2', 2020)] == 4.0
+    assert ('T3', 2020) in values and pd.isna(values[('T3', 2020)])
+    # S is wholly in U2
+    assert _values(GeographyRollup(LOOKUP).rollup(GB, 'population', 'itl2'), 'itl221cd')[('U2', 2020)] == 14.0
+
+
+def test_split_lads_weighted():
+    rollup = GeographyRollup(LOOKUP, lau_weights=pd.Series({'s1': 3, 's2': 1}))
+    values = _values(rollup.rollup(GB, 'population', 'itl3'), 'itl321cd')
+    assert values[('T1', 2020)] == 3.0 and values[('T2', 2020)] == 11.5 and values[('T3', 2020)] == 2.5
+
+
+def test_parents_without_data_left_out():
+    out = GeographyRollup(LOOKUP).rollup(GB, 'population', 'itl1')
+    # V2 (NI) has no LADs in the data, and V1 in 2021 only has A, so it's NaN
+    assert list(zip(out['itl121cd'], out['year'])) == [('V1', 2020), ('V1', 2021)]
+    assert out['population'].isna().tolist() == [False, True]
+
+
+@pytest.mark.skipif(not os.path.isfile(LOOKUP_FILEPATH), reason='the LAD21 to ITL lookup has not been downloaded')
+def test_no_itl3_lost_with_the_real_lookup():
+    lookup = pd.read_excel(LOOKUP_FILEPATH, sheet_name='LAD21_LAU121_ITL21_UK_LU', engine='openpyxl')
+    rollup = GeographyRollup(lookup)
+    df = pd.DataFrame({'lad21cd': lookup['LAD21CD'].unique(), 'year': 2020, 'population': 1.0})
+    for level, column in [('itl3', 'ITL321CD'), ('itl2', 'ITL221CD'), ('itl1', 'ITL121CD')]:
+        cd = column.lower()
+        assert set(rollup.rollup(df, 'population', level)[cd]) == set(lookup[column])
@@ -0,0 +1,32 @@
+import psycopg2
+from utils.indexes import build_indexes, drop_indexes
+from utils.schema_swap import start_refresh, staged_params, STAGING_SCHEMA
+
+CREATE = 'CREATE TABLE pcode_lookup (pcds VARCHAR PRIMARY KEY, lad21_id INTEGER, lsoa21_id INTEGER)'
+
+
+def _indexes(con, schema):
+    cur = con.cursor()
+    cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = %s AND tablename = 'pcode_lookup' ORDER BY indexname", (schema,))
+    return [x[0] for x in cur.fetchall()]
+
+
+def test_drop_indexes_leaves_live_table_alone_in_staged_refresh(params):
+    with psycopg2.connect(**params) as con:
+        con.cursor().execute(CREATE)
+        con.commit()
+        build_indexes(con, 'pcode_lookup')
+        live = _indexes(con, 'public')
+        assert live == ['pcode_lookup_lad21_id_idx', 'pcode_lookup_lsoa21_id_idx', 'pcode_lookup_pkey']
+        start_refresh(con)
+    with psycopg2.connect(**staged_params(params)) as con:
+        # the staging pcode_lookup doesn't exist yet
+        drop_indexes(con, 'pcode_lookup')
+        assert _indexes(con, 'public') == live
+        # once it does, its own indexes are dropped
+        con.cursor().execute(CREATE)
+        con.commit()
+        build_indexes(con, 'pcode_lookup')
+        drop_indexes(con, 'pcode_lookup')
+        assert _indexes(con, STAGING_SCHEMA) == ['pcode_lookup_pkey']
+        assert _indexes(con, 'public') == live
@@ -0,0 +1,30 @@
+import psycopg2
+from utils.load_manifest import legacy_tables, migrate_legacy_tables
+
+
+def _columns(con, table):
+    cur = con.cursor()
+    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s ORDER BY ordinal_position", (table,))
+    return [x[0] for x in cur.fetchall()]
+
+
+def test_migrate_legacy_tables(params):
+    with psycopg2.connect(**params) as con:
+        cur = con.cursor()
+        cur.execute("""CREATE TABLE skills_lad (lad21cd VARCHAR, year INT, created timestamptz, parent_script VARCHAR)
+                       PARTITION BY LIST (year);
+                       CREATE TABLE skills_lad_y2020 PARTITION OF skills_lad FOR VALUES IN (2020);
+                       INSERT INTO skills_lad VALUES ('A', 2020, '2022-01-01', 'a.py'), ('B', 2020, '2022-01-01', 'a.py'),
+                                                     ('C', 2020, '2022-02-01', 'b.py');
+                       CREATE TABLE iod_2019 (lsoa11cd VARCHAR, "create" timestamptz, parent_script VARCHAR);
+                       INSERT INTO iod_2019 VALUES ('E1', '2022-03-01', 'a.py');
+                       CREATE TABLE lad21_lookup (lad21cd VARCHAR)""")
+        con.commit()
+        assert legacy_tables(con) == {'iod_2019': 'create', 'skills_lad': 'created'}
+        assert migrate_legacy_tables(con) == []
+        assert legacy_tables(con) == {}
+        assert _columns(con, 'skills_lad') == ['lad21cd', 'year', 'batch_id']
+        assert _columns(con, 'iod_2019') == ['lsoa11cd', 'batch_id']
+        cur.execute("""SELECT b.dataset, b.parent_script, b.status, count(*) FROM skills_lad s
+                       JOIN load_batches b USING (batch_id) GROUP BY 1, 2, 3 ORDER BY 2""")
+        assert cur.fetchall() == [('skills_lad', 'a.py', 'migrated', 2), ('skills_lad', 'b.py', 'migrated', 1)]
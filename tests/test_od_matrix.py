@@ -0,0 +1,37 @@
+import pandas as pd
+import psycopg2
+import pytest
+
+pytest.importorskip('scipy')
+pytest.importorskip('pyarrow')
+from utils.od_matrix import MigrationOD, OTHER_AREA
+
+# N is outside the areas (e.g. an NI LA when the areas are GB LAs)
+MOVES = pd.DataFrame({'outla': ['A', 'A', 'B', 'N'], 'inla': ['B', 'N', 'A', 'A'], 'sex': [1, 2, 1, 2],
+                      'age': [3, 30, 45, 90], 'moves': [5.0, 2.0, 1.0, 4.0]})
+
+
+def test_moves_outside_the_areas_kept_as_other():
+    od = MigrationOD.from_chunks([MOVES], areas=['A', 'B'])
+    assert list(od.areas) == ['A', 'B', OTHER_AREA]
+    flows = od.net_flows()
+    assert flows.loc['A', 'inflow'] == 5.0 and flows.loc['A', 'outflow'] == 7.0
+    dropped = MigrationOD.from_chunks([MOVES], areas=['A', 'B'], other=None)
+    assert list(dropped.areas) == ['A', 'B'] and dropped.total().sum() == 6.0
+
+
+def test_parquet_round_trip_with_numeric_sex(tmp_path):
+    od = MigrationOD.from_chunks([MOVES], areas=['A', 'B'])
+    od.to_parquet(tmp_path / 'od.parquet')
+    back = MigrationOD.read_parquet(tmp_path / 'od.parquet')
+    assert list(back.areas) == list(od.areas) and back.sexes == [1, 2]
+    assert (back.total() != od.total()).nnz == 0
+    # and with the categoricals lost on the way
+    plain = od.to_frame().astype({'origin': str, 'destination': str, 'sex': 'int64'})
+    assert (MigrationOD.from_frame(plain).total() != od.total()).nnz == 0
+
+
+def test_to_postgres_with_other(params):
+    od = MigrationOD.from_chunks([MOVES], areas=['E06000001', 'E06000002'])
+    with psycopg2.connect(**params) as con:
+        assert od.to_postgres(con, 'internal_migration') == 4
@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import psycopg2
+from utils.parallel_load import load_tables
+from utils.partitions import list_partitions
+from utils.schema_swap import start_refresh, staged_params, STAGING_SCHEMA
+
+CREATE = '''CREATE TABLE population_lad (lad21cd VARCHAR, year INT, population BIGINT,
+            PRIMARY KEY (lad21cd, year)) PARTITION BY LIST (year)'''
+
+
+def _create(params):
+    with psycopg2.connect(**params) as con:
+        con.cursor().execute(CREATE)
+
+
+def _rows(params, table):
+    with psycopg2.connect(**params) as con:
+        cur = con.cursor()
+        cur.execute('SELECT lad21cd, year, population FROM {} ORDER BY year, lad21cd'.format(table))
+        return cur.fetchall()
+
+
+def test_atomic_load_creates_partitions(params):
+    _create(params)
+    df = pd.DataFrame({'lad21cd': ['A', 'B', 'A'], 'year': [2020, 2020, 2021], 'population': [1, 2, 3]})
+    assert load_tables([(df, 'population_lad')], params, atomic=True) == []
+    assert _rows(params, 'population_lad') == [('A', 2020, 1), ('B', 2020, 2), ('A', 2021, 3)]
+    with psycopg2.connect(**params) as con:
+        assert sorted(list_partitions(con, 'population_lad')) == [2020, 2021]
+
+
+def test_atomic_load_replaces_staged_years_only(params):
+    _create(params)
+    load_tables([(pd.DataFrame({'lad21cd': ['A', 'A'], 'year': [2020, 2021], 'population': [1, 2]}), 'population_lad')],
+                params, atomic=True)
+    new = pd.DataFrame({'lad21cd': ['A', 'A'], 'year': [2021, 2022], 'population': [20, 30]})
+    assert load_tables([(new, 'population_lad')], params, atomic=True) == []
+    assert _rows(params, 'population_lad') == [('A', 2020, 1), ('A', 2021, 20), ('A', 2022, 30)]
+
+
+def test_atomic_load_into_staged_refresh(params):
+    # the population block: the partitioned table is (re)created, empty, in the staging schema
+    with psycopg2.connect(**params) as con:
+        start_refresh(con)
+    staged = staged_params(params)
+    _create(staged)
+    df = pd.DataFrame({'lad21cd': ['A', 'B'], 'year': [2020, 2020], 'population': [1, 2]})
+    assert load_tables([(df, 'population_lad')], staged, atomic=True) == []
+    assert _rows(params, '{}.population_lad'.format(STAGING_SCHEMA)) == [('A', 2020, 1), ('B', 2020, 2)]
+
+
+def _staging_schemas(params):
+    with psycopg2.connect(**params) as con:
+        cur = con.cursor()
+        cur.execute("SELECT nspname FROM pg_namespace WHERE nspname LIKE 'staging_load%' ORDER BY 1")
+        return [x[0] for x in cur.fetchall()]
+
+
+def test_atomic_loads_leave_each_others_staging_alone(params):
+    _create(params)
+    with psycopg2.connect(**params) as con:
+        # another load's staging, part way through
+        con.cursor().execute('CREATE SCHEMA staging_load_other; CREATE TABLE staging_load_other.population_lad (x INT)')
+    df = pd.DataFrame({'lad21cd': ['A'], 'year': [2020], 'population': [1]})
+    assert load_tables([(df, 'population_lad')], params, atomic=True) == []
+    assert _staging_schemas(params) == ['staging_load_other']
+
+
+def test_concurrent_atomic_loads(params):
+    _create(params)
+    with psycopg2.connect(**params) as con:
+        con.cursor().execute('CREATE TABLE skills_lad (lad21cd VARCHAR, year INT, value FLOAT)')
+    jobs = [[(pd.DataFrame({'lad21cd': ['A', 'B'], 'year': [2020, 2020], 'population': [1, 2]}), 'population_lad')],
+            [(pd.DataFrame({'lad21cd': ['A'], 'year': [2021], 'value': [0.5]}), 'skills_lad')]]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert list(executor.map(lambda x: load_tables(x, params, atomic=True), jobs)) == [[], []]
+    assert _rows(params, 'population_lad') == [('A', 2020, 1), ('B', 2020, 2)]
+    assert _staging_schemas(params) == []
@@ -0,0 +1,75 @@
+import pytest
+import pandas as pd
+import psycopg2
+from utils.partitions import load_partitions, copy_partitions, relation_kind, list_partitions
+from utils.schema import apply_schema
+
+
+def test_load_partitions_converts_an_ordinary_table(params):
+    with psycopg2.connect(**params) as con:
+        con.cursor().execute('CREATE TABLE skills_lad (lad21cd VARCHAR, year INT, value FLOAT)')
+        con.cursor().execute("INSERT INTO skills_lad VALUES ('A', 2020, 1.0)")
+        con.commit()
+        df = pd.DataFrame({'lad21cd': ['A'], 'year': [2021], 'value': [2.0]})
+        assert not load_partitions(df=df, table='skills_lad', con=con)
+        assert relation_kind(con, 'skills_lad') == 'p'
+        assert sorted(list_partitions(con, 'skills_lad')) == [2020, 2021]
+
+
+def test_load_partitions_reports_a_failed_conversion(params):
+    # a row without a year can't go in any partition, so the table can't be converted
+    with psycopg2.connect(**params) as con:
+        con.cursor().execute('CREATE TABLE skills_lad (lad21cd VARCHAR, year INT, value FLOAT)')
+        con.cursor().execute("INSERT INTO skills_lad VALUES ('A', NULL, 1.0)")
+        con.commit()
+        df = pd.DataFrame({'lad21cd': ['A'], 'year': [2021], 'value': [2.0]})
+        assert load_partitions(df=df, table='skills_lad', con=con) == 1
+        assert relation_kind(con, 'skills_lad') == 'r'
+        cur = con.cursor()
+        cur.execute('SELECT count(*) FROM skills_lad')
+        assert cur.fetchone()[0] == 1
+
+
+def test_copy_partitions_replaces_the_streamed_years(params):
+    with psycopg2.connect(**params) as con:
+        con.cursor().execute('CREATE TABLE wellbeing_lad (lad21cd VARCHAR, year INT, value FLOAT) PARTITION BY LIST (year)')
+        con.commit()
+        load_partitions(df=pd.DataFrame({'lad21cd': ['A', 'A'], 'year': [2020, 2021], 'value': [1.0, 2.0]}),
+                        table='wellbeing_lad', con=con)
+        chunks = [pd.DataFrame({'lad21cd': ['A', 'B'], 'year': [2021, 2021], 'value': [20.0, None]}),
+                  pd.DataFrame({'lad21cd': ['A'], 'year': [2022], 'value': [30.0]})]
+        assert copy_partitions(iter(chunks), 'wellbeing_lad', con) == 3
+        cur = con.cursor()
+        cur.execute('SELECT lad21cd, year, value FROM wellbeing_lad ORDER BY year, lad21cd')
+        assert cur.fetchall() == [('A', 2020, 1.0), ('A', 2021, 20.0), ('B', 2021, None), ('A', 2022, 30.0)]
+        assert sorted(list_partitions(con, 'wellbeing_lad')) == [2020, 2021, 2022]
+
+
+def test_copy_partitions_failure_leaves_the_table(params):
+    with psycopg2.connect(**params) as con:
+        con.cursor().execute('CREATE TABLE wellbeing_lad (lad21cd VARCHAR, year INT, value FLOAT) PARTITION BY LIST (year)')
+        con.commit()
+        load_partitions(df=pd.DataFrame({'lad21cd': ['A'], 'year': [2021], 'value': [1.0]}), table='wellbeing_lad', con=con)
+        chunks = [pd.DataFrame({'lad21cd': ['A'], 'year': [2021], 'value': [2.0]}),
+                  pd.DataFrame({'lad21cd': ['A'], 'year': [2021], 'value': ['not a number']})]
+        with pytest.raises(psycopg2.DatabaseError):
+            copy_partitions(iter(chunks), 'wellbeing_lad', con)
+        cur = con.cursor()
+        cur.execute('SELECT lad21cd, year, value FROM wellbeing_lad')
+        assert cur.fetchall() == [('A', 2021, 1.0)]
+
+
+def test_copy_partitions_creates_the_table_from_the_first_chunk(params):
+    def create_table(con, chunk):
+        apply_schema(con, chunk, 'wellbeing_lad', primary_key=['lad21cd', 'year'], partition_by='year')
+
+    chunks = [pd.DataFrame({'lad21cd': ['E06000001'], 'year': [2021], 'value': [1.5]}),
+              pd.DataFrame({'lad21cd': ['E06000002'], 'year': [2022], 'value': [2.5]})]
+    with psycopg2.connect(**params) as con:
+        assert copy_partitions(iter(chunks), 'wellbeing_lad', con, create_table=create_table) == 2
+        assert relation_kind(con, 'wellbeing_lad') == 'p'
+        assert sorted(list_partitions(con, 'wellbeing_lad')) == [2021, 2022]
+        cur = con.cursor()
+        cur.execute("""SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute
+                       WHERE attrelid = 'wellbeing_lad'::regclass AND attnum > 0 ORDER BY attnum""")
+        assert cur.fetchall() == [('lad21cd', 'character(9)'), ('year', 'smallint'), ('value', 'real')]
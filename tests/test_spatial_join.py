@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('shapely')
+pytest.importorskip('pyarrow')
+from utils import spatial_join
+
+
+def _assign(features, areas, area_columns, chunksize=None, max_workers=None):
+    return pd.DataFrame({'LAD21CD': ['E{}'.format(x) for x in features['ListEntry']]}, index=features.index)
+
+
+def _not_recomputed(*args, **kwargs):
+    raise AssertionError('the cached assignment was not used')
+
+
+def test_cached_assignment_follows_the_ids(tmp_path, monkeypatch):
+    features_filepath, areas_filepath = tmp_path / 'listed.shp', tmp_path / 'lad.shp'
+    features_filepath.write_bytes(b'features')
+    areas_filepath.write_bytes(b'areas')
+    features = pd.DataFrame({'ListEntry': [11, 12, 13, 14]})
+    monkeypatch.setattr(spatial_join, 'assign_to_areas', _assign)
+    spatial_join.load_assignment(features, None, str(features_filepath), str(areas_filepath), ['LAD21CD'], id_column='ListEntry')
+
+    # the same file, read in a different order (e.g. after a spatial sort)
+    monkeypatch.setattr(spatial_join, 'assign_to_areas', _not_recomputed)
+    reordered = features.iloc[[2, 0, 3, 1]].reset_index(drop=True)
+    out = spatial_join.load_assignment(reordered, None, str(features_filepath), str(areas_filepath), ['LAD21CD'], id_column='ListEntry')
+    assert list(out.index) == [0, 1, 2, 3]
+    assert list(out['LAD21CD']) == ['E13', 'E11', 'E14', 'E12']
+
+
+def test_cached_assignment_redone_for_new_ids(tmp_path, monkeypatch):
+    features_filepath, areas_filepath = tmp_path / 'listed.shp', tmp_path / 'lad.shp'
+    features_filepath.write_bytes(b'features')
+    areas_filepath.write_bytes(b'areas')
+    monkeypatch.setattr(spatial_join, 'assign_to_areas', _assign)
+    spatial_join.load_assignment(pd.DataFrame({'ListEntry': [11, 12]}), None, str(features_filepath), str(areas_filepath),
+                                 ['LAD21CD'], id_column='ListEntry')
+    out = spatial_join.load_assignment(pd.DataFrame({'ListEntry': [12, 15]}), None, str(features_filepath), str(areas_filepath),
+                                       ['LAD21CD'], id_column='ListEntry')
+    assert list(out['LAD21CD']) == ['E12', 'E15']
+
+
+def test_duplicate_ids(tmp_path):
+    with pytest.raises(ValueError):
+        spatial_join.load_assignment(pd.DataFrame({'ListEntry': [11, 11]}), None, str(tmp_path / 'a.shp'),
+                                     str(tmp_path / 'b.shp'), ['LAD21CD'], id_column='ListEntry')
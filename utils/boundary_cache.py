@@ -0,0 +1,55 @@
+# A GeoParquet cache for shapefiles (boundaries and other features). Each shapefile is converted
+# once, the first time it's read (and again if the shapefile is newer than the cache):
+#   - read with pyogrio's Arrow reader, much faster than the row-by-row default
+#   - sorted along a Hilbert curve, so each row group holds features that are close together
+#     (so the rows aren't in the shapefile's order: match them on an id column, not by position)
+#   - written with a bbox covering column, so a read with a bbox only decodes the row groups
+#     that overlap it (e.g. one region's LADs), and with the row groups' statistics to prune on
+# Reads then take only the columns asked for, e.g.
+#     read_boundaries(lad_filepath, columns=['LAD21CD', 'LAD21NM'], bbox=(xmin, ymin, xmax, ymax))
+
+import os
+import geopandas as gpd
+
+# at most ROW_GROUP_SIZE rows per row group, and at least MIN_ROW_GROUPS groups, so even a small
+# but heavy layer like the ~370 full resolution LADs can be read a region at a time
+ROW_GROUP_SIZE = 10000
+MIN_ROW_GROUPS = 32
+DEFAULT_CRS = 'EPSG:27700'
+
+
+def cache_path(filepath):
+    '''The GeoParquet cache of a shapefile, next to it.'''
+    return os.path.splitext(filepath)[0] + '.parquet'
+
+
+def build_cache(filepath, crs=DEFAULT_CRS, row_group_size=None):
+    '''Convert a shapefile to a spatially sorted GeoParquet file (see the notes at the top).'''
+    print('Caching {} as GeoParquet'.format(os.path.basename(filepath)))
+    gdf = gpd.read_file(filepath, engine='pyogrio', use_arrow=True)
+    if gdf.crs is None:
+        gdf = gdf.set_crs(crs)
+    # spatial partitioning: neighbouring features end up in the same row groups
+    gdf = gdf.iloc[gdf.geometry.hilbert_distance().argsort()].reset_index(drop=True)
+    if row_group_size is None:
+        row_group_size = max(min(ROW_GROUP_SIZE, len(gdf) // MIN_ROW_GROUPS), 1)
+    out = cache_path(filepath)
+    gdf.to_parquet(out + '.tmp', index=False, write_covering_bbox=True, row_group_size=row_group_size)
+    os.replace(out + '.tmp', out)
+    return out
+
+
+def read_boundaries(filepath, columns=None, bbox=None, crs=DEFAULT_CRS, row_group_size=None, rebuild=False):
+    '''Read a shapefile through its GeoParquet cache, building the cache if it's missing or older
+       than the shapefile.
+         columns - the attribute columns to read (the geometry always comes too); all by default
+         bbox    - (xmin, ymin, xmax, ymax) in the file's CRS, to read only the features that
+                   intersect it'''
+    cached = cache_path(filepath)
+    if rebuild or not os.path.isfile(cached) or os.path.getmtime(cached) < os.path.getmtime(filepath):
+        build_cache(filepath, crs=crs, row_group_size=row_group_size)
+    if columns is not None:
+        columns = list(columns) + ['geometry']
+    gdf = gpd.read_parquet(cached, columns=columns, bbox=bbox)
+    # the bbox covering column is only there for the pruning
+    return gdf.drop(columns='bbox', errors='ignore')
@@ -0,0 +1,152 @@
+# Business demography in long form: one table of (geog_code, geog_name, period, measure, value)
+# rows, built by concatenating the long form of each sheet, rather than merging the sheets of a
+# measure side by side (and losing the areas not in the first sheet). The sources are:
+#   - the annual business demography reference tables (births, deaths and active enterprises)
+#   - the quarterly experimental births and deaths, by quarter ('2017Q1'), plus annual totals by
+#     year ('2017'), summed with a groupby on the quarters' years
+#   - the enterprise stocks from the UK business workbooks, one workbook a year ('2017')
+# Suppressed cells ('c') are NaN in value, with the marker kept in a uint8 status column (see
+# utils/na_markers.py). Reading the workbooks (mostly openpyxl, in pure Python) is the slow part,
+# so they're parsed in parallel, one workbook per process.
+
+import re
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from utils.reshape import wide_to_long
+from utils.ons_columns import split_code_name
+from utils.na_markers import decode
+
+OUTPUT_COLUMNS = ['geog_code', 'geog_name', 'period', 'measure', 'value', 'status']
+
+# the sheets of each workbook, and the measure in each
+REFERENCE_SHEETS = {'Table 1.1a': 'births', 'Table 1.1b': 'births', 'Table 1.1c': 'births', 'Table 1.1d': 'births',
+                    'Table 2.1a': 'deaths', 'Table 2.1b': 'deaths', 'Table 2.1c': 'deaths', 'Table 2.1d': 'deaths',
+                    'Table 3.1a': 'active', 'Table 3.1b': 'active', 'Table 3.1c': 'active', 'Table 3.1d': 'active'}
+QUARTERLY_SHEETS = {'Births 2017-2019': 'births', 'Births 2020': 'births', 'Births 2021': 'births', 'Births 2022-2023': 'births',
+                    'Deaths 2017-2019': 'deaths', 'Deaths 2020': 'deaths', 'Deaths 2021': 'deaths', 'Deaths 2022-2023': 'deaths'}
+QUARTER_PATTERN = r'^Q([1-4]) ([0-9]{4})$'
+
+# the areas in the stocks tables are the first rows of the earliest one (the rest are notes and
+# other breakdowns)
+STOCK_AREA_ROWS = 442
+
+
+def _drop_blank(df):
+    # drop blank rows and columns
+    return df.loc[df.isna().all(axis=1) == False, df.isna().all(axis=0) == False]
+
+
+def _split_geography(df, col='Geography'):
+    # 'E06000001: Hartlepool' -> code and name
+    parts = split_code_name(df[col])
+    return df.assign(geog_code=parts['code'], geog_name=parts['name'])
+
+
+def _long(df, value_cols, measure):
+    out = wide_to_long(df.loc[:, ['geog_code', 'geog_name'] + value_cols], id_vars=['geog_code', 'geog_name'],
+                       var_name='period', value_name='value', categorical=False)
+    out['value'], out['status'] = decode(out['value'])
+    out['measure'] = measure
+    return out
+
+
+def parse_reference_tables(filepath):
+    '''The births, deaths and active enterprises tables of the annual reference workbook, long.'''
+    xl = pd.ExcelFile(filepath, engine='openpyxl')
+    out = []
+    for sheetname, measure in REFERENCE_SHEETS.items():
+        temp = xl.parse(sheet_name=sheetname, skiprows=3)
+        temp.columns = ['geog_code', 'geog_name'] + temp.columns.to_list()[2:]
+        temp = _drop_blank(temp)
+        long = _long(temp, temp.columns.to_list()[2:], measure)
+        long['period'] = long['period'].astype(str).str[:4]
+        out.append(long)
+    return pd.concat(out, ignore_index=True).loc[:, OUTPUT_COLUMNS]
+
+
+def parse_quarterly(filepath):
+    '''The quarterly births and deaths sheets, long, with periods like '2017Q1'.'''
+    xl = pd.ExcelFile(filepath, engine='openpyxl')
+    out = []
+    for sheetname, measure in QUARTERLY_SHEETS.items():
+        temp = _split_geography(xl.parse(sheet_name=sheetname, skiprows=3, nrows=423))
+        quarters = [x for x in temp.columns if re.match(QUARTER_PATTERN, str(x))]
+        long = _long(temp, quarters, measure)
+        long['period'] = long['period'].str.replace(QUARTER_PATTERN, r'\2Q\1', regex=True)
+        out.append(long)
+    return pd.concat(out, ignore_index=True).loc[:, OUTPUT_COLUMNS]
+
+
+def annual_totals(quarterly):
+    '''Annual totals of the quarterly measures, for the years with all four quarters. A total's
+       status is the highest of its quarters' (so a suppressed quarter shows on the year).'''
+    df = quarterly.assign(period=pd.PeriodIndex(quarterly['period'], freq='Q').year.astype(str))
+    grouped = df.groupby(['geog_code', 'geog_name', 'period', 'measure'], sort=False)
+    # min_count=4: a year with a missing (or suppressed) quarter has no total
+    totals = pd.DataFrame({'value': grouped['value'].sum(min_count=4), 'status': grouped['status'].max()})
+    return totals.reset_index().loc[:, OUTPUT_COLUMNS]
+
+
+def parse_stocks(filepath, year):
+    '''The total stock of enterprises by area from a UK business workbook, long.'''
+    xl = pd.ExcelFile(filepath)
+    if year <= 2021:
+        temp = xl.parse(sheet_name='Table 1', skiprows=5)
+        temp.columns = ['geog_code', 'geog_name'] + temp.columns.to_list()[2:]
+        temp = _drop_blank(temp)
+    else:
+        temp = xl.parse(sheet_name='Table 1', skiprows=3)
+        temp.columns = ['Geography'] + temp.columns.to_list()[1:]
+        temp = _split_geography(_drop_blank(temp))
+    long = _long(temp.rename({'Total': str(year)}, axis=1), [str(year)], 'stock')
+    return long.loc[:, OUTPUT_COLUMNS]
+
+
+def load_business_demography(reference_filepath, quarterly_filepath, stock_filepaths, max_workers=None):
+    '''Parse the workbooks in parallel. stock_filepaths is {year: filepath}.
+       Returns {'annual': the reference tables, 'quarterly': the quarterly births and deaths, their
+       annual totals and the annual stocks}, both long with OUTPUT_COLUMNS.'''
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        reference = executor.submit(parse_reference_tables, reference_filepath)
+        quarterly = executor.submit(parse_quarterly, quarterly_filepath)
+        stocks = {year: executor.submit(parse_stocks, filepath, year) for year, filepath in stock_filepaths.items()}
+        reference = reference.result()
+        quarterly = quarterly.result()
+        stocks = [stocks[year].result() for year in sorted(stocks)]
+    areas = stocks[0]['geog_code'].iloc[:STOCK_AREA_ROWS]
+    stocks = pd.concat(stocks, ignore_index=True)
+    stocks = stocks[stocks['geog_code'].isin(areas)]
+    return {'annual': reference,
+            'quarterly': pd.concat([quarterly, annual_totals(quarterly), stocks], ignore_index=True)}
+
+
+def _wide(long, columns):
+    # one row per area (in the order they first appear), one column per period
+    areas = pd.MultiIndex.from_frame(long.loc[:, ['geog_code', 'geog_name']].drop_duplicates())
+    wide = long.set_index(['geog_code', 'geog_name', 'period'])['value'].unstack('period').reindex(areas)
+    return wide.loc[:, sorted(wide.columns)].rename(columns, axis=1).reset_index()
+
+
+def legacy_layouts(quarterly):
+    '''The data store layouts from before the tables were long, for the readers of the old keys:
+       'company births', the quarterly sheets as {sheetname: frame}, and 'company_demographics',
+       {'births', 'deaths': the quarters as 'Q1 2017' columns then the annual totals as int year
+       columns, 'stocks': 'Geog code', 'Geog name' and str year columns}.'''
+    quarters = quarterly['period'].str.contains('Q')
+    company_births = {}
+    company_demographics = {}
+    for measure in ['births', 'deaths']:
+        df = quarterly[quarters & (quarterly['measure'] == measure)]
+        wide = _wide(df, lambda x: re.sub(r'^([0-9]{4})Q([1-4])$', r'Q\2 \1', x))
+        wide.insert(0, 'Geography', wide['geog_code'] + ': ' + wide['geog_name'])
+        wide = wide.rename({'geog_code': 'geog code', 'geog_name': 'geog name'}, axis=1)
+        for sheetname in [x for x, y in QUARTERLY_SHEETS.items() if y == measure]:
+            years = [int(x) for x in re.findall('[0-9]{4}', sheetname)]
+            cols = [x for x in wide.columns[3:] if years[0] <= int(x[-4:]) <= years[-1]]
+            company_births[sheetname] = wide.loc[:, ['Geography'] + cols + ['geog code', 'geog name']]
+        totals = _wide(quarterly[~quarters & (quarterly['measure'] == measure)], int)
+        company_demographics[measure] = wide.merge(totals.drop('geog_name', axis=1), how='left',
+                                                   left_on='geog code', right_on='geog_code').drop('geog_code', axis=1)
+    stocks = _wide(quarterly[quarterly['measure'] == 'stock'], str)
+    company_demographics['stocks'] = stocks.rename({'geog_code': 'Geog code', 'geog_name': 'Geog name'}, axis=1)
+    return company_births, company_demographics
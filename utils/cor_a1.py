@@ -0,0 +1,138 @@
+# Parser for the DLUHC Capital Outturn Return table COR A1 (capital expenditure by service and
+# category, 'Fixed assets' sheet). The releases differ in layout:
+#   - 'two-row': a row of sub-sectors (merged across their assets) above a row of assets, with
+#     the 'ONS Code' and 'Name' columns in the asset row (2018-19 to 2020-21)
+#   - 'colon': a single header row of 'Sub-sector: Asset £ thousand' (2021-22 on)
+# and in the number of sub-sectors and local authority rows. parse_cor_a1 works out the layout
+# from the sheet itself, so a new release only needs its URL adding to COR_A1_URLS: the year comes
+# from the filename, the header layout from the header rows, the local authorities are the rows
+# with a GSS code, and the broad sectors come from the sector row above the header. A sheet
+# without one raises an error rather than having its sectors guessed from its shape.
+#
+# The result is long (one row per local authority, sub-sector and asset), with the na markers
+# (':', '[x]') decoded to NaN and kept in a uint8 status column (see utils/na_markers.py), and
+# cached as Parquet next to the source file, as reading .ods files with odfpy takes minutes.
+
+import os
+import re
+import numpy as np
+import pandas as pd
+from utils.reshape import block_to_long
+from utils.na_markers import decode_array
+
+COR_A1_URLS = [
+    'https://assets.publishing.service.gov.uk/government/uploads/system/uploads/attachment_data/file/842038/COR_2018-19_outputs_COR_A1.xlsx',
+    'https://assets.publishing.service.gov.uk/government/uploads/system/uploads/attachment_data/file/1037878/COR_2019-20_outputs_COR_A1.ods',
+    'https://assets.publishing.service.gov.uk/government/uploads/system/uploads/attachment_data/file/1037853/COR_2020-21_outputs_COR_A1.ods',
+    'https://assets.publishing.service.gov.uk/government/uploads/system/uploads/attachment_data/file/1116478/COR_2021-22_outputs_COR_A1.ods',
+]
+
+GSS_PATTERN = r'^[EWSN][0-9]{8}$'
+OUTPUT_COLUMNS = ['ONS Code', 'LA Name', 'Sector', 'Sub-sector', 'Asset', 'Year', 'value', 'status']
+
+
+def release_year(filepath):
+    '''The (first) financial year of a release, from its filename, e.g. COR_2019-20_... -> 2019.'''
+    m = re.search('([0-9]{4})-[0-9]{2}', os.path.basename(filepath))
+    if m is None:
+        raise ValueError('No financial year in {}'.format(filepath))
+    return int(m.group(1))
+
+
+def _label(x):
+    return '' if pd.isnull(x) else re.sub(r'\s+', ' ', str(x)).strip()
+
+
+def _fill_right(labels):
+    # merged header cells only hold their label in the first cell
+    return pd.Series(labels).replace('', np.nan).ffill().fillna('').tolist()
+
+
+def detect_header(grid):
+    '''Find the header in a raw sheet (read with header=None). Returns (layout, header row,
+       number of id columns, sub-sector labels, asset labels) for the data columns.'''
+    matches = np.argwhere(grid.map(_label).to_numpy() == 'ONS Code')
+    if len(matches) == 0:
+        raise ValueError("No 'ONS Code' column in the sheet")
+    row = matches[0][0]
+    header = [_label(x) for x in grid.iloc[row]]
+    if any(':' in x for x in header):
+        layout = 'colon'
+        n_ids = next(i for i, x in enumerate(header) if ':' in x)
+        split = [x.split(':', 1) for x in header[n_ids:]]
+        sub_sectors = [x[0].strip() for x in split]
+        assets = [x[1] if len(x) > 1 else '' for x in split]
+    else:
+        layout = 'two-row'
+        above = [_label(x) for x in grid.iloc[row - 1]]
+        # the data columns start at the first sub-sector label after the id columns
+        n_ids = next(i for i, x in enumerate(above) if x and i > max(header.index('ONS Code'), header.index('Name')))
+        sub_sectors = _fill_right(above[n_ids:])
+        assets = header[n_ids:]
+    assets = [re.sub('£ thousand', '', x).strip() for x in assets]
+    return layout, row, n_ids, sub_sectors, assets
+
+
+def detect_sectors(grid, layout, row, n_ids, sub_sectors):
+    '''The broad sector of each data column, from the sector row above the header (its merged
+       cells label the first column of each sector). Raises ValueError if there isn't one.'''
+    sector_row = row - (2 if layout == 'two-row' else 1)
+    if sector_row >= 0:
+        labels = [_label(x) for x in grid.iloc[sector_row, n_ids:n_ids + len(sub_sectors)]]
+        # a sector row starts with a label over the first data column
+        if labels and labels[0]:
+            return _fill_right(labels)
+    raise ValueError('No broad sector row above the COR A1 header (row {}), so the sectors of its {} '
+                     'sub-sector columns are unknown'.format(sector_row + 1, len(sub_sectors)))
+
+
+def sheet_name(filepath):
+    '''The fixed assets sheet, whichever way it's spelt ('Fixed assets', 'Fixed_assets').'''
+    for name in pd.ExcelFile(filepath).sheet_names:
+        if re.sub('[^a-z]', '', name.lower()) == 'fixedassets':
+            return name
+    raise ValueError('No fixed assets sheet in {}'.format(filepath))
+
+
+def parse_cor_a1(filepath):
+    '''Parse a COR A1 release into long form, with the columns in OUTPUT_COLUMNS.'''
+    grid = pd.read_excel(filepath, sheet_name=sheet_name(filepath), header=None, dtype=object)
+    try:
+        return grid_to_long(grid, release_year(filepath))
+    except ValueError as error:
+        raise ValueError('{}: {}'.format(os.path.basename(filepath), error)) from error
+
+
+def grid_to_long(grid, year):
+    '''The long form of a raw COR A1 sheet (read with header=None).'''
+    layout, row, n_ids, sub_sectors, assets = detect_header(grid)
+    sectors = detect_sectors(grid, layout, row, n_ids, sub_sectors)
+    header = [_label(x) for x in grid.iloc[row, :n_ids]]
+    body = grid.iloc[row + 1:]
+    # the local authorities are the rows with a GSS code (which drops notes and blank rows)
+    codes = body.iloc[:, header.index('ONS Code')].map(_label)
+    body = body[codes.str.match(GSS_PATTERN)]
+    values, status = decode_array(body.iloc[:, n_ids:n_ids + len(sub_sectors)].to_numpy())
+    ids = pd.DataFrame({'ONS Code': body.iloc[:, header.index('ONS Code')].map(_label).to_numpy(),
+                        'LA Name': body.iloc[:, header.index('Name')].map(_label).to_numpy()})
+    labels = pd.DataFrame({'Sector': sectors, 'Sub-sector': sub_sectors, 'Asset': assets})
+    df = block_to_long(ids, values, labels, categorical=False)
+    # block_to_long flattens the block row by row, so the status flattens the same way
+    df['status'] = status.ravel()
+    df['Year'] = year
+    return df.loc[:, OUTPUT_COLUMNS]
+
+
+def load_cor_a1(filepath, rebuild=False):
+    '''parse_cor_a1, cached as Parquet next to the source file (and rebuilt if the source is newer).'''
+    cache_filepath = os.path.splitext(filepath)[0] + '_long.parquet'
+    if not rebuild and os.path.isfile(cache_filepath) \
+            and os.path.getmtime(cache_filepath) >= os.path.getmtime(filepath):
+        df = pd.read_parquet(cache_filepath)
+        # caches from before the status column was added are rebuilt
+        if set(OUTPUT_COLUMNS).issubset(df.columns):
+            return df
+    print('Parsing {}'.format(os.path.basename(filepath)))
+    df = parse_cor_a1(filepath)
+    df.to_parquet(cache_filepath, index=False)
+    return df
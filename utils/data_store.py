@@ -0,0 +1,183 @@
+# A dict-like store for the RSA data dictionary, where each key is saved as its own file.
+# It replaces pickling the whole of rsa_data_dict.p, which meant deserialising every dataset
+# (including the listed buildings GeoDataFrame) just to read or add a single key.
+#
+# Layout on disk:
+#   <path>/index.json       - {key: {'kind': ..., 'file': ...}} for the keys at this level
+#   <path>/<file>.parquet   - a DataFrame or Series (Parquet, or GeoParquet for GeoDataFrames)
+#   <path>/<file>.p         - anything Parquet can't hold (lists, dicts of strings, odd column labels)
+#   <path>/<file>/          - a nested dictionary, stored as another DataStore
+
+import os
+import re
+import json
+import pickle
+import shutil
+from collections.abc import MutableMapping
+import pandas as pd
+
+INDEX_FILENAME = 'index.json'
+
+
+class DataStore(MutableMapping):
+    '''A lazily-loaded, dict-like store. Reading a key only loads that key's file (memory-mapped
+       for Parquet); nested dictionaries come back as DataStores, so
+       store['population']['totals_by_lad'] only reads one table. Assigning a key writes it
+       straight to disk.'''
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        self._index = self._read_index()
+
+    # index handling
+    def _read_index(self):
+        index_path = os.path.join(self.path, INDEX_FILENAME)
+        if os.path.isfile(index_path):
+            with open(index_path, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def _write_index(self):
+        # write to a temporary file and swap it in, so a failed write can't corrupt the index
+        index_path = os.path.join(self.path, INDEX_FILENAME)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self._index, f, indent=1, sort_keys=True)
+        os.replace(index_path + '.tmp', index_path)
+
+    def _filename(self, key, avoid=None):
+        # a filesystem-safe, unique name for the key (and not avoid, e.g. the key's current file)
+        stem = re.sub('[^A-Za-z0-9_-]+', '_', str(key)).strip('_') or 'key'
+        taken = {v['file'].rsplit('.', 1)[0] for k, v in self._index.items() if k != str(key)}
+        if avoid is not None:
+            taken.add(avoid)
+        name, n = stem, 1
+        while name in taken:
+            n += 1
+            name = '{}_{}'.format(stem, n)
+        return name
+
+    # the MutableMapping interface
+    def __getitem__(self, key):
+        key = str(key)
+        if key not in self._index:
+            raise KeyError(key)
+        return self.read(key)
+
+    def __setitem__(self, key, value):
+        key = str(key)
+        # the new value goes in a new file, and the old one is only removed once the index points
+        # at it, so a failed write keeps the old value, and the old value can be read while it's
+        # written (e.g. store[k] = store[k] for a nested store)
+        old = self._index.get(key)
+        name = self._filename(key, avoid=None if old is None else old['file'].rsplit('.', 1)[0])
+        self._remove_name(name)
+        try:
+            entry = self._write_value(name, value)
+        except BaseException:
+            self._remove_name(name)
+            raise
+        self._index[key] = entry
+        self._write_index()
+        if old is not None:
+            self._remove_file(old)
+
+    def __delitem__(self, key):
+        key = str(key)
+        entry = self._index.pop(key)
+        self._remove_file(entry)
+        self._write_index()
+
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return 'DataStore({!r}, keys={})'.format(self.path, list(self._index))
+
+    # reading and writing individual values
+    def read(self, key, columns=None):
+        '''Read a single key. For tables, columns can be a subset of columns to read.'''
+        entry = self._index[str(key)]
+        filepath = os.path.join(self.path, entry['file'])
+        kind = entry['kind']
+        if kind == 'store':
+            return DataStore(filepath)
+        elif kind == 'geoframe':
+            import geopandas as gpd
+            return gpd.read_parquet(filepath, columns=columns)
+        elif kind in ['frame', 'series']:
+            df = pd.read_parquet(filepath, columns=columns, memory_map=True)
+            if kind == 'series':
+                return df.iloc[:, 0]
+            return df
+        else:
+            with open(filepath, 'rb') as f:
+                return pickle.load(f)
+
+    def _write_value(self, name, value):
+        if isinstance(value, (dict, DataStore)):
+            substore = DataStore(os.path.join(self.path, name))
+            for k, v in value.items():
+                substore[k] = v
+            return {'kind': 'store', 'file': name}
+        if isinstance(value, pd.DataFrame) and type(value).__name__ == 'GeoDataFrame':
+            value.to_parquet(os.path.join(self.path, name + '.parquet'))
+            return {'kind': 'geoframe', 'file': name + '.parquet'}
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            df = value.to_frame(name=str(value.name)) if isinstance(value, pd.Series) else value
+            filepath = os.path.join(self.path, name + '.parquet')
+            # Parquet needs string column names and single-typed columns. Some of the wide
+            # tables have year (or date) column labels, so those fall back to pickling.
+            if not isinstance(df.columns, pd.MultiIndex) and all(isinstance(x, str) for x in df.columns):
+                try:
+                    df.to_parquet(filepath)
+                    return {'kind': 'series' if isinstance(value, pd.Series) else 'frame', 'file': name + '.parquet'}
+                except Exception as error:
+                    if os.path.isfile(filepath):
+                        os.remove(filepath)
+                    print('Storing {} as a pickle: {}'.format(name, error))
+        with open(os.path.join(self.path, name + '.p'), 'wb') as f:
+            pickle.dump(value, f)
+        return {'kind': 'pickle', 'file': name + '.p'}
+
+    def _remove_file(self, entry):
+        filepath = os.path.join(self.path, entry['file'])
+        if entry['kind'] == 'store':
+            shutil.rmtree(filepath, ignore_errors=True)
+        elif os.path.isfile(filepath):
+            os.remove(filepath)
+
+    def _remove_name(self, name):
+        # whatever is under a name that isn't in the index (an interrupted write)
+        for filepath in [os.path.join(self.path, name + x) for x in ['', '.parquet', '.p']]:
+            if os.path.isdir(filepath):
+                shutil.rmtree(filepath, ignore_errors=True)
+            elif os.path.isfile(filepath):
+                os.remove(filepath)
+
+    def to_dict(self):
+        '''Load everything into an ordinary (nested) dictionary.'''
+        return {k: v.to_dict() if isinstance(v, DataStore) else v for k, v in self.items()}
+
+    @classmethod
+    def from_pickle(cls, pickle_path, path):
+        '''Convert an existing pickled dictionary (e.g. outputs/rsa_data_dict.p) into a DataStore.'''
+        with open(pickle_path, 'rb') as f:
+            data_dict = pickle.load(f)
+        store = cls(path)
+        for k, v in data_dict.items():
+            store[k] = v
+        return store
+
+
+def open_rsa_data_store(folder='outputs'):
+    '''Open the RSA data store, converting the old rsa_data_dict.p pickle the first time round.'''
+    path = os.path.join(folder, 'rsa_data_store')
+    pickle_path = os.path.join(folder, 'rsa_data_dict.p')
+    if not os.path.isfile(os.path.join(path, INDEX_FILENAME)) and os.path.isfile(pickle_path):
+        print('Converting {} to a data store. This only happens once.'.format(pickle_path))
+        return DataStore.from_pickle(pickle_path, path)
+    return DataStore(path)
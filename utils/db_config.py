@@ -3,11 +3,19 @@
 # The following config() function reads in the database.ini file and returns the connection
 # parameters as a dictionary. This function will be imported in to the main python script:
 
+# The files are only read once per run (see _read_config); each call gets its own copy of the
+# parameters, so callers can change them freely.
+
 # !/usr/bin/python
 from configparser import ConfigParser
+from functools import lru_cache
 import os
 
 def config(filename='geoprojssd_db.ini', section='postgresql'):
+    return dict(_read_config(filename, section))
+
+@lru_cache(maxsize=None)
+def _read_config(filename, section):
     # create a parser
     parser = ConfigParser()
     # read config file
@@ -0,0 +1,159 @@
+# Derived per-head and per-job tables, computed inside Postgres.
+# The measure tables (e.g. itl3_gfcf_values) only hold the raw values. The derived tables
+# (e.g. itl3_gfcf) join them to the population and employment tables in SQL, so when a
+# denominator is revised only the affected years and geographies need to be refreshed,
+# rather than re-running the whole upload.
+
+import psycopg2
+from utils.schema import qualified
+from utils.partitions import PARTITION_COLUMN, create_partitions
+from utils.geography_dimension import GEOGRAPHY_TABLE, LAD21_COLUMNS, ITL321_COLUMNS, ITL221_COLUMNS, create_named_view
+
+# Each derived table is built from a source (measure) table and a list of denominators:
+#   (denominator table, geography column in that table, denominator column, derived column)
+# The derived column is scale * value / denominator.
+# The tables are keyed on geography ids (see utils/geography_dimension.py), and each derived table
+# has a <name>_named view with the codes and names of its geographies.
+# Derived tables are partitioned by year (see utils/partitions.py), like their source tables.
+DERIVED_TABLES = {
+    'itl3_gfcf': {'source': 'itl3_gfcf_values',
+                  'columns': ['itl321_id', 'year', 'asset', 'sic07_industry_code', 'sic07_industry_name', 'value'],
+                  'primary_key': ['itl321_id', 'year', 'sic07_industry_code', 'asset'],
+                  'geo_col': 'itl321_id',
+                  'geographies': ITL321_COLUMNS,
+                  'scale': 1000000,
+                  'denominators': [('population_itl3', 'itl321_id', 'population', 'value_per_head'),
+                                   ('employment_lfs_itl3', 'itl321_id', 'employment', 'value_per_job')]},
+    'itl2_gfcf': {'source': 'itl2_gfcf_values',
+                  'columns': ['itl221_id', 'year', 'asset', 'sic07_industry_code', 'sic07_industry_name', 'value'],
+                  'primary_key': ['itl221_id', 'year', 'sic07_industry_code', 'asset'],
+                  'geo_col': 'itl221_id',
+                  'geographies': ITL221_COLUMNS,
+                  'scale': 1000000,
+                  'denominators': [('population_itl2', 'itl221_id', 'population', 'value_per_head'),
+                                   ('employment_lfs_itl2', 'itl221_id', 'employment', 'value_per_job')]},
+    'la_investment': {'source': 'la_investment_values',
+                      'columns': ['lad21_id', 'sector', 'sub_sector', 'asset', 'year', 'value'],
+                      'primary_key': ['lad21_id', 'sector', 'sub_sector', 'asset', 'year'],
+                      'geo_col': 'lad21_id',
+                      'geographies': LAD21_COLUMNS,
+                      'scale': 1000,
+                      'denominators': [('population_lad', 'lad21_id', 'population', 'value_per_head')]},
+}
+
+
+def derived_select_sql(name):
+    '''The SELECT statement for a derived table. It contains a {where} placeholder.'''
+    spec = DERIVED_TABLES[name]
+    select_list = ['m.{}'.format(x) for x in spec['columns']]
+    joins = []
+    for idx, (table, geo_col, denominator, derived_col) in enumerate(spec['denominators']):
+        alias = 'd{}'.format(idx)
+        select_list.append('{}.{} AS {}'.format(alias, denominator, denominator))
+        # in double precision, whatever the (inferred) types of the value and denominator columns
+        select_list.append('{} * m.value::double precision / NULLIF({}.{}, 0) AS {}'.format(spec['scale'], alias, denominator, derived_col))
+        joins.append('LEFT JOIN {} {} ON {}.{} = m.{} AND {}.year = m.year'.format(table, alias, alias, geo_col, spec['geo_col'], alias))
+    return 'SELECT {} FROM {} m {} {{where}}'.format(', '.join(select_list), spec['source'], ' '.join(joins))
+
+
+def derived_columns(name):
+    spec = DERIVED_TABLES[name]
+    cols = list(spec['columns'])
+    for table, geo_col, denominator, derived_col in spec['denominators']:
+        cols += [denominator, derived_col]
+    return cols
+
+
+def table_exists(con, table, search_path=False):
+    '''True if the table is in the current schema (or, with search_path=True, anywhere on the
+       search_path, e.g. only in the live schema during a staged refresh).'''
+    cur = con.cursor()
+    cur.execute('SELECT to_regclass(%s)', (table if search_path else qualified(con, table),))
+    exists = cur.fetchone()[0] is not None
+    cur.close()
+    return exists
+
+
+def create_derived_table(con, name):
+    '''Create an (empty), year-partitioned derived table, using the column types from its SELECT
+       statement, and its _named view.'''
+    if table_exists(con, name):
+        return
+    spec = DERIVED_TABLES[name]
+    cur = con.cursor()
+    # CREATE TABLE AS can't make a partitioned table, so take the columns from a temporary one
+    cur.execute('CREATE TEMPORARY TABLE {}_columns AS {} WITH NO DATA'.format(name, derived_select_sql(name).format(where='')))
+    cur.execute('CREATE TABLE {} (LIKE {}_columns) PARTITION BY LIST ({})'.format(name, name, PARTITION_COLUMN))
+    cur.execute('DROP TABLE {}_columns'.format(name))
+    cur.execute('ALTER TABLE {} ADD PRIMARY KEY ({})'.format(name, ', '.join(spec['primary_key'])))
+    cur.close()
+    con.commit()
+    create_named_view(con, name, spec['geographies'])
+
+
+def refresh_derived_table(con, name, years=None, geos=None):
+    '''Recompute the rows of a derived table for the given years and/or geography codes (all rows
+       if both are None). The delete and insert happen in one transaction, so readers see either
+       the old or the new rows. Errors roll back the refresh and are re-raised, so a failed
+       refresh stops the run (and a staged refresh is never published).'''
+    spec = DERIVED_TABLES[name]
+    params = []
+    if years is not None:
+        params.append([int(x) for x in years])
+    if geos is not None:
+        params.append([str(x) for x in geos])
+
+    def where(prefix):
+        conditions = []
+        if years is not None:
+            conditions.append('{}year = ANY(%s)'.format(prefix))
+        if geos is not None:
+            # the table holds geography ids, so match the codes in the geography dimension
+            conditions.append('{}{} IN (SELECT geo_id FROM {} WHERE code = ANY(%s))'.format(prefix, spec['geo_col'], GEOGRAPHY_TABLE))
+        return 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+    cur = con.cursor()
+    if years is None:
+        cur.execute('SELECT DISTINCT year FROM {}'.format(spec['source']))
+        create_partitions(con, name, [x[0] for x in cur.fetchall()])
+    else:
+        create_partitions(con, name, years)
+    try:
+        cur.execute('DELETE FROM {} {}'.format(name, where('')), params)
+        cur.execute('INSERT INTO {} ({}) {}'.format(name, ', '.join(derived_columns(name)),
+                                                     derived_select_sql(name).format(where=where('m.'))), params)
+        con.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print('Error refreshing {}: {}'.format(name, error))
+        con.rollback()
+        cur.close()
+        raise
+    print('Refreshed {} ({} rows)'.format(name, cur.rowcount))
+    # the planner statistics are stale after a bulk delete and insert
+    cur.execute('ANALYZE {}'.format(name))
+    con.commit()
+    cur.close()
+
+
+def dependent_tables(table):
+    '''The derived tables that are built from a given source or denominator table.'''
+    out = []
+    for name, spec in DERIVED_TABLES.items():
+        if table == spec['source'] or table in [x[0] for x in spec['denominators']]:
+            out.append(name)
+    return out
+
+
+def refresh_for_table(con, table, years=None, geos=None):
+    '''Call after loading a measure or denominator table: refreshes the affected years and
+       geographies of every derived table that depends on it. Derived tables that haven't been
+       created yet are skipped.
+       During a staged refresh (see utils/schema_swap.py) a derived table that is only in the live
+       schema is rebuilt in full in the staging schema, so it's published along with the tables
+       it's derived from rather than left with the old denominators.'''
+    for name in dependent_tables(table):
+        if table_exists(con, name):
+            refresh_derived_table(con, name, years=years, geos=geos)
+        elif table_exists(con, name, search_path=True):
+            create_derived_table(con, name)
+            refresh_derived_table(con, name)
@@ -0,0 +1,142 @@
+# A geography dimension: every GSS (and ITL) code gets a stable integer id in the geographies
+# table, whichever vintage it was loaded from (LAD11 to LAD23, ITL2/3, LSOA11/21, MSOA, OA...).
+# Fact tables then store a 4-byte id instead of the code (and the name) on every row, and a
+# <table>_named view joins the codes and names back on for reading.
+#
+# GSS codes are never reused for a different area, so the code alone identifies a geography.
+# A code that appears in several vintages keeps the same id, and keeps the most recent name.
+
+import re
+import pandas as pd
+import psycopg2
+import psycopg2.extras as extras
+from utils.schema import existing_columns, qualified
+
+# always in the live schema, so ids stay stable through staged refreshes (see utils/schema_swap.py)
+GEOGRAPHY_TABLE = 'public.geographies'
+
+# the {code column: name column} mappings of the geographies most tables are keyed on
+LAD21_COLUMNS = {'lad21cd': 'lad21nm'}
+ITL321_COLUMNS = {'itl321cd': 'itl321nm'}
+ITL221_COLUMNS = {'itl221cd': 'itl221nm'}
+
+# e.g. 'lad21cd' -> ('lad', 21), 'itl321cd' -> ('itl3', 21), 'lsoa11cd' -> ('lsoa', 11)
+CODE_COLUMN_PATTERN = re.compile(r'^(?P<entity>[a-z]+?[0-9]?)(?P<vintage>[0-9]{2})cd$')
+
+
+def parse_code_column(col):
+    '''The entity and (4 digit) vintage year implied by a code column name, or (None, None).'''
+    m = CODE_COLUMN_PATTERN.match(col)
+    if m is None:
+        return None, None
+    return m.group('entity'), 2000 + int(m.group('vintage'))
+
+
+def id_column(col):
+    '''The id column that replaces a code column, e.g. lad21cd -> lad21_id, geog_code -> geog_id.'''
+    return re.sub('(cd|_code)$', '', col) + '_id'
+
+
+def id_types(columns):
+    '''Column types for the id columns, to pass to utils.schema as overrides. The ids are always
+       INTEGER, as the dimension will outgrow a SMALLINT whatever the range of a given load.'''
+    return {id_column(col): 'INTEGER' for col in columns}
+
+
+def create_geography_table(con):
+    cur = con.cursor()
+    cur.execute("""CREATE TABLE IF NOT EXISTS {} (
+                geo_id SERIAL PRIMARY KEY,
+                code VARCHAR(9) UNIQUE NOT NULL,
+                name VARCHAR,
+                entity VARCHAR,
+                first_vintage SMALLINT,
+                last_vintage SMALLINT
+                )""".format(GEOGRAPHY_TABLE))
+    cur.close()
+    con.commit()
+
+
+def register_geographies(con, codes, names=None, entity=None, vintage=None):
+    '''Add codes to the dimension (updating the names and vintage range of codes that are already
+       there) and return a Series mapping each code to its geo_id.'''
+    create_geography_table(con)
+    df = pd.DataFrame({'code': pd.Series(codes).astype(object).to_numpy(),
+                       'name': None if names is None else pd.Series(names).to_numpy()})
+    df = df[df['code'].notna()].drop_duplicates(subset='code', keep='last')
+    df['code'] = df['code'].astype(str).str.strip()
+    df['name'] = df['name'].where(df['name'].notna(), None)
+
+    cur = con.cursor()
+    try:
+        # upsert via a temporary table, so hundreds of thousands of codes go in one statement
+        cur.execute('CREATE TEMPORARY TABLE new_geographies (code VARCHAR(9), name VARCHAR) ON COMMIT DROP')
+        extras.execute_values(cur, 'INSERT INTO new_geographies (code, name) VALUES %s',
+                              list(df.itertuples(index=False, name=None)), page_size=10000)
+        cur.execute("""INSERT INTO {g} (code, name, entity, first_vintage, last_vintage)
+                       SELECT code, name, %(entity)s, %(vintage)s, %(vintage)s FROM new_geographies
+                       ON CONFLICT (code) DO UPDATE SET
+                           name = CASE WHEN EXCLUDED.last_vintage >= COALESCE({g}.last_vintage, 0)
+                                       THEN COALESCE(EXCLUDED.name, {g}.name) ELSE COALESCE({g}.name, EXCLUDED.name) END,
+                           entity = COALESCE({g}.entity, EXCLUDED.entity),
+                           first_vintage = LEAST({g}.first_vintage, EXCLUDED.first_vintage),
+                           last_vintage = GREATEST({g}.last_vintage, EXCLUDED.last_vintage)""".format(g=GEOGRAPHY_TABLE),
+                    {'entity': entity, 'vintage': vintage})
+        cur.execute('SELECT g.code, g.geo_id FROM {} g JOIN new_geographies n USING (code)'.format(GEOGRAPHY_TABLE))
+        ids = dict(cur.fetchall())
+        con.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print('Error registering geographies: {}'.format(error))
+        con.rollback()
+        cur.close()
+        raise
+    cur.close()
+    return pd.Series(ids, name='geo_id', dtype='int64')
+
+
+def encode_geographies(con, df, columns):
+    '''Replace code (and name) columns with integer geography ids.
+       columns maps each code column to its name column (or None), e.g.
+       {'lad21cd': 'lad21nm', 'oa21cd': None}. Codes are registered as they go, with the entity
+       and vintage taken from the column name. Returns a new dataframe where each code column
+       is replaced by an id column (see id_column) and the name columns are dropped.'''
+    out = df.copy()
+    for code_col, name_col in columns.items():
+        entity, vintage = parse_code_column(code_col)
+        codes = out[code_col].astype(object).where(out[code_col].notna(), None)
+        ids = register_geographies(con, codes, names=None if name_col is None else out[name_col],
+                                   entity=entity, vintage=vintage)
+        geo_ids = codes.str.strip().map(ids)
+        # python ints and None (rather than a nullable Int64 column), so that fillna and psycopg2 work as usual
+        position = out.columns.get_loc(code_col)
+        out.insert(position, id_column(code_col), geo_ids.astype('Int64').astype(object).where(geo_ids.notna(), None))
+        out = out.drop([code_col] + ([name_col] if name_col is not None else []), axis=1)
+    return out
+
+
+def create_named_view(con, table, columns):
+    '''Create (or replace) <table>_named, which has the codes and names back in place of the ids.
+       columns is the same {code column: name column or None} mapping given to encode_geographies.'''
+    create_geography_table(con)
+    table_columns = list(existing_columns(con, table))
+    id_columns = {id_column(k): (k, v) for k, v in columns.items()}
+    select_list = []
+    joins = []
+    for col in table_columns:
+        if col not in id_columns:
+            select_list.append('t.{}'.format(col))
+            continue
+        code_col, name_col = id_columns[col]
+        alias = 'g{}'.format(len(joins))
+        select_list.append('{}.code AS {}'.format(alias, code_col))
+        if name_col is not None:
+            select_list.append('{}.name AS {}'.format(alias, name_col))
+        joins.append('LEFT JOIN {} {} ON {}.geo_id = t.{}'.format(GEOGRAPHY_TABLE, alias, alias, col))
+    # in the current schema, so a staged refresh doesn't drop the live view (see utils/schema.py)
+    view = qualified(con, '{}_named'.format(table))
+    cur = con.cursor()
+    # drop rather than replace, as CREATE OR REPLACE VIEW can't change the existing columns
+    cur.execute('DROP VIEW IF EXISTS {}'.format(view))
+    cur.execute('CREATE VIEW {} AS SELECT {} FROM {} t {}'.format(view, ', '.join(select_list), qualified(con, table), ' '.join(joins)))
+    cur.close()
+    con.commit()
@@ -0,0 +1,131 @@
+# A roll-up engine to aggregate LAD-level data to higher geographies (ITL3, ITL2, ITL1, region
+# and country) with one sparse matrix product per level, instead of a groupby with a Python
+# lambda per group.
+#
+# NB 4 Scottish LADs are split across more than one ITL3 region. They are dropped from the ITL
+# columns of lad21_lookup. Here, given weights for their LAU1s (e.g. population), they get weighted
+# memberships of each ITL3 they fall in. Without weights there's no fair way to split them, so as in
+# lad21_lookup they're left out of the ITL3s they're split between: those ITL3s are still rolled up
+# from their other LADs (and so undercounted), and one with no other LADs is NaN.
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# the code and name columns used for each level in the database tables
+LEVEL_COLUMNS = {'itl3': ('itl321cd', 'itl321nm'),
+                 'itl2': ('itl221cd', 'itl221nm'),
+                 'itl1': ('itl121cd', 'itl121nm'),
+                 'rgn': ('rgn21cd', 'rgn21nm'),
+                 'ctry': ('ctry21cd', 'ctry21nm')}
+
+
+class GeographyRollup:
+    '''Precomputed LAD to parent membership matrices for each level of the hierarchy.
+       lad_to_itl is the LAD21_LAU121_ITL321_ITL221_ITL121 lookup (one row per LAU1, so split LADs
+       appear more than once) and lad21_lookup supplies regions and countries.
+       lau_weights is an optional Series indexed by LAU121CD (e.g. population) used to apportion
+       split LADs between their ITL3s. Without it (or without weights for all of a split LAD's
+       LAU1s) a split LAD is left out of the parents it's split between, which are rolled up from
+       their other LADs (NaN if they have none).'''
+
+    def __init__(self, lad_to_itl, lad21_lookup=None, lau_weights=None):
+        itl = lad_to_itl.copy()
+        itl.columns = [x.lower() for x in itl.columns]
+        # each LAD's weights sum to one, unless any of its LAU1s has no weight, when it can't be
+        # apportioned (NaN). That only matters where it's split between parents (below)
+        if lau_weights is None:
+            itl['weight'] = np.nan
+        else:
+            itl['weight'] = itl['lau121cd'].map(lau_weights).astype(float)
+            itl['weight'] = itl['weight'] / itl.groupby('lad21cd')['weight'].transform('sum', skipna=False)
+
+        memberships = {}
+        for level in ['itl3', 'itl2', 'itl1']:
+            cd, nm = LEVEL_COLUMNS[level]
+            m = itl.loc[:, ['lad21cd', cd, nm, 'weight']].copy()
+            # a LAD wholly within one parent goes to it in full (its LAU1 rows are summed below)
+            whole = m.groupby('lad21cd')[cd].transform('nunique') == 1
+            m.loc[whole, 'weight'] = 1.0 / m.groupby('lad21cd')[cd].transform('size')[whole]
+            memberships[level] = m
+        if lad21_lookup is not None:
+            for level in ['rgn', 'ctry']:
+                cd, nm = LEVEL_COLUMNS[level]
+                temp = lad21_lookup.loc[lad21_lookup[cd].notna(), ['lad21cd', cd, nm]].copy()
+                temp['weight'] = 1.0
+                memberships[level] = temp
+
+        self.lads = pd.Index(sorted(set().union(*[set(m['lad21cd']) for m in memberships.values()])), name='lad21cd')
+        self.matrices = {}
+        self.unapportioned = {}
+        self.parents = {}
+        for level, m in memberships.items():
+            cd, nm = LEVEL_COLUMNS[level]
+            parents = m.loc[:, [cd, nm]].drop_duplicates(subset=cd).sort_values(cd).reset_index(drop=True)
+            # the LADs that can't be apportioned are left out of the sums, but kept track of, so
+            # their parents still count as having data (see rollup)
+            split = m.loc[m['weight'].isna()].drop_duplicates(subset=['lad21cd', cd]).assign(weight=1.0)
+            m = m.loc[m['weight'].notna()].groupby(['lad21cd', cd, nm], as_index=False)['weight'].sum()
+            self.matrices[level] = self._matrix(m, parents[cd])
+            self.unapportioned[level] = self._matrix(split, parents[cd])
+            self.parents[level] = parents
+
+    def _matrix(self, memberships, parents):
+        # a (parent x LAD) matrix of the membership weights
+        rows = pd.Index(parents).get_indexer(memberships[parents.name])
+        cols = self.lads.get_indexer(memberships['lad21cd'])
+        return sparse.csr_matrix((memberships['weight'].to_numpy(dtype=float), (rows, cols)),
+                                 shape=(len(parents), len(self.lads)))
+
+    @property
+    def levels(self):
+        return list(self.matrices)
+
+    def _apply(self, values, level):
+        '''Aggregate a (LAD x anything) array. A parent is NaN if any of its LADs is NaN, or if it
+           has no LADs that can be apportioned to it.'''
+        matrix = self.matrices[level]
+        missing = np.isnan(values)
+        out = np.asarray(matrix @ np.where(missing, 0, values))
+        membership = matrix.copy()
+        membership.data = np.ones_like(membership.data)
+        out[np.asarray(membership @ missing.astype(float)) > 0] = np.nan
+        out[np.diff(matrix.indptr) == 0] = np.nan
+        return out
+
+    def rollup_wide(self, wide, level):
+        '''Roll up a wide dataframe indexed by lad21cd (e.g. one column per year). LADs missing
+           from the index count as NaN, so their parents come back as NaN.'''
+        values = wide.reindex(self.lads).to_numpy(dtype=float)
+        cd, nm = LEVEL_COLUMNS[level]
+        return pd.DataFrame(self._apply(values, level), columns=wide.columns,
+                            index=pd.Index(self.parents[level][cd], name=cd))
+
+    def rollup(self, df, value_col, level, lad_col='lad21cd', by='year'):
+        '''Roll up a long dataframe with one row per LAD and by (a column or list of columns, usually
+           year). All years are done in a single sparse product. Rows that aren't LADs are ignored
+           and (LAD, by) pairs that are missing count as NaN, but (parent, by) pairs with no LAD
+           in df at all are left out (e.g. NI ITL3s from GB data).
+           Returns a long dataframe with the parent code and name, the by columns and value_col.'''
+        by = [by] if isinstance(by, str) else list(by)
+        rows = self.lads.get_indexer(df[lad_col])
+        keys = pd.MultiIndex.from_frame(df.loc[:, by]) if len(by) > 1 else pd.Index(df[by[0]])
+        cols, uniques = keys.factorize()
+        valid = rows >= 0
+        values = np.full((len(self.lads), len(uniques)), np.nan)
+        values[rows[valid], cols[valid]] = df[value_col].to_numpy(dtype=float)[valid]
+        # how many of each parent's LADs have a row for each by value
+        present = np.zeros(values.shape)
+        present[rows[valid], cols[valid]] = 1
+        membership = self.matrices[level].copy()
+        membership.data = np.ones_like(membership.data)
+        contributing = np.asarray((membership + self.unapportioned[level]) @ present)
+
+        result = self._apply(values, level)
+        parents = self.parents[level]
+        out = parents.iloc[np.repeat(np.arange(len(parents)), len(uniques))].reset_index(drop=True)
+        key_frame = uniques.to_frame(index=False) if len(by) > 1 else pd.DataFrame({by[0]: uniques})
+        key_frame = key_frame.iloc[np.tile(np.arange(len(uniques)), len(parents))].reset_index(drop=True)
+        out = pd.concat([out, key_frame], axis=1)
+        out[value_col] = result.ravel()
+        return out.loc[contributing.ravel() > 0].reset_index(drop=True)
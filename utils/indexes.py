@@ -0,0 +1,99 @@
+# Secondary indexes and planner statistics for the loaded tables.
+# Each table declares the indexes for its common lookups in TABLE_INDEXES (the primary keys
+# already cover lookups by their leading columns, e.g. pcode_lookup by pcds and iod_2019 by
+# lsoa11_id). Bulk loads drop the indexes first where that helps, build them once the rows are
+# in, and ANALYZE the table so the planner knows what was loaded.
+
+import psycopg2
+from utils.schema import existing_columns, qualified
+from utils.partitions import relation_kind, list_partitions
+
+# table: list of indexes, each a list of columns
+TABLE_INDEXES = {
+    'pcode_lookup': [['lad21_id'], ['lsoa21_id']],
+    'population_lsoa': [['lad21_id']],
+    'wellbeing_lad': [['measure_of_wellbeing'], ['lad21_id']],
+    'skills_lad': [['variable_name']],
+    'ashe_distribution_lad': [['percentile']],
+}
+
+
+def index_name(table, columns):
+    return '{}_{}_idx'.format(table, '_'.join(columns))
+
+
+def drop_indexes(con, table):
+    '''Drop a table's declared indexes, e.g. before a bulk load into an ordinary table.
+       Only the table in the current schema is touched: during a staged refresh (see
+       utils/schema_swap.py) a table that hasn't been created in staging yet is skipped, rather
+       than dropping the live table's indexes.'''
+    schema, table = qualified(con, table).split('.', 1)
+    cur = con.cursor()
+    cur.execute('SELECT to_regclass(%s)', ('{}.{}'.format(schema, table),))
+    if cur.fetchone()[0] is not None:
+        for columns in TABLE_INDEXES.get(table, []):
+            cur.execute('DROP INDEX IF EXISTS {}.{}'.format(schema, index_name(table, columns)))
+    cur.close()
+    con.commit()
+
+
+def build_indexes(con, table, concurrently=False):
+    '''Create any of a table's declared indexes that are missing.
+       With concurrently=True the indexes are built without blocking writes to the table. A
+       partitioned table can't be indexed concurrently in one go, so its index is created on the
+       parent only, built concurrently on each partition and then attached.'''
+    columns_present = set(existing_columns(con, table))
+    partitioned = relation_kind(con, table) == 'p'
+    autocommit = con.autocommit
+    if concurrently:
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction
+        con.commit()
+        con.autocommit = True
+    cur = con.cursor()
+    try:
+        for columns in TABLE_INDEXES.get(table, []):
+            if not set(columns) <= columns_present:
+                print('Skipping index on {} ({}): no such column'.format(table, ', '.join(columns)))
+                continue
+            name = index_name(table, columns)
+            if not concurrently:
+                cur.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(name, table, ', '.join(columns)))
+            elif not partitioned:
+                cur.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})'.format(name, table, ', '.join(columns)))
+            else:
+                cur.execute('CREATE INDEX IF NOT EXISTS {} ON ONLY {} ({})'.format(name, table, ', '.join(columns)))
+                for partition in list_partitions(con, table).values():
+                    partition_index = index_name(partition, columns)
+                    cur.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})'.format(
+                        partition_index, partition, ', '.join(columns)))
+                    cur.execute("""SELECT 1 FROM pg_inherits WHERE inhparent = to_regclass(%s)
+                                   AND inhrelid = to_regclass(%s)""", (name, partition_index))
+                    if cur.fetchone() is None:
+                        cur.execute('ALTER INDEX {} ATTACH PARTITION {}'.format(name, partition_index))
+        if not concurrently:
+            con.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print('Error building indexes on {}: {}'.format(table, error))
+        if not concurrently:
+            con.rollback()
+        return 1
+    finally:
+        cur.close()
+        con.autocommit = autocommit
+
+
+def analyze(con, tables):
+    '''Refresh the planner statistics for the given tables.'''
+    cur = con.cursor()
+    for table in [tables] if isinstance(tables, str) else tables:
+        cur.execute('ANALYZE {}'.format(table))
+    cur.close()
+    con.commit()
+
+
+def after_load(con, tables, concurrently=False):
+    '''Call once a load has finished: builds each table's declared indexes and ANALYZEs it.'''
+    tables = [tables] if isinstance(tables, str) else list(tables)
+    for table in tables:
+        build_indexes(con, table, concurrently=concurrently)
+    analyze(con, tables)
@@ -0,0 +1,129 @@
+# Harmonise LAD-level data published on different boundary vintages (lad18cd, lad19cd, ...) to a
+# single target vintage (lad21cd by default), for all years in one go.
+#
+# lad_mappings (one row per area, with a ladYYcd column per vintage) gives a sparse transition
+# matrix from every (vintage, code) to the target codes. Each row of the data is assigned the
+# vintage its code belongs to (the latest vintage at or before its year that contains the code),
+# the values are put in a sparse (source x year and other keys) matrix and mapped to the target
+# with one product, so:
+#   - merges (several old codes -> one target code) are summed
+#   - splits (one code -> several target codes, e.g. a 2023 unitary on lad21 boundaries) are
+#     apportioned by weight: by default equally, or in proportion to weights supplied by the
+#     caller (e.g. the population of the target LADs)
+# This is for additive values (counts, spending, ...), not rates or per head values.
+
+import re
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+VINTAGE_PATTERN = '^lad[0-9]{2}cd$'
+
+
+def vintage_year(vintage):
+    '''The year of a vintage column, e.g. lad19cd -> 2019.'''
+    return 2000 + int(vintage[3:5])
+
+
+class LadHarmoniser:
+    '''A precomputed transition matrix from every LAD vintage in lad_mappings to target.
+       weights is an optional Series indexed by target code (e.g. population) used to apportion
+       codes that are split between several target codes. Without it each part gets an equal share.'''
+
+    def __init__(self, lad_mappings, target='lad21cd', weights=None):
+        self.target = target
+        self.vintages = sorted(x for x in lad_mappings.columns if re.match(VINTAGE_PATTERN, x))
+        if target not in self.vintages:
+            raise ValueError('No {} column in lad_mappings'.format(target))
+        self.codes = {}
+        pairs = []
+        for vintage in self.vintages:
+            m = lad_mappings.loc[:, [vintage, target]].dropna().drop_duplicates()
+            m.columns = ['source', 'target']
+            m.insert(0, 'vintage', vintage)
+            pairs.append(m)
+            self.codes[vintage] = pd.Index(m['source'].unique())
+        pairs = pd.concat(pairs, ignore_index=True)
+        if weights is None:
+            pairs['weight'] = 1.0
+        else:
+            pairs['weight'] = pairs['target'].map(weights).astype(float).fillna(0)
+            # a split with no weight for any of its parts falls back to an equal share
+            unweighted = pairs.groupby(['vintage', 'source'])['weight'].transform('sum') == 0
+            pairs.loc[unweighted, 'weight'] = 1.0
+        # each source code's weights sum to one
+        pairs['weight'] = pairs['weight'] / pairs.groupby(['vintage', 'source'])['weight'].transform('sum')
+
+        self.sources = pd.MultiIndex.from_frame(pairs.loc[:, ['vintage', 'source']]).unique()
+        self.targets = pd.Index(sorted(pairs['target'].unique()), name=target)
+        rows = self.targets.get_indexer(pairs['target'])
+        cols = self.sources.get_indexer(pd.MultiIndex.from_frame(pairs.loc[:, ['vintage', 'source']]))
+        self.matrix = sparse.csr_matrix((pairs['weight'].to_numpy(), (rows, cols)),
+                                        shape=(len(self.targets), len(self.sources)))
+
+    def splits(self):
+        '''The (vintage, code) pairs that are split between more than one target code.'''
+        parts = np.diff(self.matrix.tocsc().indptr)
+        return self.sources[parts > 1]
+
+    def detect_vintage(self, codes, years):
+        '''The vintage of each (code, year): the latest vintage at or before the year that
+           contains the code, or failing that the earliest later one. None if no vintage has it.'''
+        codes = pd.Index(codes)
+        years = np.asarray(years, dtype=int)
+        best = np.full(len(codes), -np.inf)
+        out = np.full(len(codes), None, dtype=object)
+        for vintage in self.vintages:
+            # vintages up to the year score by recency, later ones below all of those, earliest first
+            vy = vintage_year(vintage)
+            score = np.where(vy <= years, vy, -vy)
+            better = codes.isin(self.codes[vintage]) & (score > best)
+            best[better] = score[better]
+            out[better] = vintage
+        return out
+
+    def harmonise(self, df, values='value', code_col='ONS Code', year_col='Year', by=None, vintage=None):
+        '''Map a long dataframe with a LAD code, a year and one or more value columns to the target
+           vintage. by is a list of other key columns (e.g. sector) kept in the output. vintage,
+           if given, is the vintage of every row; otherwise it's detected per row.
+           Rows whose code isn't in any vintage are dropped (and counted). A target value is the
+           (weighted) sum of the values mapped to it, ignoring NaNs, and NaN if they're all NaN.
+           Returns a long dataframe of the target code, the by columns, the year and the values.'''
+        values = [values] if isinstance(values, str) else list(values)
+        keys = list(by or []) + [year_col]
+        if vintage is None:
+            vintages = self.detect_vintage(df[code_col], df[year_col])
+        else:
+            vintages = np.full(len(df), vintage, dtype=object)
+        src = self.sources.get_indexer(pd.MultiIndex.from_arrays([vintages, df[code_col].to_numpy()]))
+        matched = src >= 0
+        if not matched.all():
+            unmatched = df.loc[~matched, code_col].unique()
+            print('Dropping {} rows with {} codes not in lad_mappings, e.g. {}'.format(
+                (~matched).sum(), len(unmatched), ', '.join(map(str, unmatched[:5]))))
+        src = src[matched]
+        key_codes, uniques = pd.MultiIndex.from_frame(df.loc[matched, keys]).factorize()
+        shape = (len(self.sources), len(uniques))
+
+        # every (target, key) cell with a row mapped to it is in the output
+        cells = (self.matrix @ sparse.csr_matrix((np.ones(len(src)), (src, key_codes)), shape=shape)).tocoo()
+        rows, cols = cells.row, cells.col
+        # and the sums of (and whether there are any) values in each
+        present = {}
+        sums = {}
+        for col in values:
+            v = df[col].to_numpy(dtype=float)[matched]
+            ok = ~np.isnan(v)
+            # duplicate (source, key) entries are summed when the matrix is built
+            x = sparse.csr_matrix((v[ok], (src[ok], key_codes[ok])), shape=shape)
+            seen = sparse.csr_matrix((np.ones(ok.sum()), (src[ok], key_codes[ok])), shape=shape)
+            sums[col] = self.matrix @ x
+            present[col] = self.matrix @ seen
+
+        out = pd.DataFrame({self.target: self.targets[rows]})
+        out = pd.concat([out, uniques[cols].to_frame(index=False, name=keys)], axis=1)
+        for col in values:
+            result = np.asarray(sums[col][rows, cols]).ravel()
+            result[np.asarray(present[col][rows, cols]).ravel() == 0] = np.nan
+            out[col] = result
+        return out.sort_values([self.target] + keys).reset_index(drop=True)
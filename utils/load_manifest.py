@@ -0,0 +1,123 @@
+# A manifest of data loads. Each upload gets a row in load_batches (the script and dataset it
+# came from, hashes of its source files, when it started and finished and how many rows went
+# into each table), and the rows it loads only carry the integer batch_id. This replaces the
+# created and parent_script columns that used to be repeated on every row of every table.
+
+import os
+import json
+import hashlib
+import psycopg2
+
+# always in the live schema, so loads into a staging schema (see utils/schema_swap.py) still
+# record their batches in the one manifest
+MANIFEST_TABLE = 'public.load_batches'
+
+# the column definition to add to a table that is loaded in batches
+BATCH_ID_COLUMN = 'batch_id INTEGER REFERENCES {} (batch_id)'.format(MANIFEST_TABLE)
+
+
+def create_manifest_table(con):
+    cur = con.cursor()
+    cur.execute("""CREATE TABLE IF NOT EXISTS {} (
+                batch_id SERIAL PRIMARY KEY,
+                parent_script VARCHAR,
+                dataset VARCHAR,
+                source_files VARCHAR[],
+                source_hashes VARCHAR[],
+                started timestamptz DEFAULT now(),
+                finished timestamptz,
+                row_counts JSONB,
+                status VARCHAR DEFAULT 'running'
+                );
+                CREATE INDEX IF NOT EXISTS load_batches_dataset_idx ON {} (dataset, started);
+                """.format(MANIFEST_TABLE, MANIFEST_TABLE))
+    cur.close()
+    con.commit()
+
+
+def file_hash(filepath, chunk_size=1 << 20):
+    '''sha256 of a file, read in chunks so large downloads aren't held in memory.'''
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def start_batch(con, dataset, parent_script, source_files=None):
+    '''Record the start of a load and return its batch_id. source_files are the local files (or
+       URLs) the data came from; files that exist on disk are hashed.'''
+    create_manifest_table(con)
+    source_files = [str(x) for x in (source_files or [])]
+    hashes = [file_hash(x) if os.path.isfile(x) else None for x in source_files]
+    cur = con.cursor()
+    cur.execute("""INSERT INTO {} (parent_script, dataset, source_files, source_hashes)
+                   VALUES (%s, %s, %s, %s) RETURNING batch_id""".format(MANIFEST_TABLE),
+                (parent_script, dataset, source_files, hashes))
+    batch_id = cur.fetchone()[0]
+    cur.close()
+    con.commit()
+    return batch_id
+
+
+def finish_batch(con, batch_id, row_counts=None, status='complete'):
+    '''Record the end of a load. row_counts is a dict of {table: number of rows loaded}.'''
+    row_counts = {k: int(v) for k, v in (row_counts or {}).items()}
+    cur = con.cursor()
+    cur.execute("""UPDATE {} SET finished = now(), row_counts = %s, status = %s
+                   WHERE batch_id = %s""".format(MANIFEST_TABLE),
+                (json.dumps(row_counts), status, batch_id))
+    cur.close()
+    con.commit()
+
+
+def migrate_to_batches(con, table, created_col='created', script_col='parent_script'):
+    '''Convert a table that still has per-row created/parent_script columns: each distinct
+       (created, parent_script) pair becomes a batch, the rows get its batch_id and the old
+       columns are dropped. Everything happens in one transaction.'''
+    create_manifest_table(con)
+    cur = con.cursor()
+    try:
+        cur.execute('ALTER TABLE {} ADD COLUMN IF NOT EXISTS {}'.format(table, BATCH_ID_COLUMN))
+        cur.execute("""WITH batches AS (
+                           INSERT INTO {m} (parent_script, dataset, started, finished, row_counts, status)
+                           SELECT {s}, %s, "{c}", "{c}", jsonb_build_object(%s, count(*)), 'migrated'
+                           FROM {t} GROUP BY "{c}", {s}
+                           RETURNING batch_id, parent_script, started)
+                       UPDATE {t} SET batch_id = b.batch_id FROM batches b
+                       WHERE {t}.{s} IS NOT DISTINCT FROM b.parent_script
+                       AND {t}."{c}" IS NOT DISTINCT FROM b.started""".format(
+                           m=MANIFEST_TABLE, t=table, c=created_col, s=script_col), (table, table))
+        cur.execute('ALTER TABLE {} DROP COLUMN "{}", DROP COLUMN {}'.format(table, created_col, script_col))
+        con.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print('Error migrating {}: {}'.format(table, error))
+        con.rollback()
+        cur.close()
+        return 1
+    print('Migrated {} to batch ids'.format(table))
+    cur.close()
+
+
+def legacy_tables(con):
+    '''The tables in the current schema that still have per-row metadata, as {table: created
+       column} (iod_2019 called it 'create'). Partitions are left to their parent.'''
+    cur = con.cursor()
+    cur.execute("""SELECT c.relname, min(a.attname) FILTER (WHERE a.attname IN ('created', 'create'))
+                   FROM pg_class c JOIN pg_attribute a ON a.attrelid = c.oid
+                   WHERE c.relnamespace = current_schema()::regnamespace AND c.relkind IN ('r', 'p')
+                   AND NOT c.relispartition AND NOT a.attisdropped
+                   GROUP BY c.relname
+                   HAVING bool_or(a.attname = 'parent_script') AND bool_or(a.attname IN ('created', 'create'))
+                   ORDER BY c.relname""")
+    out = dict(cur.fetchall())
+    cur.close()
+    return out
+
+
+def migrate_legacy_tables(con):
+    '''migrate_to_batches for every table that still has per-row metadata, so loads (which tag
+       rows with a batch_id) can go into them. Run it against the live schema before anything is
+       loaded or staged. Returns the tables that failed to migrate.'''
+    return [table for table, created_col in legacy_tables(con).items()
+            if migrate_to_batches(con, table, created_col=created_col)]
@@ -0,0 +1,127 @@
+# Simplified boundaries for maps. Full resolution (BFC) LAD boundaries are far more detailed than
+# a chart can show, and slow to draw, so each layer (LADs, and ITLs dissolved from them) is
+# simplified once at a few tolerances and stored in the boundary cache (see
+# utils/boundary_cache.py) as <stem>_<resolution>.parquet next to the shapefile:
+#   RESOLUTIONS = {'high': 20, 'medium': 100, 'low': 500}   - tolerances in metres (EPSG:27700)
+# The simplification keeps the layer's topology: shared edges are simplified once, the same way
+# on both sides, so neighbours still meet without gaps or overlaps (shapely.coverage_simplify,
+# shapely >= 2.1; older versions fall back to simplifying each polygon with preserve_topology).
+#
+# choropleth() picks the coarsest resolution whose tolerance is still under a pixel of the
+# output, so a small chart draws the 'low' layer and a poster the 'high' one.
+
+import os
+import shapely
+import geopandas as gpd
+from utils.boundary_cache import read_boundaries
+
+RESOLUTIONS = {'high': 20, 'medium': 100, 'low': 500}
+
+# the lad21_lookup columns to dissolve the LADs by, for each ITL level
+ITL_COLUMNS = {'itl3': ('itl321cd', 'itl321nm'),
+               'itl2': ('itl221cd', 'itl221nm'),
+               'itl1': ('itl121cd', 'itl121nm')}
+
+
+def simplify_layer(gdf, tolerance):
+    '''A copy of a GeoDataFrame of (non-overlapping) polygons simplified to tolerance, keeping
+       shared boundaries shared.'''
+    geoms = gdf.geometry.to_numpy()
+    if hasattr(shapely, 'coverage_simplify'):
+        simplified = shapely.coverage_simplify(geoms, tolerance)
+    else:
+        simplified = shapely.simplify(geoms, tolerance, preserve_topology=True)
+    return gdf.set_geometry(gpd.GeoSeries(simplified, index=gdf.index, crs=gdf.crs))
+
+
+def itl_layer(lads, lad21_lookup, level, lad_col='LAD21CD'):
+    '''ITL boundaries for a level, dissolved from the LAD boundaries. NB the Scottish LADs that are
+       split between ITL3s have no ITL in lad21_lookup, so their areas are left out.'''
+    cd, nm = ITL_COLUMNS[level]
+    lookup = lad21_lookup.loc[lad21_lookup[cd].notna(), ['lad21cd', cd, nm]]
+    merged = lads.merge(lookup, how='inner', left_on=lad_col, right_on='lad21cd')
+    return merged.dissolve(by=[cd, nm], as_index=False).loc[:, [cd, nm, 'geometry']]
+
+
+def resolution_path(filepath, resolution, layer=None):
+    '''The cache file of a layer at a resolution, e.g. LAD_DEC_2021_UK_BFC_medium.parquet, or
+       LAD_DEC_2021_UK_BFC_itl3_medium.parquet for an ITL layer dissolved from it.'''
+    stem = os.path.splitext(filepath)[0]
+    return '{}_{}.parquet'.format('_'.join([stem] + ([layer] if layer else [])), resolution)
+
+
+def build_resolutions(filepath, columns=None, lad21_lookup=None, resolutions=RESOLUTIONS, rebuild=False):
+    '''Write the simplified versions of a boundary shapefile (and, given lad21_lookup, of the ITL
+       levels dissolved from it), skipping any that are newer than the shapefile.
+       Returns {(layer, resolution): filepath}, with layer None for the shapefile's own layer.'''
+    outputs = {(None, x): resolution_path(filepath, x) for x in resolutions}
+    if lad21_lookup is not None:
+        outputs.update({(level, x): resolution_path(filepath, x, layer=level) for level in ITL_COLUMNS for x in resolutions})
+    todo = [k for k, v in outputs.items() if rebuild or not os.path.isfile(v) or os.path.getmtime(v) < os.path.getmtime(filepath)]
+    if not todo:
+        return outputs
+    layers = {None: read_boundaries(filepath, columns=columns)}
+    if lad21_lookup is not None:
+        for level in ITL_COLUMNS:
+            layers[level] = itl_layer(layers[None], lad21_lookup, level)
+    for layer, resolution in todo:
+        print('Simplifying {} to {}m'.format(layer or os.path.basename(filepath), resolutions[resolution]))
+        out = outputs[(layer, resolution)]
+        simplify_layer(layers[layer], resolutions[resolution]).to_parquet(out + '.tmp', index=False, write_covering_bbox=True)
+        os.replace(out + '.tmp', out)
+    return outputs
+
+
+def read_resolution(filepath, resolution, layer=None, columns=None, bbox=None):
+    '''Read a simplified layer written by build_resolutions, or the full resolution layer (through
+       the boundary cache) for resolution 'full'.'''
+    if resolution == 'full':
+        if layer is not None:
+            raise ValueError("Only the shapefile's own layer is kept at full resolution")
+        return read_boundaries(filepath, columns=columns, bbox=bbox)
+    if columns is not None:
+        columns = list(columns) + ['geometry']
+    gdf = gpd.read_parquet(resolution_path(filepath, resolution, layer=layer), columns=columns, bbox=bbox)
+    return gdf.drop(columns='bbox', errors='ignore')
+
+
+def write_postgis(outputs, engine, name, schema=None):
+    '''Copy the layers written by build_resolutions into PostGIS (needs geoalchemy2), as tables
+       <name>_<resolution> and <name>_<itl level>_<resolution>.'''
+    for (layer, resolution), path in outputs.items():
+        table = '_'.join([name] + ([layer] if layer else []) + [resolution])
+        gpd.read_parquet(path).to_postgis(table, engine, schema=schema, if_exists='replace', index=False)
+
+
+def pick_resolution(bounds, figsize, dpi=100, resolutions=RESOLUTIONS):
+    '''The coarsest resolution whose tolerance is under a pixel, for a map of bounds (xmin, ymin,
+       xmax, ymax, in metres) drawn at figsize (inches) and dpi. 'full' if none is fine enough.'''
+    xmin, ymin, xmax, ymax = bounds
+    # with an equal aspect ratio, the longer side of the extent (relative to the figure) sets the scale
+    metres_per_pixel = max((xmax - xmin) / (figsize[0] * dpi), (ymax - ymin) / (figsize[1] * dpi))
+    fine_enough = [(tolerance, name) for name, tolerance in resolutions.items() if tolerance <= metres_per_pixel]
+    return max(fine_enough)[1] if fine_enough else 'full'
+
+
+def choropleth(df, value_col, filepath, code_col='lad21cd', geo_code_col='LAD21CD', layer=None, ax=None,
+               figsize=(6, 8), dpi=100, bbox=None, resolution=None, title=None, cmap='viridis', **plot_kwargs):
+    '''Map value_col of df (one row per area, with the area code in code_col) on the boundaries
+       from filepath (geo_code_col holds the code; for an ITL layer, its code column, e.g. itl321cd).
+       The resolution is picked from the output size and the extent (bbox, or the whole layer),
+       unless given. The simplified layers need to have been built (build_resolutions).
+       Returns the matplotlib axes.'''
+    from matplotlib import pyplot as plt
+    if resolution is None:
+        extent = bbox or tuple(read_resolution(filepath, max(RESOLUTIONS, key=RESOLUTIONS.get), layer=layer,
+                                               columns=[geo_code_col]).total_bounds)
+        resolution = pick_resolution(extent, figsize, dpi=dpi)
+    areas = read_resolution(filepath, resolution, layer=layer, columns=[geo_code_col], bbox=bbox)
+    areas = areas.merge(df.loc[:, [code_col, value_col]], how='left', left_on=geo_code_col, right_on=code_col)
+    if ax is None:
+        fig, ax = plt.subplots(1, 1, figsize=figsize, dpi=dpi)
+    areas.plot(column=value_col, ax=ax, cmap=cmap, legend=True, linewidth=0.1, edgecolor='white',
+               missing_kwds={'color': 'lightgrey'}, **plot_kwargs)
+    ax.set_axis_off()
+    if title is not None:
+        ax.set_title(title)
+    return ax
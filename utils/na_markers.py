@@ -0,0 +1,123 @@
+# One decoder for the na markers and suppression codes in ONS, DLUHC, VOA and nomis tables, in
+# place of a na_values list per parse (which turned every marker into the same NaN, so a
+# suppressed value looked just like a missing one). decode() turns a column into:
+#   - the values, as float64, with NaN wherever there's no number
+#   - a uint8 status per value saying why: STATUS_OK for a number, otherwise the code of the
+#     marker it held (STATUS_LABELS has the meanings), STATUS_BLANK for an empty cell and
+#     STATUS_UNRECOGNISED for any other text
+# Markers are matched case-insensitively after stripping, e.g. 'NIL' and 'Nil' are both STATUS_NIL.
+# The work is done once per distinct value of the column (as in utils/ons_columns.py).
+#
+# For CSVs, read the value columns as (Arrow) strings with string_dtypes() and decode each chunk
+# as it's read (chunk_transform(decode=...) in utils/streaming.py), so the raw column never
+# becomes an object column and the decoded one is typed straight away.
+
+import numpy as np
+import pandas as pd
+from utils.ons_columns import STRING_DTYPE, as_strings
+
+STATUS_OK = 0
+STATUS_BLANK = 1
+STATUS_NOT_AVAILABLE = 2
+STATUS_CONFIDENTIAL = 3
+STATUS_UNRELIABLE = 4
+STATUS_WITHHELD = 5
+STATUS_LOW = 6
+STATUS_NOT_APPLICABLE = 7
+STATUS_NIL = 8
+STATUS_TERMINATED = 9
+STATUS_UNRECOGNISED = 255
+
+STATUS_LABELS = {STATUS_OK: 'ok',
+                 STATUS_BLANK: 'blank',
+                 STATUS_NOT_AVAILABLE: 'not available',
+                 STATUS_CONFIDENTIAL: 'confidential (suppressed to avoid disclosure)',
+                 STATUS_UNRELIABLE: 'low reliability',
+                 STATUS_WITHHELD: 'withheld (too few cases)',
+                 STATUS_LOW: 'rounds to zero',
+                 STATUS_NOT_APPLICABLE: 'not applicable',
+                 STATUS_NIL: 'nil or negligible',
+                 STATUS_TERMINATED: 'terminated',
+                 STATUS_UNRECOGNISED: 'unrecognised text'}
+
+# every marker seen in the sources, lower case
+MARKERS = {':': STATUS_NOT_AVAILABLE,           # ONS
+           '[x]': STATUS_NOT_AVAILABLE,         # ONS, DLUHC, DfT
+           'not available': STATUS_NOT_AVAILABLE,
+           '#n/a': STATUS_NOT_AVAILABLE,
+           '!': STATUS_NOT_AVAILABLE,           # nomis: sample size zero or disclosive
+           'c': STATUS_CONFIDENTIAL,            # ONS business demography, FDI
+           '[c]': STATUS_CONFIDENTIAL,
+           '..': STATUS_CONFIDENTIAL,           # VOA
+           '[u]': STATUS_UNRELIABLE,
+           '*': STATUS_UNRELIABLE,              # nomis: small sample
+           '#': STATUS_UNRELIABLE,              # nomis
+           '[w]': STATUS_WITHHELD,
+           '[low]': STATUS_LOW,
+           '[z]': STATUS_NOT_APPLICABLE,
+           '.': STATUS_NOT_APPLICABLE,          # VOA
+           '-': STATUS_NIL,                     # VOA, nomis
+           'nil': STATUS_NIL,                   # UK Finance
+           'terminated': STATUS_TERMINATED}
+
+
+def string_dtypes(columns):
+    '''read_csv dtypes for the columns to decode, so they're read as (Arrow) strings however
+       their markers fall across the chunks.'''
+    return {col: STRING_DTYPE for col in columns}
+
+
+def _decode_uniques(uniques, markers):
+    # the value and status of each distinct value: numbers (and numeric strings) first, then only
+    # what's left is matched against the markers as (Arrow) strings
+    numbers = pd.to_numeric(uniques, errors='coerce').astype('float64')
+    status = np.full(len(uniques), STATUS_OK, dtype=np.uint8)
+    rest = numbers.isna().to_numpy()
+    if rest.any():
+        strings = as_strings(uniques[rest])
+        keys = strings.str.strip().str.lower()
+        codes = keys.map(markers).astype('float64').fillna(STATUS_UNRECOGNISED)
+        status[rest] = codes.where(strings.notna() & (keys != ''), STATUS_BLANK).to_numpy()
+    return numbers.to_numpy(), status
+
+
+def decode(series, markers=MARKERS):
+    '''Decode a column of numbers and markers. Returns (values, status): a float64 Series with
+       NaN for every marker or blank, and a uint8 Series of status codes (see STATUS_LABELS).'''
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        values = series.astype('float64')
+        status = np.where(values.isna(), STATUS_BLANK, STATUS_OK).astype(np.uint8)
+        return values, pd.Series(status, index=series.index, name=series.name)
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    numbers, status = _decode_uniques(pd.Series(uniques), markers)
+    return (pd.Series(numbers[codes], index=series.index, name=series.name),
+            pd.Series(status[codes], index=series.index, name=series.name))
+
+
+def decode_array(values, markers=MARKERS):
+    '''decode() for a 2-d block of values (e.g. the body of a wide sheet). Returns (values,
+       status) as float64 and uint8 arrays of the same shape.'''
+    values = np.asarray(values, dtype=object)
+    decoded, status = decode(pd.Series(values.ravel()), markers=markers)
+    return decoded.to_numpy().reshape(values.shape), status.to_numpy().reshape(values.shape)
+
+
+def decode_frame(df, columns=None, suffix='_status', markers=MARKERS):
+    '''A copy of df with columns decoded, each followed by a uint8 <column><suffix> status column.
+       By default the columns are all those holding only numbers, markers and blanks (with at
+       least one number or marker), e.g. the value columns of a wide table.'''
+    out = {}
+    for col in df.columns:
+        if columns is None or col in columns:
+            values, status = decode(df[col], markers=markers)
+            if columns is not None or ((status != STATUS_UNRECOGNISED).all() and (status != STATUS_BLANK).any()):
+                out[col], out[str(col) + suffix] = values, status
+                continue
+        out[col] = df[col]
+    return pd.DataFrame(out, index=df.index)
+
+
+def summarise(status):
+    '''Counts of each status in a status column (or array), by label.'''
+    counts = pd.Series(np.asarray(status).ravel()).value_counts()
+    return counts.rename(index=STATUS_LABELS).rename('count')
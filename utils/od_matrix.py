@@ -0,0 +1,210 @@
+# A sparse origin-destination store for the internal migration estimates (moves by origin LA,
+# destination LA, sex and single year of age; ~10m rows of which most pairs of LAs are empty).
+# Rather than one big long frame with the LA names merged on, the moves are kept as one sparse
+# (origin x destination) matrix per (sex, age band), with the LAs integer-coded against a fixed
+# index, and built chunk by chunk straight from the CSVs, so no string columns are ever held.
+# Moves to or from anywhere outside that index (e.g. cross-border moves, when the index is GB
+# LAs) are kept under one 'other' area at the end of it, so the LAs' inflows and outflows still
+# include them.
+#
+# Queries are sparse sums and products:
+#   net_flows        - inflows, outflows and net flows per LA
+#   top_destinations - the largest destinations from an LA
+#   age_rollup       - net flows by coarser age bands
+#   rollup           - the OD matrix between ITLs (or regions), via a GeographyRollup's matrix
+# and the store goes to Parquet (to_frame / from_frame, the non-zero cells in long form with
+# categorical codes) or to a compact Postgres table of geography ids (to_postgres).
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from scipy import sparse
+from utils.geography_dimension import register_geographies, create_named_view
+from utils.streaming import copy_chunks
+
+# the lower bound of each stored age band (0-4, 5-9, ... 85-89, 90+)
+AGE_BANDS = list(range(0, 95, 5))
+# the code of the area that stands for everywhere outside the areas
+OTHER_AREA = 'other'
+
+
+class MigrationOD:
+    '''Sparse OD matrices of moves, one per (sex, age band), over a fixed index of areas.'''
+
+    def __init__(self, areas, sexes, age_bands=AGE_BANDS, matrices=None):
+        self.areas = pd.Index(areas, name='code')
+        self.sexes = list(sexes)
+        self.age_bands = list(age_bands)
+        shape = (len(self.areas), len(self.areas))
+        self.matrices = matrices or {(s, b): sparse.csr_matrix(shape, dtype=np.float64)
+                                     for s in self.sexes for b in self.age_bands}
+
+    @classmethod
+    def from_chunks(cls, chunks, areas, sexes=None, age_bands=AGE_BANDS, origin_col='outla', destination_col='inla',
+                    sex_col='sex', age_col='age', value_col='moves', other=OTHER_AREA):
+        '''Build the store from an iterable of chunks of the long data (e.g. iter_csv_chunks).
+           Only the integer codes of each chunk are kept. Moves to or from areas not in areas go
+           to the other area, added at the end of the areas (or with other=None are dropped, and
+           counted).'''
+        areas = pd.Index(areas)
+        if other is not None:
+            areas = areas.append(pd.Index([other]))
+        starts = np.asarray(age_bands)
+        parts = []
+        dropped = 0
+        for chunk in chunks:
+            o = areas.get_indexer(chunk[origin_col])
+            d = areas.get_indexer(chunk[destination_col])
+            if other is not None:
+                o[o < 0] = len(areas) - 1
+                d[d < 0] = len(areas) - 1
+            ok = (o >= 0) & (d >= 0)
+            dropped += (~ok).sum()
+            parts.append(pd.DataFrame({'o': o[ok].astype(np.int32), 'd': d[ok].astype(np.int32),
+                                       'sex': chunk[sex_col].to_numpy()[ok],
+                                       'band': starts[np.searchsorted(starts, chunk[age_col].to_numpy()[ok], side='right') - 1],
+                                       'moves': chunk[value_col].to_numpy(dtype=np.float32)[ok]}))
+        if dropped:
+            print('Dropped {} rows with an origin or destination outside the areas'.format(dropped))
+        coo = pd.concat(parts, ignore_index=True)
+        if sexes is None:
+            sexes = sorted(coo['sex'].unique())
+        out = cls(areas, sexes, age_bands=age_bands)
+        out._fill(coo)
+        return out
+
+    def _fill(self, coo):
+        # one sparse matrix per (sex, band); repeated (origin, destination) cells are summed
+        shape = (len(self.areas), len(self.areas))
+        for (s, b), group in coo.groupby(['sex', 'band'], sort=False):
+            self.matrices[(s, b)] = sparse.csr_matrix((group['moves'].to_numpy(dtype=np.float64),
+                                                       (group['o'].to_numpy(), group['d'].to_numpy())), shape=shape)
+
+    def total(self, sexes=None, age_bands=None):
+        '''The OD matrix summed over some sexes and age bands (all of them by default).'''
+        sexes = self.sexes if sexes is None else list(sexes)
+        age_bands = self.age_bands if age_bands is None else list(age_bands)
+        out = sparse.csr_matrix((len(self.areas), len(self.areas)), dtype=np.float64)
+        for s in sexes:
+            for b in age_bands:
+                out = out + self.matrices[(s, b)]
+        return out
+
+    def net_flows(self, sexes=None, age_bands=None):
+        '''Inflow, outflow and net flow per area (moves within an area are left out).'''
+        m = self.total(sexes=sexes, age_bands=age_bands)
+        within = m.diagonal()
+        inflow = np.asarray(m.sum(axis=0)).ravel() - within
+        outflow = np.asarray(m.sum(axis=1)).ravel() - within
+        return pd.DataFrame({'inflow': inflow, 'outflow': outflow, 'net': inflow - outflow}, index=self.areas)
+
+    def top_destinations(self, origin, n=10, sexes=None, age_bands=None):
+        '''The n largest destinations of moves from an area, largest first.'''
+        row = self.total(sexes=sexes, age_bands=age_bands).getrow(self.areas.get_loc(origin))
+        keep = row.indices != self.areas.get_loc(origin)
+        cols, moves = row.indices[keep], row.data[keep]
+        order = np.argsort(-moves, kind='stable')[:n]
+        return pd.Series(moves[order], index=pd.Index(self.areas[cols[order]], name='destination'), name='moves')
+
+    def age_rollup(self, bands=(0, 15, 25, 45, 65), sexes=None):
+        '''Net flows per area by coarser age bands, given by their lower bounds, each of which
+           must start a stored band. Returns a long dataframe of code, age_band, inflow, outflow, net.'''
+        bands = sorted(bands)
+        missing = [x for x in bands if x not in self.age_bands]
+        if missing:
+            raise ValueError('{} are not the start of a stored age band'.format(missing))
+        out = []
+        for i, lower in enumerate(bands):
+            upper = bands[i + 1] if i + 1 < len(bands) else np.inf
+            flows = self.net_flows(sexes=sexes, age_bands=[b for b in self.age_bands if lower <= b < upper])
+            flows.insert(0, 'age_band', lower)
+            out.append(flows.reset_index())
+        return pd.concat(out, ignore_index=True)
+
+    def rollup(self, geography_rollup, level, sexes=None, age_bands=None):
+        '''The OD matrix between the parents at a level of a GeographyRollup (R M R'), as a
+           dataframe indexed by origin parent with a column per destination parent.'''
+        r = geography_rollup.matrices[level]
+        # the rollup's columns, in the order of this store's areas (zero for areas it doesn't have)
+        positions = geography_rollup.lads.get_indexer(self.areas)
+        select = sparse.csr_matrix((np.ones((positions >= 0).sum()), (positions[positions >= 0], np.flatnonzero(positions >= 0))),
+                                   shape=(len(geography_rollup.lads), len(self.areas)))
+        r = r @ select
+        m = r @ self.total(sexes=sexes, age_bands=age_bands) @ r.T
+        codes = geography_rollup.parents[level].iloc[:, 0]
+        return pd.DataFrame(m.toarray(), index=pd.Index(codes, name='origin'), columns=pd.Index(codes, name='destination'))
+
+    def to_frame(self):
+        '''The non-zero cells in long form: origin, destination (categoricals over the areas),
+           sex, age_band and moves.'''
+        parts = []
+        for (s, b), m in self.matrices.items():
+            coo = m.tocoo()
+            parts.append(pd.DataFrame({'origin': coo.row.astype(np.int32), 'destination': coo.col.astype(np.int32),
+                                       'sex': s, 'age_band': np.int16(b), 'moves': coo.data.astype(np.float32)}))
+        df = pd.concat(parts, ignore_index=True)
+        for col in ['origin', 'destination']:
+            df[col] = pd.Categorical.from_codes(df[col].to_numpy(), categories=self.areas)
+        df['sex'] = pd.Categorical(df['sex'], categories=self.sexes)
+        df['age_band'] = df['age_band'].astype(np.int16)
+        return df
+
+    @classmethod
+    def from_frame(cls, df, age_bands=AGE_BANDS):
+        '''Rebuild the store from to_frame's output (e.g. read back from Parquet). The origin,
+           destination and sex columns needn't still be categoricals (a round trip can lose that,
+           e.g. for a numeric sex), but then only the areas and sexes with moves come back.'''
+        if isinstance(df['origin'].dtype, pd.CategoricalDtype):
+            areas = df['origin'].cat.categories
+        else:
+            areas = pd.Index(pd.concat([df['origin'], df['destination']]).unique()).sort_values()
+        sex = pd.Categorical(df['sex'])
+        out = cls(areas, sex.categories, age_bands=age_bands)
+        out._fill(pd.DataFrame({'o': pd.Categorical(df['origin'], categories=areas).codes,
+                                'd': pd.Categorical(df['destination'], categories=areas).codes,
+                                'sex': np.asarray(sex), 'band': df['age_band'].to_numpy(), 'moves': df['moves'].to_numpy()}))
+        return out
+
+    def to_parquet(self, filepath):
+        self.to_frame().to_parquet(filepath, index=False)
+
+    @classmethod
+    def read_parquet(cls, filepath, age_bands=AGE_BANDS):
+        return cls.from_frame(pd.read_parquet(filepath), age_bands=age_bands)
+
+    def to_postgres(self, con, table, vintage=2021):
+        '''Replace a compact Postgres table of the non-zero cells: origin and destination as ids in
+           the geography dimension (with a <table>_named view of the codes and names), sex,
+           age_band and moves. Returns the number of rows.'''
+        lads = self.areas[self.areas != OTHER_AREA]
+        ids = register_geographies(con, pd.Series(lads), entity='lad', vintage=vintage)
+        if len(lads) < len(self.areas):
+            ids = pd.concat([ids, register_geographies(con, [OTHER_AREA], names=['Outside the areas'])])
+        area_ids = ids.reindex(self.areas).to_numpy()
+        cur = con.cursor()
+        try:
+            cur.execute('DROP TABLE IF EXISTS {} CASCADE'.format(table))
+            cur.execute("""CREATE TABLE {} (
+                        origin_lad{v}_id INTEGER,
+                        destination_lad{v}_id INTEGER,
+                        sex VARCHAR,
+                        age_band SMALLINT,
+                        moves REAL,
+                        PRIMARY KEY (origin_lad{v}_id, destination_lad{v}_id, sex, age_band))""".format(table, v=vintage % 100))
+        except (Exception, psycopg2.DatabaseError) as error:
+            print('Error creating {}: {}'.format(table, error))
+            con.rollback()
+            cur.close()
+            raise
+        cur.close()
+
+        def chunks():
+            for (s, b), m in self.matrices.items():
+                coo = m.tocoo()
+                yield pd.DataFrame({'origin_lad{}_id'.format(vintage % 100): area_ids[coo.row],
+                                    'destination_lad{}_id'.format(vintage % 100): area_ids[coo.col],
+                                    'sex': s, 'age_band': b, 'moves': coo.data})
+        rows = copy_chunks(chunks(), table, con)
+        create_named_view(con, table, {'origin_lad{}cd'.format(vintage % 100): 'origin_lad{}nm'.format(vintage % 100),
+                                       'destination_lad{}cd'.format(vintage % 100): 'destination_lad{}nm'.format(vintage % 100)})
+        return rows
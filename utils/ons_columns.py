@@ -0,0 +1,82 @@
+# Vectorised versions of the column clean-ups most ONS (and nomis) tables need, in place of
+# per-row lambdas and list comprehensions:
+#   split_code_name - 'E06000001: Hartlepool' -> code and name columns
+#   extract_year    - '2019-20', 'Apr 2019-Mar 2020', '2021-06' -> 2019, 2019, 2021
+#   parse_percentile - '10 percentile', 'Median' -> 10, 50 (ASHE item names)
+#   replace_markers - ':', '[x]', 'c' etc. -> NaN, then numeric
+#   snake_case      - 'SIC07 industry code' -> 'sic07_industry_code'
+# ONS columns repeat a few values (periods, item names, a few hundred area codes) over many rows,
+# so each column is factorized and the string work (the .str methods, on Arrow-backed strings) is
+# done once per distinct value, then taken back out to the rows with the integer codes.
+# benchmark_ons_columns.py times them against the lambdas they replace.
+
+import importlib.util
+import pandas as pd
+
+# Arrow-backed strings where pyarrow is installed (it's only needed by pandas, not imported here)
+STRING_DTYPE = 'string[pyarrow]' if importlib.util.find_spec('pyarrow') is not None else 'string'
+
+YEAR_PATTERN = r'([0-9]{4})'
+PERCENTILE_PATTERN = r'^\s*([0-9]{1,2})'
+
+
+def as_strings(series):
+    '''A Series as (Arrow-backed, where pyarrow is installed) strings, with missing values kept
+       missing. Already-string Series are returned as they are.'''
+    if isinstance(series.dtype, pd.StringDtype) or str(series.dtype).startswith('string'):
+        return series
+    return series.astype(STRING_DTYPE)
+
+
+def _by_value(series, func):
+    # func (vectorised, on a Series of strings) applied to the distinct values of series only
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    out = func(as_strings(pd.Series(uniques))).take(codes)
+    out.index = series.index
+    return out
+
+
+def _to_int(values):
+    # plain ints when nothing is missing, so fillna(AsIs('NULL')) and psycopg2 work as usual
+    values = pd.to_numeric(values)
+    return values.astype('int64') if values.notna().all() else values.astype('float64')
+
+
+def split_code_name(series, sep=':'):
+    '''Split 'CODE: Name' strings at the first sep into a dataframe of code and name, both
+       stripped (a name with sep in it is kept whole). Values without sep get a NaN name.'''
+    def split(strings):
+        parts = strings.str.split(sep, n=1, expand=True)
+        for col in [0, 1]:
+            if col not in parts.columns:
+                parts[col] = pd.Series(pd.NA, index=parts.index, dtype=STRING_DTYPE)
+        return pd.DataFrame({'code': parts[0].str.strip(), 'name': parts[1].str.strip()})
+    return _by_value(series, split)
+
+
+def extract_year(series):
+    '''The first four digit year in each value (a period like '2019-20', a date string, or a year).'''
+    if pd.api.types.is_integer_dtype(series):
+        return series.astype('int64')
+    return _by_value(series, lambda s: _to_int(s.str.extract(YEAR_PATTERN, expand=False)))
+
+
+def parse_percentile(series, median='Median'):
+    '''The percentile in an ASHE item name, e.g. '10 percentile' -> 10, with median -> 50.'''
+    return _by_value(series, lambda s: _to_int(s.str.replace(median, '50', regex=False)
+                                                .str.extract(PERCENTILE_PATTERN, expand=False)))
+
+
+def replace_markers(series, markers):
+    '''Replace the given na markers (e.g. [':', '[x]']) with NaN and make the rest numeric.'''
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    def numeric(strings):
+        strings = strings.str.strip()
+        return pd.to_numeric(strings.where(~strings.isin(markers)), errors='coerce').astype('float64')
+    return _by_value(series, numeric)
+
+
+def snake_case(columns):
+    '''Column names stripped, lower case and with spaces as underscores.'''
+    return pd.Index(columns).astype(str).str.strip().str.lower().str.replace(' ', '_', regex=False)
@@ -0,0 +1,144 @@
+# Load several independent tables at once. A batch of (dataframe, table) jobs is spread over a
+# pool of connections, a few at a time, instead of loading each table in turn over a single
+# connection.
+#
+# With atomic=True the jobs are first loaded into copies of the tables in a staging schema of
+# their own (so concurrent or nested loads can't drop each other's). Only if every job succeeds
+# are the rows moved into the live tables, all in one transaction; otherwise nothing in the live
+# tables changes.
+
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+import psycopg2.extras as extras
+from psycopg2.pool import ThreadedConnectionPool
+from utils.partitions import PARTITION_COLUMN, relation_kind, load_partitions, create_partitions
+
+# each atomic load stages into <STAGING_PREFIX>_<pid>_<random suffix>
+STAGING_PREFIX = 'staging_load'
+
+
+def staging_schema():
+    '''A new staging schema name, for one atomic load.'''
+    return '{}_{}_{}'.format(STAGING_PREFIX, os.getpid(), uuid.uuid4().hex[:8])
+
+
+def insert_rows(df, table, con):
+    '''Insert a dataframe into a table in one transaction. Unlike the scripts' execute_values(),
+       errors are raised rather than printed, so the caller knows the load failed.'''
+    cols = ','.join(list(df.columns))
+    cur = con.cursor()
+    try:
+        extras.execute_values(cur, 'INSERT INTO {}({}) VALUES %s'.format(table, cols),
+                              list(df.itertuples(index=False, name=None)), page_size=1000)
+        con.commit()
+    except (Exception, psycopg2.DatabaseError):
+        con.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def load_table(df, table, con):
+    '''Load one table: a partition swap for each year of a partitioned table, a plain insert otherwise.'''
+    if relation_kind(con, table) == 'p':
+        if load_partitions(df=df, table=table, con=con):
+            raise RuntimeError('Loading {} failed'.format(table))
+    else:
+        insert_rows(df, table, con)
+
+
+def _stage(df, table, con, schema):
+    # an unpartitioned copy of the live table, which is fine for holding one load
+    staged = '{}.{}'.format(schema, table)
+    cur = con.cursor()
+    cur.execute('DROP TABLE IF EXISTS {}'.format(staged))
+    cur.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS)'.format(staged, table))
+    con.commit()
+    cur.close()
+    insert_rows(df, staged, con)
+
+
+def _publish(con, tables, schema):
+    '''Move every staged table into its live table in a single transaction. Years that were
+       staged replace the same years in partitioned tables (creating their partitions, for years
+       the table doesn't have yet).'''
+    cur = con.cursor()
+    try:
+        for table in tables:
+            staged = '{}.{}'.format(schema, table)
+            cur.execute('SELECT attname FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped', (staged,))
+            cols = ', '.join([x[0] for x in cur.fetchall()])
+            if relation_kind(con, table) == 'p':
+                cur.execute('SELECT DISTINCT {} FROM {}'.format(PARTITION_COLUMN, staged))
+                create_partitions(con, table, [x[0] for x in cur.fetchall()], commit=False)
+                cur.execute('DELETE FROM {} WHERE {} IN (SELECT DISTINCT {} FROM {})'.format(
+                    table, PARTITION_COLUMN, PARTITION_COLUMN, staged))
+            cur.execute('INSERT INTO {} ({}) SELECT {} FROM {}'.format(table, cols, cols, staged))
+            cur.execute('DROP TABLE {}'.format(staged))
+        con.commit()
+    except (Exception, psycopg2.DatabaseError):
+        con.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def load_tables(jobs, params, max_workers=4, atomic=False):
+    '''Load a list of (dataframe, table) jobs concurrently, over at most max_workers connections.
+       params are the connection parameters from utils.db_config.config.
+       With atomic=True, either every table is loaded or none are (see the notes at the top).
+       Returns the list of tables that failed to load (empty if everything went in).'''
+    jobs = list(jobs)
+    pool = ThreadedConnectionPool(1, max_workers, **params)
+    if atomic:
+        schema = staging_schema()
+        con = pool.getconn()
+        cur = con.cursor()
+        cur.execute('CREATE SCHEMA {}'.format(schema))
+        con.commit()
+        cur.close()
+        pool.putconn(con)
+
+    def run(job):
+        df, table = job
+        con = pool.getconn()
+        try:
+            if atomic:
+                _stage(df, table, con, schema)
+            else:
+                load_table(df, table, con)
+            print('Loaded {} ({} rows)'.format(table, len(df)))
+            return None
+        except (Exception, psycopg2.DatabaseError) as error:
+            print('Error loading {}: {}'.format(table, error))
+            return table
+        finally:
+            pool.putconn(con)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            failed = [x for x in executor.map(run, jobs) if x is not None]
+        if atomic:
+            tables = [table for df, table in jobs]
+            con = pool.getconn()
+            try:
+                if failed:
+                    print('Not publishing any of {}: {} failed'.format(', '.join(tables), ', '.join(failed)))
+                    failed = tables
+                else:
+                    try:
+                        _publish(con, tables, schema)
+                    except (Exception, psycopg2.DatabaseError) as error:
+                        print('Error publishing {}: {}'.format(', '.join(tables), error))
+                        failed = tables
+                cur = con.cursor()
+                cur.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(schema))
+                con.commit()
+                cur.close()
+            finally:
+                pool.putconn(con)
+    finally:
+        pool.closeall()
+    return failed
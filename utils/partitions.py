@@ -0,0 +1,179 @@
+# Year-partitioned fact tables. Most datasets are released (and reloaded) one year at a time,
+# so the big fact tables are declaratively partitioned by year, one partition per year:
+#   - queries filtered by year only scan the partitions they need
+#   - reloading a year loads a fresh table and swaps it in for the old partition, in one short
+#     transaction, instead of deleting and re-inserting rows in the live table
+#
+# Partitions are named <table>_y<year> and created automatically as years turn up.
+
+import re
+import itertools
+import psycopg2
+import psycopg2.extras as extras
+from utils.schema import qualified
+from utils.streaming import copy_chunks
+
+PARTITION_COLUMN = 'year'
+
+
+def partition_name(table, year):
+    return '{}_y{}'.format(table, int(year))
+
+
+def relation_kind(con, table):
+    '''pg_class.relkind for the table: 'r' for an ordinary table, 'p' for a partitioned one, or None.'''
+    cur = con.cursor()
+    cur.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', (qualified(con, table),))
+    row = cur.fetchone()
+    cur.close()
+    return None if row is None else row[0]
+
+
+def list_partitions(con, table):
+    '''The partitions of a table, as {year: partition name}.'''
+    cur = con.cursor()
+    cur.execute("""SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                   WHERE i.inhparent = to_regclass(%s)""", (qualified(con, table),))
+    names = [x[0] for x in cur.fetchall()]
+    cur.close()
+    out = {}
+    for name in names:
+        m = re.search('_y([0-9]{4})$', name)
+        if m is not None:
+            out[int(m.group(1))] = name
+    return out
+
+
+def create_partitions(con, table, years, commit=True):
+    '''Create any missing partitions for the given years. With commit=False they're created in
+       the caller's open transaction, e.g. to publish rows into them in the same one.'''
+    existing = list_partitions(con, table)
+    cur = con.cursor()
+    for year in sorted({int(x) for x in years} - set(existing)):
+        cur.execute('CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES IN ({})'.format(
+            partition_name(table, year), table, year))
+    cur.close()
+    if commit:
+        con.commit()
+
+
+def convert_to_partitioned(con, table):
+    '''Turn an existing (unpartitioned) table into a year-partitioned one with the same columns,
+       defaults, constraints and indexes, moving its rows across in one transaction.'''
+    cur = con.cursor()
+    try:
+        cur.execute('ALTER TABLE {} RENAME TO {}_unpartitioned'.format(table, table))
+        cur.execute('CREATE TABLE {} (LIKE {}_unpartitioned INCLUDING ALL) PARTITION BY LIST ({})'.format(
+            table, table, PARTITION_COLUMN))
+        cur.execute('SELECT DISTINCT {} FROM {}_unpartitioned'.format(PARTITION_COLUMN, table))
+        for (year,) in cur.fetchall():
+            cur.execute('CREATE TABLE {} PARTITION OF {} FOR VALUES IN ({})'.format(partition_name(table, year), table, int(year)))
+        cur.execute('INSERT INTO {} SELECT * FROM {}_unpartitioned'.format(table, table))
+        cur.execute('DROP TABLE {}_unpartitioned CASCADE'.format(table))
+        con.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print('Error partitioning {}: {}'.format(table, error))
+        con.rollback()
+        cur.close()
+        return 1
+    print('Partitioned {} by {}'.format(table, PARTITION_COLUMN))
+    cur.close()
+
+
+def swap_partition(con, df, table, year):
+    '''Replace one year of a partitioned table with the rows in df.
+       The rows are loaded into a new table first, then the old partition is detached and
+       the new one attached in a single short transaction, so readers see either the old or the
+       new year in full, and never wait on the load itself.'''
+    year = int(year)
+    name = partition_name(table, year)
+    staging = name + '_new'
+    cols = ','.join(list(df.columns))
+    cur = con.cursor()
+    try:
+        # load the new partition. The CHECK constraint lets ATTACH skip scanning it
+        cur.execute('DROP TABLE IF EXISTS {}'.format(staging))
+        cur.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(staging, table))
+        cur.execute('ALTER TABLE {} ADD CONSTRAINT {}_year_check CHECK ({} IS NOT NULL AND {} = {})'.format(
+            staging, staging, PARTITION_COLUMN, PARTITION_COLUMN, year))
+        extras.execute_values(cur, 'INSERT INTO {}({}) VALUES %s'.format(staging, cols),
+                              list(df.itertuples(index=False, name=None)), page_size=1000)
+        con.commit()
+
+        # and swap it in
+        if year in list_partitions(con, table):
+            cur.execute('ALTER TABLE {} DETACH PARTITION {}'.format(table, name))
+            cur.execute('DROP TABLE {}'.format(name))
+        cur.execute('ALTER TABLE {} ATTACH PARTITION {} FOR VALUES IN ({})'.format(table, staging, year))
+        cur.execute('ALTER TABLE {} DROP CONSTRAINT {}_year_check'.format(staging, staging))
+        cur.execute('ALTER TABLE {} RENAME TO {}'.format(staging, name))
+        # the indexes ATTACH created are named after the staging table, so rename them too
+        cur.execute('SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = to_regclass(%s)', (name,))
+        for (index,) in cur.fetchall():
+            if staging in index:
+                cur.execute('ALTER INDEX {} RENAME TO {}'.format(index, index.replace(staging, name)))
+        con.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print('Error swapping in {}: {}'.format(name, error))
+        con.rollback()
+        cur.execute('DROP TABLE IF EXISTS {}'.format(staging))
+        con.commit()
+        cur.close()
+        return 1
+    cur.close()
+
+
+def load_partitions(df, table, con):
+    '''Load a dataframe into a year-partitioned table, replacing each year it contains with a
+       partition swap. A table that exists but isn't partitioned yet is converted first.
+       Returns 1 if the conversion or any year's swap failed, so the caller can mark the load
+       failed.'''
+    if relation_kind(con, table) == 'r' and convert_to_partitioned(con, table):
+        return 1
+    errors = 0
+    for year, year_df in df.groupby(PARTITION_COLUMN):
+        errors += swap_partition(con, year_df, table, year) or 0
+    if errors:
+        return 1
+    print('load_partitions() done: {} ({} years)'.format(table, df[PARTITION_COLUMN].nunique()))
+
+
+def copy_partitions(chunks, table, con, create_table=None):
+    '''Load an iterable of dataframes (e.g. from iter_csv_chunks) into a year-partitioned table
+       without holding them all in memory: the chunks are COPYed into a temporary table one at a
+       time, then the years they contain replace the same years of the table in one transaction
+       (creating their partitions as needed). A table that isn't partitioned yet is converted
+       first. create_table, if given, is called as create_table(con, first_chunk) before that, as
+       in utils.streaming.copy_chunks. Returns the number of rows; errors roll back the load and
+       are re-raised.'''
+    if create_table is not None:
+        chunks = iter(chunks)
+        first = next(chunks, None)
+        if first is not None:
+            create_table(con, first)
+            chunks = itertools.chain([first], chunks)
+    if relation_kind(con, table) == 'r' and convert_to_partitioned(con, table):
+        raise RuntimeError('Could not partition {}'.format(table))
+    loading = '{}_load'.format(table)
+    cur = con.cursor()
+    cur.execute('DROP TABLE IF EXISTS pg_temp.{}'.format(loading))
+    cur.execute('CREATE TEMPORARY TABLE {} (LIKE {} INCLUDING DEFAULTS)'.format(loading, table))
+    con.commit()
+    try:
+        rows = copy_chunks(chunks, loading, con)
+        cur.execute('SELECT DISTINCT {} FROM {}'.format(PARTITION_COLUMN, loading))
+        create_partitions(con, table, [x[0] for x in cur.fetchall()], commit=False)
+        cur.execute('DELETE FROM {} WHERE {} IN (SELECT DISTINCT {} FROM {})'.format(
+            table, PARTITION_COLUMN, PARTITION_COLUMN, loading))
+        cur.execute('INSERT INTO {} SELECT * FROM {}'.format(table, loading))
+        con.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print('Error loading {}: {}'.format(table, error))
+        con.rollback()
+        raise
+    finally:
+        cur.execute('DROP TABLE IF EXISTS pg_temp.{}'.format(loading))
+        con.commit()
+        cur.close()
+    print('copy_partitions() done: {} ({} rows)'.format(table, rows))
+    return rows
@@ -0,0 +1,63 @@
+# Helpers to map postcode sectors and districts to local authorities.
+# The ONS postcode lookup has ~2.7m rows, so everything here is vectorised and the
+# (small) result is cached as a CSV next to the source file.
+
+import os
+import re
+import pandas as pd
+
+# One pattern for both levels. The district (outward code) is 1-2 letters followed by either
+# 1-2 digits or a digit and a letter, and the sector adds the first digit of the inward code.
+# e.g. 'AB10 1AA' -> district 'AB10', sector 'AB10 1'; 'EC1A 1BB' -> 'EC1A', 'EC1A 1'
+POSTCODE_PATTERN = re.compile(r'^(?P<sector>(?P<district>[A-Z]{1,2}(?:[0-9]{1,2}|[0-9][A-Z])) [0-9])')
+
+
+def extract_postcode_parts(pcds):
+    '''Split a Series of postcodes (in the 'pcds' format, i.e. with a single space) into sector and
+       district with a single vectorised regex pass. Unmatched postcodes get NaN.'''
+    return pcds.str.extract(POSTCODE_PATTERN, expand=True)
+
+
+def build_postcode_to_lad(pcode_lookup, level='sector', lad_col='ladcd', weights=None):
+    '''Derive a lookup from postcode sector (or district) to the modal LAD.
+       pcode_lookup needs a 'pcds' column and lad_col. By default each postcode counts once; pass
+       weights (a column name or a Series aligned with pcode_lookup, e.g. population) to pick the
+       LAD holding the largest share of the weight instead.
+       Ties are broken alphabetically on the LAD code, matching pd.Series.mode()[0].
+       Returns a dataframe indexed by level with columns lad_col and share (the modal LAD's share).'''
+    df = pd.DataFrame({level: extract_postcode_parts(pcode_lookup['pcds'])[level],
+                       lad_col: pcode_lookup[lad_col]})
+    if weights is None:
+        df['weight'] = 1.0
+    elif isinstance(weights, str):
+        df['weight'] = pcode_lookup[weights].to_numpy()
+    else:
+        df['weight'] = pd.Series(weights).to_numpy()
+    # drop postcodes with no sector or no LAD (e.g. blank postcode districts and non-geographic postcodes)
+    df = df.dropna(subset=[level, lad_col])
+    df = df[df[lad_col].str.len() > 0]
+
+    # total weight by (area, LAD), then keep the largest LAD in each area
+    counts = df.groupby([level, lad_col], sort=False)['weight'].sum().reset_index()
+    counts['share'] = counts['weight'] / counts.groupby(level)['weight'].transform('sum')
+    counts = counts.sort_values(['weight', lad_col], ascending=[False, True]).drop_duplicates(subset=level)
+    return counts.set_index(level).sort_index().loc[:, [lad_col, 'share']]
+
+
+def load_postcode_to_lad(pcode_filepath, level='sector', cache_filepath=None, lad_col='ladcd', weights=None, rebuild=False):
+    '''Load the postcode (sector/district) to LAD lookup from a CSV cache, rebuilding it from the
+       full postcode lookup CSV if the cache is missing or older than the source.
+       weights is passed to build_postcode_to_lad, and must be a column name in the source file.'''
+    if cache_filepath is None:
+        suffix = '' if weights is None else '_{}_weighted'.format(weights)
+        cache_filepath = os.path.join(os.path.dirname(pcode_filepath), '{}_to_lad{}.csv'.format(level, suffix))
+    if not rebuild and os.path.isfile(cache_filepath) \
+            and os.path.getmtime(cache_filepath) >= os.path.getmtime(pcode_filepath):
+        return pd.read_csv(cache_filepath, index_col=0)
+
+    print('Building postcode {} to LAD lookup'.format(level))
+    usecols = ['pcds', lad_col] + ([weights] if isinstance(weights, str) else [])
+    pcode_lookup = pd.read_csv(pcode_filepath, usecols=usecols, encoding='unicode_escape')
+    lookup = build_postcode_to_lad(pcode_lookup, level=level, lad_col=lad_col, weights=weights)
+    lookup.to_csv(cache_filepath)
+    return lookup
@@ -0,0 +1,180 @@
+# Reading the tables back. get() is the one call consumers need, e.g.
+#     get('population_lad', years=[2019, 2020], geos=['E08000025'], columns=['lad21cd', 'year', 'population'])
+# The year, geography and other filters and the column list become the WHERE clause and SELECT
+# list, so only the rows and columns asked for leave the database (rather than
+# 'select * from population_lad' and filtering in pandas). Results are fetched through a
+# server-side cursor in batches, so a big result isn't buffered twice.
+#
+# Each result is cached locally as Parquet, keyed by the query and the table's version: the
+# latest completed load_batches entry for the table (and, for a derived table, the tables it's
+# built from) and the table's oid, which changes when a staged refresh is published. Repeated
+# reads are served from the file, and the first read after a new load goes back to the database.
+
+import os
+import re
+import json
+import hashlib
+import pandas as pd
+import psycopg2
+from utils.db_config import config
+from utils.load_manifest import MANIFEST_TABLE
+from utils.geography_dimension import GEOGRAPHY_TABLE, CODE_COLUMN_PATTERN
+from utils.derived_metrics import DERIVED_TABLES
+
+CACHE_FOLDER = os.path.join('input_data', 'read_cache')
+DB_CONFIG = 'geoproj_aws_db.ini'
+FETCH_SIZE = 50000
+
+# id columns from the geography dimension, e.g. lad21_id, geog_id, itl_id
+ID_COLUMN_PATTERN = re.compile(r'^([a-z]+?[0-9]?[0-9]{2}|geog|itl)_id$')
+
+
+def table_columns(con, table):
+    '''The columns of a table or view, wherever it is on the search_path, in order.'''
+    cur = con.cursor()
+    cur.execute("""SELECT a.attname FROM pg_attribute a
+                   WHERE a.attrelid = to_regclass(%s) AND a.attnum > 0 AND NOT a.attisdropped
+                   ORDER BY a.attnum""", (table,))
+    out = [x[0] for x in cur.fetchall()]
+    cur.close()
+    if not out:
+        raise ValueError('No such table: {}'.format(table))
+    return out
+
+
+def geography_column(columns):
+    '''The column to filter geographies on: the first code column (e.g. lad21cd), or failing
+       that the first geography id column (e.g. lad21_id).'''
+    for col in columns:
+        if CODE_COLUMN_PATTERN.match(col) or col in ('geog_code', 'itl_code'):
+            return col
+    for col in columns:
+        if ID_COLUMN_PATTERN.match(col):
+            return col
+    raise ValueError('No geography column among {}'.format(', '.join(columns)))
+
+
+def source_tables(table):
+    '''The tables whose loads change a table: itself, plus the source and denominator tables of a
+       derived table. A _named view counts as its table.'''
+    table = re.sub('_named$', '', table)
+    out = [table]
+    if table in DERIVED_TABLES:
+        spec = DERIVED_TABLES[table]
+        out += [spec['source']] + [x[0] for x in spec['denominators']]
+    return out
+
+
+def table_version(con, table):
+    '''A dict identifying the current contents of a table (see the notes at the top).'''
+    cur = con.cursor()
+    cur.execute('SELECT to_regclass(%s)::oid', (table,))
+    version = {'oid': cur.fetchone()[0]}
+    for source in source_tables(table):
+        cur.execute("""SELECT max(batch_id) FROM {} WHERE status = 'complete'
+                       AND row_counts ? %s""".format(MANIFEST_TABLE), (source,))
+        version[source] = cur.fetchone()[0]
+    cur.close()
+    return version
+
+
+def select_sql(con, table, years=None, geos=None, columns=None, filters=None, geo_col=None):
+    '''The SELECT statement and parameters for a get() call.'''
+    available = table_columns(con, table)
+    columns = available if columns is None else list(columns)
+    missing = [x for x in columns + list(filters or {}) if x not in available]
+    if missing:
+        raise ValueError('{} has no column(s) {}'.format(table, ', '.join(missing)))
+    conditions, params = [], []
+    if years is not None:
+        conditions.append('year = ANY(%s)')
+        params.append([int(x) for x in years])
+    if geos is not None:
+        geo_col = geo_col or geography_column(available)
+        if ID_COLUMN_PATTERN.match(geo_col):
+            # the table holds geography ids, so match the codes in the geography dimension
+            conditions.append('{} IN (SELECT geo_id FROM {} WHERE code = ANY(%s))'.format(geo_col, GEOGRAPHY_TABLE))
+        else:
+            conditions.append('{} = ANY(%s)'.format(geo_col))
+        params.append([str(x) for x in geos])
+    for col, values in (filters or {}).items():
+        conditions.append('{} = ANY(%s)'.format(col))
+        params.append(list(values))
+    sql = 'SELECT {} FROM {}'.format(', '.join(columns), table)
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    return sql, params
+
+
+def fetch(con, sql, params, fetch_size=FETCH_SIZE):
+    '''Run a query through a server-side cursor, fetch_size rows at a time.'''
+    cur = con.cursor(name='read_api_fetch')
+    cur.itersize = fetch_size
+    chunks = []
+    try:
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            columns = [x[0] for x in cur.description]
+            if not rows:
+                break
+            chunks.append(pd.DataFrame(rows, columns=columns))
+        cur.close()
+        con.commit()
+    except (Exception, psycopg2.DatabaseError):
+        con.rollback()
+        raise
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _hash(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def get(table, years=None, geos=None, columns=None, filters=None, geo_col=None, con=None, params=None,
+        cache=True, cache_folder=CACHE_FOLDER):
+    '''Read (part of) a table into a dataframe.
+         years   - the years to keep
+         geos    - the geography codes to keep, matched against geo_col (by default the table's
+                   first code or geography id column)
+         columns - the columns to return (all of them by default)
+         filters - other {column: list of values} to keep
+       Pass an open connection as con, or connection params (by default read from the usual
+       config file). With cache=False the local cache is neither read nor written.'''
+    own_connection = con is None
+    if own_connection:
+        con = psycopg2.connect(**(params or config(filename=DB_CONFIG)))
+    try:
+        sql, sql_params = select_sql(con, table, years=years, geos=geos, columns=columns, filters=filters, geo_col=geo_col)
+        if not cache:
+            return fetch(con, sql, sql_params)
+        # <version>_<query>.parquet, so a new version can clear out the files of the old ones
+        folder = os.path.join(cache_folder, table)
+        version = _hash(table_version(con, table))
+        filepath = os.path.join(folder, '{}_{}.parquet'.format(version, _hash([sql, sql_params])))
+        if os.path.isfile(filepath):
+            return pd.read_parquet(filepath)
+        df = fetch(con, sql, sql_params)
+    finally:
+        if own_connection:
+            con.close()
+    os.makedirs(folder, exist_ok=True)
+    for x in os.listdir(folder):
+        if not x.startswith(version):
+            os.remove(os.path.join(folder, x))
+    df.to_parquet(filepath + '.tmp', index=False)
+    os.replace(filepath + '.tmp', filepath)
+    return df
+
+
+def clear_cache(table=None, cache_folder=CACHE_FOLDER):
+    '''Delete the cached results for a table, or for every table.'''
+    folder = cache_folder if table is None else os.path.join(cache_folder, table)
+    if os.path.isdir(folder):
+        for root, dirs, files in os.walk(folder, topdown=False):
+            for x in files:
+                os.remove(os.path.join(root, x))
+            for x in dirs:
+                os.rmdir(os.path.join(root, x))
@@ -0,0 +1,64 @@
+# Wide to long in one pass. Most of the spreadsheets are wide (a column per year, or per
+# sub-sector and asset under a multi-row header), and pd.melt / stack make several full copies of
+# the frame (and stack needs the id columns moved into the index first). Here the value block is
+# taken as a single 2-d array and flattened row by row, the id columns are repeated and the column
+# labels tiled to match, so the long table is built directly. The dimension columns made from the
+# labels are categorical by default, as each label is repeated once per row of the wide frame.
+
+import numpy as np
+import pandas as pd
+
+
+def _dimension(labels, n_rows, categorical):
+    # one label per column, tiled down the rows of the wide frame
+    if categorical:
+        codes, uniques = pd.factorize(pd.Index(labels), use_na_sentinel=False)
+        return pd.Categorical.from_codes(np.tile(codes, n_rows), categories=uniques)
+    return np.tile(np.asarray(labels, dtype=object), n_rows)
+
+
+def block_to_long(ids, values, labels, value_name='value', categorical=True, dropna=False):
+    '''The core of wide_to_long.
+         ids    - a dataframe of the id columns, one row per row of values
+         values - a 2-d array (or dataframe) of the values, n rows by m columns
+         labels - a dataframe with one row per value column (m rows) and one column per dimension
+       Returns a long dataframe with the id columns, the dimension columns and value_name, in
+       row-major order (all the values of the first wide row first).'''
+    values = np.asarray(values)
+    n_rows, n_cols = values.shape
+    if len(ids) != n_rows or len(labels) != n_cols:
+        raise ValueError('ids have {} rows and labels {}, for a {} x {} block of values'.format(
+            len(ids), len(labels), n_rows, n_cols))
+    out = {}
+    for col in ids.columns:
+        # take on the column's array (rather than np.repeat on its values) keeps its dtype, e.g. a
+        # pyarrow string, categorical or nullable integer column, without a round trip through objects
+        out[col] = ids[col].array.take(np.repeat(np.arange(n_rows), n_cols))
+    for col in labels.columns:
+        out[col] = _dimension(labels[col].to_numpy(), n_rows, categorical)
+    out[value_name] = values.ravel()
+    long = pd.DataFrame(out)
+    if dropna:
+        long = long[long[value_name].notna()].reset_index(drop=True)
+    return long
+
+
+def wide_to_long(df, id_vars, var_name='variable', value_name='value', categorical=True, dropna=False, dtype=None):
+    '''Reshape a wide dataframe to long, like pd.melt, but in one pass (see the notes at the top).
+       The value columns are all the columns not in id_vars. If the columns are a MultiIndex (e.g. a
+       two-row header), each level becomes a dimension column: var_name is then a list of names,
+       one per level, and id_vars are the full column tuples (their output name is the last
+       non-empty level of each). dtype, if given, is the dtype of the value block, e.g. float.'''
+    id_vars = list(id_vars)
+    value_vars = [x for x in df.columns if x not in id_vars]
+    ids = df.loc[:, id_vars]
+    if isinstance(df.columns, pd.MultiIndex):
+        ids.columns = [[y for y in x if str(y) and not str(y).startswith('Unnamed:')][-1] for x in id_vars]
+        names = list(var_name) if not isinstance(var_name, str) else \
+            ['{}_{}'.format(var_name, i) for i in range(df.columns.nlevels)]
+        labels = pd.DataFrame(list(value_vars), columns=names)
+    else:
+        labels = pd.DataFrame({var_name: value_vars})
+    values = df.loc[:, value_vars].to_numpy(dtype=dtype)
+    return block_to_long(ids.reset_index(drop=True), values, labels, value_name=value_name,
+                         categorical=categorical, dropna=dropna)
@@ -0,0 +1,201 @@
+# Generate Postgres DDL from a dataframe, using the narrowest sensible type for each column,
+# instead of making every column VARCHAR (or FLOAT/BIGINT) by hand.
+#   - integers get SMALLINT/INTEGER/BIGINT depending on their range (years are always SMALLINT)
+#   - floats get REAL if no value has more than 6 significant figures, otherwise DOUBLE PRECISION
+#   - GSS codes (e.g. E06000001) get CHAR(9)
+#   - low-cardinality strings (e.g. country names) get an enum type
+# It can also compare a dataframe with an existing table and emit the ALTER statements needed
+# to migrate it.
+
+import numpy as np
+import pandas as pd
+
+GSS_CODE_PATTERN = r'^[EJKLMNSW][0-9]{8}$'
+YEAR_COLUMNS = ['year']
+INT_RANGES = [('SMALLINT', -32768, 32767), ('INTEGER', -2147483648, 2147483647)]
+
+
+def _is_integral(values):
+    values = values[~np.isnan(values)]
+    return len(values) > 0 and np.array_equal(values, np.round(values))
+
+
+def _fits_real(values, sig_figs=6):
+    '''True if every value survives rounding to sig_figs significant figures, i.e. it can be
+       stored as a 4-byte REAL without losing anything that was in the source data.'''
+    values = values[np.isfinite(values) & (values != 0)]
+    if len(values) == 0:
+        return True
+    scale = 10.0 ** (np.floor(np.log10(np.abs(values))) - (sig_figs - 1))
+    return np.allclose(np.round(values / scale) * scale, values, rtol=1e-12, atol=0)
+
+
+def _integer_type(values, name):
+    if name in YEAR_COLUMNS:
+        return 'SMALLINT'
+    values = values[~np.isnan(values)] if values.dtype.kind == 'f' else values
+    if len(values) == 0:
+        return 'SMALLINT'
+    low, high = values.min(), values.max()
+    for sql_type, type_low, type_high in INT_RANGES:
+        if low >= type_low and high <= type_high:
+            return sql_type
+    return 'BIGINT'
+
+
+def infer_column_type(series, table=None, enum_max_levels=32, enum_max_share=0.05):
+    '''Return (sql type, enum labels or None) for a single column.'''
+    name = series.name
+    s = series.dropna()
+    if pd.api.types.is_bool_dtype(series):
+        return 'BOOLEAN', None
+    if pd.api.types.is_integer_dtype(series):
+        return _integer_type(s.to_numpy(dtype='int64'), name), None
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(dtype=float)
+        if _is_integral(values):
+            return _integer_type(values, name), None
+        return ('REAL' if _fits_real(values) else 'DOUBLE PRECISION'), None
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return ('TIMESTAMPTZ' if getattr(series.dt, 'tz', None) is not None else 'TIMESTAMP'), None
+    if len(s) == 0:
+        return 'VARCHAR', None
+    if s.map(lambda x: isinstance(x, (list, tuple))).all():
+        return 'VARCHAR[]', None
+    if not s.map(lambda x: isinstance(x, str)).all():
+        return 'VARCHAR', None
+    if s.str.match(GSS_CODE_PATTERN).all():
+        return 'CHAR(9)', None
+    levels = s.unique()
+    if table is not None and len(levels) <= enum_max_levels and len(levels) <= enum_max_share * len(series):
+        return '{}_{}'.format(table, name), sorted(levels)
+    return 'VARCHAR', None
+
+
+def infer_schema(df, table=None, enum_max_levels=32, enum_max_share=0.05, overrides=None):
+    '''Infer a Postgres type for every column of df.
+       Returns (columns, enums): columns maps column name to type, and enums maps any enum type
+       names to their labels. Enums are only used when table is given (it prefixes the type name).
+       overrides is a dict of column: type to skip the inference for some columns.'''
+    overrides = overrides or {}
+    columns = {}
+    enums = {}
+    for col in df.columns:
+        if col in overrides:
+            columns[col] = overrides[col]
+            continue
+        sql_type, labels = infer_column_type(df[col], table=table, enum_max_levels=enum_max_levels,
+                                             enum_max_share=enum_max_share)
+        columns[col] = sql_type
+        if labels is not None:
+            enums[sql_type] = labels
+    return columns, enums
+
+
+def _quote(label):
+    return "'{}'".format(str(label).replace("'", "''"))
+
+
+def create_enum_sql(type_name, labels):
+    # CREATE TYPE has no IF NOT EXISTS, so ignore the error if it's already there
+    return """DO $$ BEGIN
+                CREATE TYPE {} AS ENUM ({});
+                EXCEPTION WHEN duplicate_object THEN NULL;
+                END $$;""".format(type_name, ', '.join([_quote(x) for x in labels]))
+
+
+def create_table_sql(df, table, primary_key=None, extra_columns=None, partition_by=None, **kwargs):
+    '''DDL to create a table (and any enum types) for df. extra_columns is a list of column
+       definitions to append, e.g. ['batch_id INT']. partition_by is a column to partition the
+       table by list on (see utils/partitions.py).'''
+    columns, enums = infer_schema(df, table=table, **kwargs)
+    column_sql = ['{} {}'.format(col, sql_type) for col, sql_type in columns.items()] + list(extra_columns or [])
+    if primary_key:
+        column_sql.append('PRIMARY KEY ({})'.format(', '.join(primary_key)))
+    statements = [create_enum_sql(type_name, labels) for type_name, labels in enums.items()]
+    statements.append('CREATE TABLE IF NOT EXISTS {} (\n                {}\n                ){};'.format(
+        table, ',\n                '.join(column_sql), '' if partition_by is None else ' PARTITION BY LIST ({})'.format(partition_by)))
+    return '\n'.join(statements)
+
+
+def qualified(con, table):
+    '''Qualify a table name with the current schema (the first schema on the search_path).
+       Tables are looked up there only, not along the whole search_path, so during a staged
+       refresh (see utils/schema_swap.py) a table that only exists in the live schema counts as
+       missing and is created in the staging schema, rather than altered in place.'''
+    if '.' in table:
+        return table
+    cur = con.cursor()
+    cur.execute('SELECT current_schema()')
+    schema = cur.fetchone()[0]
+    cur.close()
+    return '{}.{}'.format(schema, table)
+
+
+def existing_columns(con, table):
+    '''The columns of an existing table, as {column: type}. Empty if the table doesn't exist.'''
+    cur = con.cursor()
+    cur.execute("""SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+                   FROM pg_attribute a
+                   WHERE a.attrelid = to_regclass(%s) AND a.attnum > 0 AND NOT a.attisdropped
+                   ORDER BY a.attnum""", (qualified(con, table),))
+    out = dict(cur.fetchall())
+    cur.close()
+    return out
+
+
+def enum_labels(con, type_name):
+    cur = con.cursor()
+    cur.execute("""SELECT e.enumlabel FROM pg_enum e JOIN pg_type t ON t.oid = e.enumtypid
+                   WHERE t.typname = %s ORDER BY e.enumsortorder""", (type_name,))
+    out = [x[0] for x in cur.fetchall()]
+    cur.close()
+    return out
+
+
+# how format_type() spells the types we generate
+TYPE_ALIASES = {'SMALLINT': 'smallint', 'INTEGER': 'integer', 'BIGINT': 'bigint', 'REAL': 'real',
+                'DOUBLE PRECISION': 'double precision', 'BOOLEAN': 'boolean', 'VARCHAR': 'character varying',
+                'VARCHAR[]': 'character varying[]', 'CHAR(9)': 'character(9)', 'TIMESTAMP': 'timestamp without time zone',
+                'TIMESTAMPTZ': 'timestamp with time zone'}
+
+
+def migration_sql(con, df, table, primary_key=None, extra_columns=None, partition_by=None, **kwargs):
+    '''Statements to bring an existing table in line with the schema inferred from df: new enum
+       types and labels, new columns and narrower (or wider) column types. If the table doesn't
+       exist yet, this is just its CREATE TABLE statement.'''
+    current = existing_columns(con, table)
+    if not current:
+        return [create_table_sql(df, table, primary_key=primary_key, extra_columns=extra_columns,
+                                 partition_by=partition_by, **kwargs)]
+    columns, enums = infer_schema(df, table=table, **kwargs)
+    statements = []
+    for type_name, labels in enums.items():
+        known = enum_labels(con, type_name)
+        if not known:
+            statements.append(create_enum_sql(type_name, labels))
+            continue
+        for label in labels:
+            if label not in known:
+                statements.append('ALTER TYPE {} ADD VALUE IF NOT EXISTS {};'.format(type_name, _quote(label)))
+    for col, sql_type in columns.items():
+        if col not in current:
+            statements.append('ALTER TABLE {} ADD COLUMN {} {};'.format(table, col, sql_type))
+        elif current[col] != TYPE_ALIASES.get(sql_type, sql_type.lower()):
+            # cast through text, which works between any of the types we generate
+            statements.append('ALTER TABLE {} ALTER COLUMN {} TYPE {} USING {}::text::{};'.format(
+                table, col, sql_type, col, sql_type))
+    return statements
+
+
+def apply_schema(con, df, table, primary_key=None, extra_columns=None, partition_by=None, **kwargs):
+    '''Create the table for df, or migrate an existing one to the inferred types.'''
+    statements = migration_sql(con, df, table, primary_key=primary_key, extra_columns=extra_columns,
+                               partition_by=partition_by, **kwargs)
+    cur = con.cursor()
+    for statement in statements:
+        print(statement)
+        cur.execute(statement)
+        # commit each statement, as new enum labels can't be used in the transaction that adds them
+        con.commit()
+    cur.close()
@@ -0,0 +1,149 @@
+# Staged full refreshes. Analysts query the database while the uploads run, so a refresh can
+# build everything in a staging schema instead of the live (public) one:
+#   1. start_refresh creates an empty staging schema, and staged_params/staged_engine give
+#      connections whose search_path puts it ahead of public. Every CREATE TABLE, load and
+#      partition then lands in staging, while reads of tables that haven't been rebuilt (and
+#      the load_batches and geographies tables, which always live in public) fall through to
+#      the live schema.
+#   2. validate_staging checks the staged tables: none are empty or much smaller than the live
+#      table they replace, and every primary key on a live table exists on its replacement.
+#   3. publish_refresh moves the live versions of the rebuilt tables (and views and enum types)
+#      into a previous schema and the staged ones into public, in one transaction. Readers see
+#      the old tables or the new ones, never a half-loaded mix. The previous schema is kept
+#      until the next refresh, in case the new data needs rolling back.
+# NB views on a rebuilt table that aren't rebuilt themselves go with the old table, so a run
+# should recreate its views (as the uploaders do for the _named views).
+
+import time
+import psycopg2
+
+LIVE_SCHEMA = 'public'
+STAGING_SCHEMA = 'refresh_staging'
+PREVIOUS_SCHEMA = 'refresh_previous'
+
+
+def staged_params(params):
+    '''Connection parameters (from utils.db_config.config) that build into the staging schema.'''
+    out = dict(params)
+    out['options'] = '-c search_path={},{}'.format(STAGING_SCHEMA, LIVE_SCHEMA)
+    return out
+
+
+def staged_engine(params):
+    '''An sqlalchemy engine for the staging schema, for to_sql and read_sql.'''
+    from sqlalchemy import create_engine
+    return create_engine('postgresql://{}:{}@{}:{}/{}'.format(params['user'], params['password'], params['host'], params['port'], params['database']),
+                         connect_args={'options': staged_params(params)['options']})
+
+
+def start_refresh(con):
+    '''Create an empty staging schema, dropping whatever a failed or unpublished run left there.'''
+    cur = con.cursor()
+    cur.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(STAGING_SCHEMA))
+    cur.execute('CREATE SCHEMA {}'.format(STAGING_SCHEMA))
+    cur.close()
+    con.commit()
+
+
+def _staged_tables(cur):
+    # the top-level tables in staging (partitions are checked via their parent)
+    cur.execute("""SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                   WHERE n.nspname = %s AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+                   ORDER BY c.relname""", (STAGING_SCHEMA,))
+    return [x[0] for x in cur.fetchall()]
+
+
+def _primary_key(cur, schema, table):
+    cur.execute("""SELECT pg_get_constraintdef(oid) FROM pg_constraint
+                   WHERE conrelid = to_regclass(%s) AND contype = 'p'""", ('{}.{}'.format(schema, table),))
+    row = cur.fetchone()
+    return None if row is None else row[0]
+
+
+def validate_staging(con, min_ratio=0.9):
+    '''Check the staged tables before they're published. Returns a list of problems (empty if
+       everything looks right): a staged table is empty, or has fewer than min_ratio times the
+       rows of the live table, or is missing the live table's primary key.'''
+    problems = []
+    cur = con.cursor()
+    for table in _staged_tables(cur):
+        cur.execute('SELECT count(*) FROM {}.{}'.format(STAGING_SCHEMA, table))
+        staged_rows = cur.fetchone()[0]
+        if staged_rows == 0:
+            problems.append('{} is empty'.format(table))
+        cur.execute('SELECT to_regclass(%s)', ('{}.{}'.format(LIVE_SCHEMA, table),))
+        if cur.fetchone()[0] is None:
+            continue
+        cur.execute('SELECT count(*) FROM {}.{}'.format(LIVE_SCHEMA, table))
+        live_rows = cur.fetchone()[0]
+        if staged_rows < min_ratio * live_rows:
+            problems.append('{} has {} rows, down from {}'.format(table, staged_rows, live_rows))
+        live_key = _primary_key(cur, LIVE_SCHEMA, table)
+        if live_key is not None and _primary_key(cur, STAGING_SCHEMA, table) != live_key:
+            problems.append('{} is missing its primary key {}'.format(table, live_key))
+    cur.close()
+    con.commit()
+    return problems
+
+
+def _swap(cur):
+    # every relation and enum type in staging, replacing anything of the same name in live.
+    # Indexes, and sequences owned by a column, move with their tables
+    cur.execute("""SELECT c.relname, CASE c.relkind WHEN 'v' THEN 'VIEW' WHEN 'm' THEN 'MATERIALIZED VIEW'
+                                                 WHEN 'S' THEN 'SEQUENCE' ELSE 'TABLE' END
+                   FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                   WHERE n.nspname = %s AND c.relkind IN ('r', 'p', 'v', 'm', 'S')
+                   AND (c.relkind <> 'S' OR NOT EXISTS (SELECT 1 FROM pg_depend d WHERE d.objid = c.oid
+                                                        AND d.classid = 'pg_class'::regclass AND d.deptype = 'a'))
+                   """, (STAGING_SCHEMA,))
+    objects = cur.fetchall()
+    cur.execute("""SELECT t.typname, 'TYPE' FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace
+                   WHERE n.nspname = %s AND t.typtype = 'e'""", (STAGING_SCHEMA,))
+    objects += cur.fetchall()
+    for name, kind in objects:
+        if kind == 'TYPE':
+            cur.execute('SELECT to_regtype(%s)', ('{}.{}'.format(LIVE_SCHEMA, name),))
+        else:
+            cur.execute('SELECT to_regclass(%s)', ('{}.{}'.format(LIVE_SCHEMA, name),))
+        if cur.fetchone()[0] is not None:
+            cur.execute('ALTER {} {}.{} SET SCHEMA {}'.format(kind, LIVE_SCHEMA, name, PREVIOUS_SCHEMA))
+        cur.execute('ALTER {} {}.{} SET SCHEMA {}'.format(kind, STAGING_SCHEMA, name, LIVE_SCHEMA))
+    return [name for name, kind in objects]
+
+
+def publish_refresh(con, min_ratio=0.9, lock_timeout='5s', retries=5):
+    '''Validate the staging schema and swap it in. The swap needs a brief exclusive lock on
+       each live table, so it gives up after lock_timeout (rather than queueing behind a long
+       query and blocking every other reader meanwhile) and tries again, up to retries times.
+       Returns 1 if nothing was published.'''
+    problems = validate_staging(con, min_ratio=min_ratio)
+    if problems:
+        print('Not publishing the refresh:\n  ' + '\n  '.join(problems))
+        return 1
+    cur = con.cursor()
+    cur.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(PREVIOUS_SCHEMA))
+    cur.execute('CREATE SCHEMA {}'.format(PREVIOUS_SCHEMA))
+    con.commit()
+    for attempt in range(retries):
+        try:
+            cur.execute("SET LOCAL lock_timeout = '{}'".format(lock_timeout))
+            published = _swap(cur)
+            con.commit()
+            break
+        except psycopg2.errors.LockNotAvailable:
+            con.rollback()
+            print('Tables are busy, retrying the swap ({}/{})'.format(attempt + 1, retries))
+            time.sleep(2 ** attempt)
+        except (Exception, psycopg2.DatabaseError) as error:
+            print('Error publishing the refresh: {}'.format(error))
+            con.rollback()
+            cur.close()
+            return 1
+    else:
+        print('Could not get the locks to publish the refresh')
+        cur.close()
+        return 1
+    cur.execute('DROP SCHEMA {}'.format(STAGING_SCHEMA))
+    con.commit()
+    cur.close()
+    print('Published {} objects from {}'.format(len(published), STAGING_SCHEMA))
@@ -0,0 +1,146 @@
+# An offline snapshot of the database, for analysis without a round trip to the server.
+# Every table in the live schema (including the lookups, the geographies and the load_batches
+# manifest) and every _named view is written to a Hive-partitioned Parquet directory:
+#   <folder>/<table>/year=<year>/data.parquet   - tables (and views) with a year column
+#   <folder>/<table>/data.parquet               - everything else
+#   <folder>/snapshot.json                      - the fingerprint of each file written
+# which pandas, pyarrow and DuckDB all read directly (e.g. read_parquet('<folder>/population_lad')).
+#
+# Each partition's fingerprint is its row count, the latest batch_id in it (see
+# utils/load_manifest.py), the partition's oid (a reloaded year is swapped in as a new table) and,
+# for a derived table, the latest batches of the tables it's built from. A later snapshot into the
+# same folder only rewrites the partitions whose fingerprint has changed, and removes the ones
+# that have gone.
+#
+# export_duckdb then copies the snapshot into a single DuckDB file, again only for the tables
+# that changed. duckdb is optional and only imported there.
+
+import os
+import re
+import json
+import shutil
+from utils.schema_swap import LIVE_SCHEMA
+from utils.partitions import PARTITION_COLUMN, list_partitions
+from utils.read_api import table_columns, table_version, fetch
+
+SNAPSHOT_MANIFEST = 'snapshot.json'
+
+
+def snapshot_relations(con, schema=LIVE_SCHEMA):
+    '''The tables (not partitions) and _named views in a schema.'''
+    cur = con.cursor()
+    cur.execute("""SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                   WHERE n.nspname = %s AND ((c.relkind IN ('r', 'p') AND NOT c.relispartition)
+                                             OR (c.relkind = 'v' AND c.relname LIKE '%%\\_named'))
+                   ORDER BY c.relname""", (schema,))
+    out = [x[0] for x in cur.fetchall()]
+    cur.close()
+    return out
+
+
+def fingerprints(con, table):
+    '''{partition: fingerprint} for a table, where the partition is 'year=<year>' or '' for a
+       table without a year column.'''
+    columns = table_columns(con, table)
+    # a derived table has no batch_id, so it changes with the tables it's built from
+    sources = {k: v for k, v in table_version(con, table).items() if k not in ('oid', table, re.sub('_named$', '', table))}
+    latest_batch = 'max(batch_id)' if 'batch_id' in columns else 'NULL'
+    cur = con.cursor()
+    if PARTITION_COLUMN in columns:
+        cur.execute('SELECT {}, count(*), {} FROM {} GROUP BY 1'.format(PARTITION_COLUMN, latest_batch, table))
+        rows = cur.fetchall()
+        cur.execute("""SELECT c.relname, c.oid FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                       WHERE i.inhparent = to_regclass(%s)""", (table,))
+        oids = dict(cur.fetchall())
+        partitions = list_partitions(con, table)
+        out = {}
+        for year, count, batch in rows:
+            if year is None:
+                continue
+            out['{}={}'.format(PARTITION_COLUMN, year)] = [count, batch, oids.get(partitions.get(year)), sources]
+    else:
+        cur.execute('SELECT count(*), {}, to_regclass(%s)::oid FROM {}'.format(latest_batch, table), (table,))
+        count, batch, oid = cur.fetchone()
+        out = {'': [count, batch, oid, sources]}
+    cur.close()
+    # via json, so they compare equal to the ones read back from snapshot.json
+    return json.loads(json.dumps(out, default=str))
+
+
+def read_manifest(folder):
+    filepath = os.path.join(folder, SNAPSHOT_MANIFEST)
+    if os.path.isfile(filepath):
+        with open(filepath, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def write_manifest(folder, manifest):
+    filepath = os.path.join(folder, SNAPSHOT_MANIFEST)
+    with open(filepath + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(filepath + '.tmp', filepath)
+
+
+def _write_partition(con, table, partition, filepath):
+    if partition:
+        year = int(partition.split('=')[1])
+        df = fetch(con, 'SELECT * FROM {} WHERE {} = %s'.format(table, PARTITION_COLUMN), [year])
+        # the year is in the directory name, as Hive partitioning expects
+        df = df.drop(PARTITION_COLUMN, axis=1)
+    else:
+        df = fetch(con, 'SELECT * FROM {}'.format(table), [])
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    df.to_parquet(filepath + '.tmp', index=False)
+    os.replace(filepath + '.tmp', filepath)
+
+
+def export_snapshot(con, folder, tables=None, schema=LIVE_SCHEMA):
+    '''Write (or bring up to date) a Parquet snapshot of the given tables, by default every table
+       and _named view in the schema. Returns {table: [partitions written or removed]}.'''
+    os.makedirs(folder, exist_ok=True)
+    manifest = read_manifest(folder)
+    written = {}
+    for table in tables or snapshot_relations(con, schema=schema):
+        current = fingerprints(con, table)
+        previous = manifest.get(table, {})
+        table_folder = os.path.join(folder, table)
+        # a table that's gained or lost its year column is rewritten from scratch
+        if set(previous) and ('' in previous) != ('' in current):
+            shutil.rmtree(table_folder, ignore_errors=True)
+            previous = {}
+        removed = sorted(set(previous) - set(current))
+        for partition in removed:
+            shutil.rmtree(os.path.join(table_folder, partition), ignore_errors=True)
+        changed = sorted(x for x in current if previous.get(x) != current[x])
+        for partition in changed:
+            _write_partition(con, table, partition, os.path.join(table_folder, partition, 'data.parquet'))
+        manifest[table] = current
+        # record progress as it goes, so an interrupted export picks up where it stopped
+        write_manifest(folder, manifest)
+        if changed or removed:
+            print('Snapshot of {}: wrote {} of {} partitions, removed {}'.format(table, len(changed), len(current), len(removed)))
+        written[table] = changed + removed
+    return written
+
+
+def export_duckdb(folder, duckdb_path, written=None):
+    '''Copy a Parquet snapshot into a DuckDB file, one table per snapshot table. written is the
+       output of export_snapshot: only those tables with changes are recreated (every table if
+       None).'''
+    import duckdb
+    manifest = read_manifest(folder)
+    db = duckdb.connect(duckdb_path)
+    try:
+        for table, partitions in manifest.items():
+            if written is not None and not written.get(table):
+                continue
+            if not partitions:
+                db.execute('DROP TABLE IF EXISTS "{}"'.format(table))
+                continue
+            hive = '' not in partitions
+            path = os.path.join(folder, table, '*', 'data.parquet') if hive else os.path.join(folder, table, 'data.parquet')
+            db.execute('CREATE OR REPLACE TABLE "{}" AS SELECT * FROM read_parquet(?, hive_partitioning = {})'.format(
+                table, 'true' if hive else 'false'), [path])
+    finally:
+        db.close()
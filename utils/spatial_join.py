@@ -0,0 +1,128 @@
+# Assign features (e.g. the ~400k listed building polygons) to the areas they're in (e.g. LADs),
+# one area per feature, without a full polygon-on-polygon sjoin against full resolution boundaries:
+#   - each feature's representative point (shapely.point_on_surface, always inside the feature) is
+#     looked up in an STRtree of the areas, a cheap point-in-polygon test
+#   - only the features that cross an area boundary (found with a second STRtree, of the area
+#     boundaries) get the exact polygon intersection, and go to the area they overlap most
+# The features are done in chunks over a process pool, each worker building the trees once.
+#
+# The assignment is cached as Parquet, keyed by hashes of both input files (and the area columns),
+# so it's only recomputed when either file changes. It's stored with each feature's id and joined
+# back on it, so it doesn't depend on the order the features are read in.
+
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNKSIZE = 20000
+# the column the feature ids are stored in, in the cached assignment
+FEATURE_ID = 'feature_id'
+SHAPEFILE_PARTS = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
+
+# the areas and their trees, set once in each worker process by _init_worker
+_areas = None
+_area_tree = None
+_boundary_tree = None
+
+
+def file_hash(filepath):
+    '''A hash of a file's contents. For a shapefile this covers its .shx, .dbf etc. too.'''
+    stem, ext = os.path.splitext(filepath)
+    parts = [stem + x for x in SHAPEFILE_PARTS] if ext.lower() == '.shp' else [filepath]
+    h = hashlib.sha256()
+    for part in parts:
+        if os.path.isfile(part):
+            with open(part, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+    return h.hexdigest()
+
+
+def _init_worker(areas):
+    global _areas, _area_tree, _boundary_tree
+    _areas = areas
+    shapely.prepare(_areas)
+    _area_tree = STRtree(_areas)
+    _boundary_tree = STRtree(shapely.boundary(_areas))
+
+
+def assign_chunk(geoms):
+    '''The position in the areas of the area each geometry is in, or -1 if it's in none.'''
+    out = np.full(len(geoms), -1, dtype=np.int64)
+    # the area each representative point falls in
+    points = shapely.point_on_surface(geoms)
+    feature, area = _area_tree.query(points, predicate='within')
+    out[feature] = area
+    # features that cross an area boundary go to the area they overlap most
+    crossing = np.unique(_boundary_tree.query(geoms, predicate='intersects')[0])
+    if len(crossing):
+        # (made valid first, as a self-intersecting feature can't be intersected)
+        near = shapely.make_valid(geoms[crossing])
+        feature, area = _area_tree.query(near, predicate='intersects')
+        overlap = shapely.area(shapely.intersection(near[feature], _areas[area]))
+        # the largest overlap first within each feature, then the first row of each feature
+        order = np.lexsort((-overlap, feature))
+        first = order[np.r_[True, feature[order][1:] != feature[order][:-1]]]
+        out[crossing[feature[first]]] = area[first]
+    return out
+
+
+def assign_to_areas(features, areas, area_columns, chunksize=CHUNKSIZE, max_workers=None):
+    '''Assign each feature of a GeoDataFrame to one of the areas of another (in the same CRS).
+       Returns a dataframe with the same index as features and area_columns from areas (NaN
+       for features outside every area).'''
+    if features.crs != areas.crs:
+        raise ValueError('features and areas are in different CRSs ({} and {})'.format(features.crs, areas.crs))
+    geoms = features.geometry.to_numpy()
+    area_geoms = areas.geometry.to_numpy()
+    chunks = [geoms[i:i + chunksize] for i in range(0, len(geoms), chunksize)]
+    if max_workers == 1 or len(chunks) <= 1:
+        _init_worker(area_geoms)
+        positions = [assign_chunk(x) for x in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(area_geoms,)) as executor:
+            positions = list(executor.map(assign_chunk, chunks))
+    positions = np.concatenate(positions) if positions else np.array([], dtype=np.int64)
+    # a row of NaNs on the end of the area columns for the unassigned features
+    table = pd.concat([areas.loc[:, area_columns].reset_index(drop=True),
+                       pd.DataFrame(np.nan, index=[len(areas)], columns=area_columns)])
+    out = table.iloc[np.where(positions >= 0, positions, len(areas))]
+    out.index = features.index
+    return out
+
+
+def load_assignment(features, areas, features_filepath, areas_filepath, area_columns, id_column=None, cache_folder=None,
+                    rebuild=False, chunksize=CHUNKSIZE, max_workers=None):
+    '''assign_to_areas, cached as Parquet (by default next to the features file) and keyed by the
+       hashes of both input files, so it's only recomputed when one of them changes. The cache is
+       matched to the features by id_column (the features' index by default), which must be unique
+       and shouldn't depend on the order the features were read in.'''
+    ids = pd.Index(features.index if id_column is None else features[id_column])
+    if not ids.is_unique:
+        raise ValueError('{} has duplicates, so it can\'t match the features to their cached areas'.format(
+            id_column or 'The features\' index'))
+    key = hashlib.sha256('|'.join([file_hash(features_filepath), file_hash(areas_filepath), str(id_column)] + list(area_columns))
+                         .encode()).hexdigest()[:16]
+    cache_folder = cache_folder or os.path.dirname(features_filepath)
+    stem = os.path.splitext(os.path.basename(features_filepath))[0]
+    cache_filepath = os.path.join(cache_folder, '{}_areas_{}.parquet'.format(stem, key))
+    if not rebuild and os.path.isfile(cache_filepath):
+        out = pd.read_parquet(cache_filepath)
+        # (a cache from before the ids were stored, or missing some of the features, is redone)
+        if FEATURE_ID in out.columns and ids.isin(out[FEATURE_ID]).all():
+            out = out.set_index(FEATURE_ID).reindex(ids)
+            out.index = features.index
+            return out
+    print('Assigning {} features to areas'.format(len(features)))
+    out = assign_to_areas(features, areas, area_columns, chunksize=chunksize, max_workers=max_workers)
+    # clear out the assignments for earlier versions of the files
+    for x in os.listdir(cache_folder):
+        if x.startswith(stem + '_areas_') and x.endswith('.parquet'):
+            os.remove(os.path.join(cache_folder, x))
+    out.reset_index(drop=True).assign(**{FEATURE_ID: ids.to_numpy()}).to_parquet(cache_filepath + '.tmp', index=False)
+    os.replace(cache_filepath + '.tmp', cache_filepath)
+    return out
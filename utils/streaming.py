@@ -0,0 +1,77 @@
+# Stream large flat files into Postgres. The CSV is read in fixed-size chunks, each chunk gets
+# the (vectorised) column transforms, and is written straight into the table with COPY, so
+# peak memory depends on the chunk size rather than the size of the file.
+
+import io
+import pandas as pd
+import psycopg2
+from utils.ons_columns import extract_year
+from utils.na_markers import decode_frame
+
+CHUNKSIZE = 100000
+
+
+def iter_csv_chunks(source, transform=None, chunksize=CHUNKSIZE, **read_kwargs):
+    '''Read a CSV (a path or an open file, e.g. from ZipFile.open) in chunks, yielding each chunk
+       after transform (a function of a dataframe) has been applied.'''
+    with pd.read_csv(source, chunksize=chunksize, **read_kwargs) as reader:
+        for chunk in reader:
+            yield chunk if transform is None else transform(chunk)
+
+
+def chunk_transform(columns=None, rename=None, decode=None, assign=None, year_from=None):
+    '''Build a transform from the usual light tidying steps, applied in this order:
+         columns   - the columns to keep (before renaming)
+         rename    - a dict of old: new column names, or a function of a column name
+         decode    - value columns (after renaming) holding numbers and na markers, decoded to
+                     float64 each with a uint8 <column>_status column (see utils/na_markers.py;
+                     read them as strings with na_markers.string_dtypes)
+         assign    - a dict of new columns, each a constant or a function of the chunk
+         year_from - a column (after renaming) holding a period like '2019-20' or '2019/20',
+                     replaced by its (first) year as an integer'''
+    def transform(chunk):
+        if columns is not None:
+            chunk = chunk.loc[:, columns]
+        if rename is not None:
+            chunk = chunk.rename(columns=rename)
+        if decode is not None:
+            chunk = decode_frame(chunk, decode)
+        for col, value in (assign or {}).items():
+            chunk[col] = value(chunk) if callable(value) else value
+        if year_from is not None:
+            chunk[year_from] = extract_year(chunk[year_from])
+        return chunk
+    return transform
+
+
+def copy_chunks(chunks, table, con, create_table=None):
+    '''COPY an iterable of dataframes into a table, in one transaction.
+       create_table, if given, is called as create_table(con, first_chunk) before anything is
+       copied, e.g. to create the table with types inferred from the first chunk.
+       Returns the number of rows copied. Errors roll back the whole load and are re-raised.'''
+    cur = con.cursor()
+    rows = 0
+    try:
+        for chunk in chunks:
+            if rows == 0 and create_table is not None:
+                create_table(con, chunk)
+            buffer = io.StringIO()
+            chunk.to_csv(buffer, header=False, index=False)
+            buffer.seek(0)
+            cur.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(table, ', '.join(chunk.columns)), buffer)
+            rows += len(chunk)
+        con.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print('Error copying into {}: {}'.format(table, error))
+        con.rollback()
+        raise
+    finally:
+        cur.close()
+    print('Copied {} rows into {}'.format(rows, table))
+    return rows
+
+
+def stream_csv_to_table(source, table, con, transform=None, chunksize=CHUNKSIZE, create_table=None, **read_kwargs):
+    '''Read, transform and COPY a CSV into a table chunk by chunk. Returns the number of rows.'''
+    return copy_chunks(iter_csv_chunks(source, transform=transform, chunksize=chunksize, **read_kwargs),
+                       table, con, create_table=create_table)